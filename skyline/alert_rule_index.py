@@ -0,0 +1,133 @@
+"""
+alert_rule_index
+
+Precompiled matching of metric names against the ALERTS rules.
+
+A metric base_name matches an alert if it is the alert namespace, if the alert
+namespace as a regex matches the start of the base_name, or if the alert
+namespace is a substring of the base_name.  These are the same semantics as the
+original Analyzer loops, however rather than compiling the alert regex for
+every alert and metric in every loop, each alert is compiled once and the
+alerts that match each metric are kept in an index.  :meth:`AlertRuleIndex.update`
+only matches the metrics that have been added to the unique_metrics since the
+last update and drops the metrics that have been removed, so the alerts are
+only matched against all the metrics in the first run.
+
+The index is built in the Analyzer parent process before the spin processes
+are started, so the processes share it.
+"""
+
+import re
+
+
+class AlertRuleIndex(object):
+    """
+    The alerts that match each metric.
+    """
+
+    def __init__(self, alerts):
+        """
+        :param alerts: the ALERTS
+        :type alerts: tuple
+        """
+        self.alerts = list(alerts)
+        # The namespace and the compiled regex, or None if the namespace is not
+        # a valid regex, of each alert
+        self.rules = []
+        for alert in self.alerts:
+            try:
+                compiled = re.compile(alert[0])
+            except:
+                compiled = None
+            self.rules.append((alert[0], compiled))
+        self.smtp_rules = set([
+            rule_index for rule_index, alert in enumerate(self.alerts)
+            if str(alert[1]) == 'smtp'])
+        # The alerts with a SECOND_ORDER_RESOLUTION_HOURS
+        self.mirage_rules = set([
+            rule_index for rule_index, alert in enumerate(self.alerts)
+            if len(alert) > 3])
+        self.index = {}
+
+    def match_rules(self, base_name):
+        """
+        Match a metric against all the alerts.
+
+        :param base_name: the metric base_name
+        :type base_name: str
+        :return: a tuple of the ``(alert_index, matched_by)`` of the alerts
+            that match, in the ALERTS order, matched_by being absolute, regex
+            or substring
+        :rtype: tuple
+        """
+        matches = []
+        for rule_index, (namespace, compiled) in enumerate(self.rules):
+            if base_name == namespace:
+                matched_by = 'absolute'
+            elif compiled is not None and compiled.match(base_name):
+                matched_by = 'regex'
+            elif namespace in base_name:
+                matched_by = 'substring'
+            else:
+                continue
+            matches.append((rule_index, matched_by))
+        return tuple(matches)
+
+    def matches(self, base_name):
+        """
+        The ``(alert_index, matched_by)`` of the alerts that match a metric,
+        from the index, matching and indexing the metric if it is not in it.
+
+        :param base_name: the metric base_name
+        :type base_name: str
+        :rtype: tuple
+        """
+        try:
+            return self.index[base_name]
+        except KeyError:
+            pass
+        matches = self.match_rules(base_name)
+        self.index[base_name] = matches
+        return matches
+
+    def update(self, base_names):
+        """
+        Index the metrics that are not in the index and drop the metrics that
+        are no longer in base_names.
+
+        :param base_names: the base_names of the unique_metrics
+        :type base_names: list
+        :return: the number of metrics added and removed
+        :rtype: tuple
+        """
+        base_names = set(base_names)
+        index = self.index
+        removed = [base_name for base_name in index if base_name not in base_names]
+        for base_name in removed:
+            del index[base_name]
+        added = 0
+        for base_name in base_names:
+            if base_name not in index:
+                index[base_name] = self.match_rules(base_name)
+                added += 1
+        return added, len(removed)
+
+    def smtp_alerter(self, base_name):
+        """
+        Whether a metric matches an smtp alert.
+        """
+        smtp_rules = self.smtp_rules
+        for rule_index, matched_by in self.matches(base_name):
+            if rule_index in smtp_rules:
+                return True
+        return False
+
+    def mirage_metric(self, base_name):
+        """
+        Whether a metric matches an alert with a SECOND_ORDER_RESOLUTION_HOURS.
+        """
+        mirage_rules = self.mirage_rules
+        for rule_index, matched_by in self.matches(base_name):
+            if rule_index in mirage_rules:
+                return True
+        return False
@@ -0,0 +1,491 @@
+"""
+algorithm_engine
+
+Evaluate the ALGORITHMS on one numpy array of a timeseries with shared
+statistics.
+
+Each function in algorithms.py builds its own pandas.Series or scipy.array from
+``[x[1] for x in timeseries]`` and computes its own mean, std, median and
+tail_avg, so the same timeseries is converted up to nine times per metric.
+:class:`SeriesStatistics` converts the timeseries into numpy arrays once and
+computes each statistic once, when it is first used, and :data:`ALGORITHMS`
+are the algorithms implemented on it.  They compute the same values, in the
+same way as pandas, numpy and scipy do in algorithms.py, so they return the
+same results.
+
+If the timeseries has any values that are not finite, which pandas handles as
+missing, :func:`get_series_statistics` returns ``None`` and the algorithms.py
+functions are run instead.  An algorithm that is not in :data:`ALGORITHMS` is
+always run from algorithms.py.
+
+If the metric has an :class:`incremental_state.IncrementalState`,
+stddev_from_moving_average uses the ewm state kept between runs rather than
+calculating the ewm of the whole timeseries.
+
+The algorithms raise rather than handling their own exceptions, the caller
+records the algorithm error and uses ``None`` as the result, as the
+algorithms.py functions do.
+
+:func:`batch_algorithms` evaluates the :data:`BATCH_ALGORITHMS` for many
+timeseries at once.  The timeseries with the same length are stacked into 2-D
+arrays, one row per timeseries, and each statistic is calculated along the
+rows for the whole block.  numpy reduces each row of a C contiguous array in
+the same order as it reduces a 1-D array, so the results are the same as for
+each timeseries on its own.
+"""
+
+from __future__ import division
+from itertools import chain
+from time import time
+
+import numpy as np
+import pandas
+import scipy
+import scipy.stats
+import statsmodels.api as sm
+
+from settings import FULL_DURATION
+
+# The pandas cython exponentially weighted functions that
+# pandas.Series.ewm().mean() and .std() run, without the pandas overhead
+try:
+    from pandas._libs.window import ewma, ewmcov
+except ImportError:
+    try:
+        from pandas._window import ewma, ewmcov
+    except ImportError:
+        ewma = None
+        ewmcov = None
+
+# The com of the stddev_from_moving_average exponentially weighted moving
+# average and stddev
+MOVING_AVERAGE_COM = 50
+
+# The grubbs_score for each length of timeseries
+grubbs_scores = {}
+
+# The algorithms that batch_algorithms evaluates and the least number of
+# timeseries of the same length to evaluate as a block
+BATCH_ALGORITHMS = (
+    'histogram_bins', 'first_hour_average', 'stddev_from_average', 'grubbs',
+    'mean_subtraction_cumulation', 'median_absolute_deviation')
+BATCH_MIN_TIMESERIES = 2
+HISTOGRAM_BINS = 15
+
+
+def pandas_mean(values):
+    """
+    The mean of the values as pandas.Series.mean calculates it.
+    """
+    if not len(values):
+        return np.nan
+    return values.sum(dtype=np.float64) / len(values)
+
+
+def pandas_std(values):
+    """
+    The sample standard deviation of the values as pandas.Series.std
+    calculates it, ``nan`` for fewer than 2 values.
+    """
+    count = len(values)
+    if count < 2:
+        return np.nan
+    average = values.sum(dtype=np.float64) / count
+    return np.sqrt(((average - values) ** 2).sum(dtype=np.float64) / (count - 1))
+
+
+class SeriesStatistics(object):
+    """
+    The numpy arrays of a timeseries and its shared statistics.
+    """
+
+    def __init__(self, timeseries, timestamps=None, values=None):
+        """
+        :param timeseries: the timeseries, a list of ``(timestamp, value)``
+            items or a numpy array of shape ``(n, 2)``
+        :param timestamps: the timestamps array, if it has already been made
+        :param values: the values array, if it has already been made
+        :type timeseries: list
+        :type timestamps: numpy.ndarray
+        :type values: numpy.ndarray
+        """
+        self.timeseries = timeseries
+        if timestamps is None or values is None:
+            if isinstance(timeseries, np.ndarray):
+                array = np.asarray(timeseries, dtype=np.float64)
+            else:
+                array = np.fromiter(
+                    chain.from_iterable(timeseries), np.float64, len(timeseries) * 2).reshape(-1, 2)
+            timestamps = np.ascontiguousarray(array[:, 0])
+            values = np.ascontiguousarray(array[:, 1])
+        self.timestamps = timestamps
+        self.values = values
+        self.length = len(self.values)
+        # The results of the algorithms that have already been evaluated,
+        # by batch_algorithms
+        self.results = {}
+        # The incremental_state.IncrementalState of the metric, if the ewm
+        # state is kept between runs
+        self.incremental_state = None
+        self._mean = None
+        self._std = None
+        self._population_std = None
+        self._median = None
+        self._tail_avg = None
+
+    @property
+    def mean(self):
+        if self._mean is None:
+            self._mean = pandas_mean(self.values)
+        return self._mean
+
+    @property
+    def std(self):
+        """
+        The sample standard deviation, as pandas.Series.std.
+        """
+        if self._std is None:
+            self._std = pandas_std(self.values)
+        return self._std
+
+    @property
+    def population_std(self):
+        """
+        The population standard deviation, as scipy.std.
+        """
+        if self._population_std is None:
+            self._population_std = np.std(self.values)
+        return self._population_std
+
+    @property
+    def median(self):
+        if self._median is None:
+            self._median = np.median(self.values)
+        return self._median
+
+    @property
+    def tail_avg(self):
+        """
+        The average of the last three values, as algorithms.tail_avg.
+        """
+        if self._tail_avg is None:
+            values = self.values
+            if self.length >= 3:
+                self._tail_avg = (values[-1] + values[-2] + values[-3]) / 3
+            else:
+                self._tail_avg = values[-1]
+        return self._tail_avg
+
+
+def get_series_statistics(timeseries):
+    """
+    The SeriesStatistics of a timeseries, or ``None`` if the values cannot be
+    handled the same way as in algorithms.py.
+
+    :param timeseries: the timeseries
+    :type timeseries: list
+    :return: the statistics or ``None``
+    :rtype: SeriesStatistics
+    """
+    try:
+        statistics = SeriesStatistics(timeseries)
+    except (TypeError, ValueError):
+        return None
+    if not statistics.length or not np.isfinite(statistics.values).all():
+        return None
+    return statistics
+
+
+def median_absolute_deviation(statistics):
+    demedianed = np.abs(statistics.values - statistics.median)
+    median_deviation = np.median(demedianed)
+    # The test statistic is infinite when the median is zero
+    if median_deviation == 0:
+        return False
+    test_statistic = demedianed[-1] / median_deviation
+    if test_statistic > 6:
+        return True
+    return False
+
+
+def grubbs(statistics):
+    stdDev = statistics.population_std
+    if stdDev == 0:
+        return False
+    z_score = (statistics.tail_avg - statistics.mean) / stdDev
+    return z_score > get_grubbs_score(statistics.length)
+
+
+def get_grubbs_score(len_series):
+    """
+    The grubbs_score of a length of timeseries.
+    """
+    grubbs_score = grubbs_scores.get(len_series)
+    if grubbs_score is None:
+        threshold = scipy.stats.t.isf(.05 / (2 * len_series), len_series - 2)
+        threshold_squared = threshold * threshold
+        grubbs_score = ((len_series - 1) / np.sqrt(len_series)) * np.sqrt(threshold_squared / (len_series - 2 + threshold_squared))
+        grubbs_scores[len_series] = grubbs_score
+    return grubbs_score
+
+
+def first_hour_average(statistics):
+    last_hour_threshold = time() - (FULL_DURATION - 3600)
+    series = statistics.values[statistics.timestamps < last_hour_threshold]
+    mean = pandas_mean(series)
+    stdDev = pandas_std(series)
+    return abs(statistics.tail_avg - mean) > 3 * stdDev
+
+
+def stddev_from_average(statistics):
+    return abs(statistics.tail_avg - statistics.mean) > 3 * statistics.std
+
+
+def stddev_from_moving_average(statistics):
+    values = statistics.values
+    if statistics.incremental_state is not None:
+        moving = statistics.incremental_state.moving_average(statistics.timestamps, values)
+        if moving is not None:
+            expAverage, stdDev = moving
+            return abs(values[-1] - expAverage) > 3 * stdDev
+    if ewma is not None:
+        expAverage = ewma(values, MOVING_AVERAGE_COM, 1, 0, 0)[-1]
+        variance = ewmcov(values, values, MOVING_AVERAGE_COM, 1, 0, 0, 0)[-1]
+        # As pandas zsqrt
+        if variance < 0:
+            stdDev = 0
+        else:
+            stdDev = np.sqrt(variance)
+    else:
+        moving = pandas.Series(values).ewm(ignore_na=False, min_periods=0, adjust=True, com=MOVING_AVERAGE_COM)
+        expAverage = moving.mean().iat[-1]
+        stdDev = moving.std(bias=False).iat[-1]
+    return abs(values[-1] - expAverage) > 3 * stdDev
+
+
+def mean_subtraction_cumulation(statistics):
+    values = statistics.values
+    series = values - pandas_mean(values[:-1])
+    stdDev = pandas_std(series[:-1])
+    return abs(series[-1]) > 3 * stdDev
+
+
+def least_squares(statistics):
+    x = statistics.timestamps
+    y = statistics.values
+    A = np.vstack([x, np.ones(len(x))]).T
+    m, c = np.linalg.lstsq(A, y)[0]
+    errors = y - (m * x + c)
+    if len(errors) < 3:
+        return False
+    std_dev = scipy.std(errors)
+    t = (errors[-1] + errors[-2] + errors[-3]) / 3
+    return abs(t) > std_dev * 3 and round(std_dev) != 0 and round(t) != 0
+
+
+def histogram_bins(statistics):
+    t = statistics.tail_avg
+    h = np.histogram(statistics.values, bins=15)
+    bins = h[1]
+    for index, bin_size in enumerate(h[0]):
+        if bin_size <= 20:
+            # Is it in the first bin?
+            if index == 0:
+                if t <= bins[0]:
+                    return True
+            # Is it in the current bin?
+            elif t >= bins[index] and t < bins[index + 1]:
+                return True
+    return False
+
+
+def ks_test(statistics):
+    hour_ago = time() - 3600
+    ten_minutes_ago = time() - 600
+    timestamps = statistics.timestamps
+    reference = statistics.values[(timestamps >= hour_ago) & (timestamps < ten_minutes_ago)]
+    probe = statistics.values[timestamps >= ten_minutes_ago]
+    if reference.size < 20 or probe.size < 20:
+        return False
+    ks_d, ks_p_value = scipy.stats.ks_2samp(reference, probe)
+    if ks_p_value < 0.05 and ks_d > 0.5:
+        adf = sm.tsa.stattools.adfuller(reference, 10)
+        if adf[1] < 0.05:
+            return True
+    return False
+
+
+ALGORITHMS = {
+    'median_absolute_deviation': median_absolute_deviation,
+    'grubbs': grubbs,
+    'first_hour_average': first_hour_average,
+    'stddev_from_average': stddev_from_average,
+    'stddev_from_moving_average': stddev_from_moving_average,
+    'mean_subtraction_cumulation': mean_subtraction_cumulation,
+    'least_squares': least_squares,
+    'histogram_bins': histogram_bins,
+    'ks_test': ks_test,
+}
+
+
+def _batch_block(timestamps, values):
+    """
+    The BATCH_ALGORITHMS results of a block of timeseries of the same length.
+
+    :param timestamps: the timestamps, one timeseries per row
+    :param values: the values, one timeseries per row
+    :type timestamps: numpy.ndarray
+    :type values: numpy.ndarray
+    :return: a dict of the array of the results of each algorithm, the
+        first_hour_average results are ``None`` for the timeseries that it is
+        not calculated for, and a dict of the arrays of the statistics
+    :rtype: tuple
+    """
+    count, length = values.shape
+    results = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if length >= 3:
+            tail_avg = (values[:, -1] + values[:, -2] + values[:, -3]) / 3
+        else:
+            tail_avg = values[:, -1]
+        mean = values.sum(axis=1, dtype=np.float64) / length
+        if length > 1:
+            std = np.sqrt(((mean[:, None] - values) ** 2).sum(axis=1, dtype=np.float64) / (length - 1))
+        else:
+            std = np.full(count, np.nan)
+
+        results['stddev_from_average'] = np.abs(tail_avg - mean) > 3 * std
+
+        population_std = np.std(values, axis=1)
+        z_score = (tail_avg - mean) / population_std
+        results['grubbs'] = (population_std != 0) & (z_score > get_grubbs_score(length))
+
+        if length > 1:
+            series = values - (values[:, :-1].sum(axis=1, dtype=np.float64) / (length - 1))[:, None]
+            head = series[:, :-1]
+            if length > 2:
+                head_mean = head.sum(axis=1, dtype=np.float64) / (length - 1)
+                head_std = np.sqrt(((head_mean[:, None] - head) ** 2).sum(axis=1, dtype=np.float64) / (length - 2))
+            else:
+                head_std = np.full(count, np.nan)
+            results['mean_subtraction_cumulation'] = np.abs(series[:, -1]) > 3 * head_std
+        else:
+            results['mean_subtraction_cumulation'] = np.zeros(count, dtype=bool)
+
+        median = np.median(values, axis=1)
+        demedianed = np.abs(values - median[:, None])
+        median_deviation = np.median(demedianed, axis=1)
+        statistics = {
+            '_mean': mean, '_std': std, '_population_std': population_std,
+            '_median': median, '_tail_avg': tail_avg}
+        results['median_absolute_deviation'] = (
+            (median_deviation != 0) & (demedianed[:, -1] / median_deviation > 6))
+
+        # The tail_avg is only in one of the np.histogram bins=15 bins, so only
+        # the size of that bin is counted.  np.histogram puts each value in
+        # the bin with edges[j] <= value < edges[j + 1], with the last bin
+        # closed, and histogram_bins matches the first bin if
+        # tail_avg <= edges[0] rather than if it is in the bin
+        first_edge = values.min(axis=1)
+        last_edge = values.max(axis=1)
+        equal = first_edge == last_edge
+        first_edge[equal] -= 0.5
+        last_edge[equal] += 0.5
+        bin_edges = np.linspace(first_edge, last_edge, HISTOGRAM_BINS + 1, axis=1)
+        t = tail_avg[:, None]
+        in_bin = (t >= bin_edges[:, 1:-1]) & (t < bin_edges[:, 2:])
+        in_first_bin = tail_avg <= bin_edges[:, 0]
+        has_bin = in_first_bin | in_bin.any(axis=1)
+        bin_index = np.where(in_first_bin, 0, in_bin.argmax(axis=1) + 1)
+        rows = np.arange(count)
+        lower = bin_edges[rows, bin_index]
+        upper = bin_edges[rows, bin_index + 1]
+        lower[bin_index == 0] = -np.inf
+        upper[bin_index == HISTOGRAM_BINS - 1] = np.inf
+        bin_sizes = ((values >= lower[:, None]) & (values < upper[:, None])).sum(axis=1)
+        results['histogram_bins'] = has_bin & (bin_sizes <= 20)
+
+        # The values before the last hour threshold are a prefix of each
+        # timeseries that has its timestamps in order, the timeseries are
+        # grouped by the length of the prefix and the others are left for
+        # first_hour_average
+        first_hour_average = [None] * count
+        last_hour_threshold = time() - (FULL_DURATION - 3600)
+        before_threshold = timestamps < last_hour_threshold
+        prefix_lengths = before_threshold.sum(axis=1)
+        if length > 1:
+            in_order = (np.diff(timestamps, axis=1) >= 0).all(axis=1)
+        else:
+            in_order = np.ones(count, dtype=bool)
+        for prefix_length in np.unique(prefix_lengths[in_order]):
+            block_rows = np.nonzero(in_order & (prefix_lengths == prefix_length))[0]
+            if prefix_length < 2:
+                # The mean or std is nan
+                for row in block_rows:
+                    first_hour_average[row] = False
+                continue
+            prefix = values[block_rows, :prefix_length]
+            prefix_mean = prefix.sum(axis=1, dtype=np.float64) / prefix_length
+            prefix_std = np.sqrt(((prefix_mean[:, None] - prefix) ** 2).sum(axis=1, dtype=np.float64) / (prefix_length - 1))
+            prefix_results = np.abs(tail_avg[block_rows] - prefix_mean) > 3 * prefix_std
+            for row, result in zip(block_rows, prefix_results):
+                first_hour_average[row] = bool(result)
+        results['first_hour_average'] = first_hour_average
+    return results, statistics
+
+
+def batch_algorithms(timeseries_list):
+    """
+    Evaluate the BATCH_ALGORITHMS for the timeseries with the same length as
+    at least BATCH_MIN_TIMESERIES - 1 others, as 2-D blocks.
+
+    :param timeseries_list: the timeseries
+    :type timeseries_list: list
+    :return: a list with the SeriesStatistics of each timeseries, with the
+        shared statistics and the result of each of the BATCH_ALGORITHMS in
+        its results, or ``None`` for the timeseries that were not evaluated,
+        which are ragged, too short or have values that are not finite
+    :rtype: list
+    """
+    batch_results = [None] * len(timeseries_list)
+    lengths = {}
+    for index, timeseries in enumerate(timeseries_list):
+        try:
+            length = len(timeseries)
+        except TypeError:
+            continue
+        if length:
+            lengths.setdefault(length, []).append(index)
+
+    for length, indices in lengths.items():
+        if len(indices) < BATCH_MIN_TIMESERIES:
+            continue
+        try:
+            array = np.fromiter(
+                chain.from_iterable(chain.from_iterable(timeseries_list[index] for index in indices)),
+                np.float64, len(indices) * length * 2).reshape(len(indices), length, 2)
+        except (TypeError, ValueError):
+            continue
+        timestamps = np.ascontiguousarray(array[:, :, 0])
+        values = np.ascontiguousarray(array[:, :, 1])
+        finite = np.isfinite(values).all(axis=1)
+        if not finite.all():
+            indices = [index for index, is_finite in zip(indices, finite) if is_finite]
+            if len(indices) < BATCH_MIN_TIMESERIES:
+                continue
+            timestamps = timestamps[finite]
+            values = values[finite]
+        results, statistics = _batch_block(timestamps, values)
+        for row, index in enumerate(indices):
+            # The rows of the blocks are the arrays of the SeriesStatistics,
+            # so they are not converted again for the other algorithms
+            series_statistics = SeriesStatistics(
+                timeseries_list[index], timestamps[row], values[row])
+            for name, statistic in statistics.items():
+                setattr(series_statistics, name, statistic[row])
+            for algorithm in BATCH_ALGORITHMS:
+                result = results[algorithm][row]
+                if result is not None:
+                    series_statistics.results[algorithm] = bool(result)
+            batch_results[index] = series_statistics
+    return batch_results
@@ -60,6 +60,36 @@ try:
 except:
     ALERT_ON_STALE_PERIOD = 300
 
+# @added 20261018 - Shared statistics algorithm engine
+# If ANALYZER_VECTORISED_ALGORITHMS is True the timeseries is converted to a
+# numpy array once and the ALGORITHMS are run from the algorithm_engine on its
+# shared statistics, rather than each algorithm converting the timeseries and
+# calculating the statistics itself.
+try:
+    from settings import ANALYZER_VECTORISED_ALGORITHMS
+except:
+    ANALYZER_VECTORISED_ALGORITHMS = True
+if ANALYZER_VECTORISED_ALGORITHMS:
+    import algorithm_engine
+
+# @added 20261018 - Incremental algorithm state
+# If ANALYZER_INCREMENTAL_STATE is True the ewm state of
+# stddev_from_moving_average is kept in Redis between runs and only the new
+# datapoints are folded into it.  It requires ANALYZER_VECTORISED_ALGORITHMS.
+try:
+    from settings import ANALYZER_INCREMENTAL_STATE
+except:
+    ANALYZER_INCREMENTAL_STATE = False
+if ANALYZER_INCREMENTAL_STATE and ANALYZER_VECTORISED_ALGORITHMS:
+    from redis import StrictRedis
+    from incremental_state import IncrementalState
+    if REDIS_PASSWORD:
+        incremental_state_redis_conn = StrictRedis(password=REDIS_PASSWORD, unix_socket_path=REDIS_SOCKET_PATH)
+    else:
+        incremental_state_redis_conn = StrictRedis(unix_socket_path=REDIS_SOCKET_PATH)
+else:
+    ANALYZER_INCREMENTAL_STATE = False
+
 """
 This is no man's land. Do anything you want in here,
 as long as you return a boolean that determines whether the input timeseries is
@@ -517,9 +547,28 @@ def is_anomalously_anomalous(metric_name, ensemble, datapoint):
     return abs(intervals[-1] - mean) > 3 * stdDev
 
 
-def run_selected_algorithm(timeseries, metric_name):
+# @modified 20261018 - Batched algorithms
+# Added series_statistics
+# @modified 20261018 - Skip unchanged metrics
+# Added last_verdict
+def run_selected_algorithm(timeseries, metric_name, series_statistics=None, last_verdict=None):
     """
     Filter timeseries and run selected algorithm.
+
+    :param timeseries: the timeseries
+    :param metric_name: the metric name
+    :param series_statistics: the algorithm_engine.SeriesStatistics of the
+        timeseries from algorithm_engine.batch_algorithms, the results of the
+        algorithms that it has already evaluated are used rather than running
+        those algorithms
+    :param last_verdict: the ``(anomalous, ensemble, datapoint)`` of the last
+        run if the timeseries has not changed since, which is returned rather
+        than running the algorithms, after the stale, too short and boring
+        checks
+    :type timeseries: list
+    :type metric_name: str
+    :type series_statistics: SeriesStatistics
+    :type last_verdict: tuple
     """
 
     # @added 20180807 - Feature #2492: alert on stale metrics
@@ -575,6 +624,13 @@ def run_selected_algorithm(timeseries, metric_name):
     if len(set(item[1] for item in timeseries[-MAX_TOLERABLE_BOREDOM:])) == BOREDOM_SET_SIZE:
         raise Boring()
 
+    # @added 20261018 - Skip unchanged metrics
+    # The timeseries has not changed since the last run.  With
+    # ENABLE_SECOND_ORDER the trigger_history changes each run so the
+    # algorithms are run.
+    if last_verdict is not None and not ENABLE_SECOND_ORDER:
+        return last_verdict
+
     # RUN_OPTIMIZED_WORKFLOW - replaces the original ensemble method:
     # ensemble = [globals()[algorithm](timeseries) for algorithm in ALGORITHMS]
     # which runs all timeseries through all ALGORITHMS
@@ -593,6 +649,24 @@ def run_selected_algorithm(timeseries, metric_name):
 
     algorithm_tmp_file_prefix = '%s/%s.' % (SKYLINE_TMP_DIR, skyline_app)
 
+    # @added 20261018 - Shared statistics algorithm engine
+    # @modified 20261018 - Batched algorithms
+    # The statistics are passed from batch_algorithms or only determined if
+    # an algorithm is run
+    # if ANALYZER_VECTORISED_ALGORITHMS:
+    #     series_statistics = algorithm_engine.get_series_statistics(timeseries)
+    # else:
+    #     series_statistics = None
+    if series_statistics is not None:
+        precomputed_results = series_statistics.results
+    else:
+        precomputed_results = {}
+    use_series_statistics = ANALYZER_VECTORISED_ALGORITHMS
+    # @added 20261018 - Incremental algorithm state
+    if series_statistics is not None and ANALYZER_INCREMENTAL_STATE:
+        series_statistics.incremental_state = IncrementalState(
+            incremental_state_redis_conn, metric_name, algorithm_engine.MOVING_AVERAGE_COM)
+
     for algorithm in ALGORITHMS:
         if consensus_possible:
 
@@ -605,11 +679,36 @@ def run_selected_algorithm(timeseries, metric_name):
             number_of_algorithms_run += 1
             if send_algorithm_run_metrics:
                 start = timer()
-            try:
-                algorithm_result = [globals()[test_algorithm](timeseries) for test_algorithm in run_algorithm]
-            except:
-                # logger.error('%s failed' % (algorithm))
-                algorithm_result = [None]
+            # @modified 20261018 - Shared statistics algorithm engine
+            # Run the algorithm on the shared statistics if it is in the
+            # algorithm_engine, recording any error as the algorithm would
+            # try:
+            #     algorithm_result = [globals()[test_algorithm](timeseries) for test_algorithm in run_algorithm]
+            # except:
+            #     # logger.error('%s failed' % (algorithm))
+            #     algorithm_result = [None]
+            # @added 20261018 - Batched algorithms
+            if use_series_statistics and series_statistics is None and algorithm not in precomputed_results:
+                series_statistics = algorithm_engine.get_series_statistics(timeseries)
+                use_series_statistics = series_statistics is not None
+                # @added 20261018 - Incremental algorithm state
+                if use_series_statistics and ANALYZER_INCREMENTAL_STATE:
+                    series_statistics.incremental_state = IncrementalState(
+                        incremental_state_redis_conn, metric_name, algorithm_engine.MOVING_AVERAGE_COM)
+            if algorithm in precomputed_results:
+                algorithm_result = [precomputed_results[algorithm]]
+            elif series_statistics is not None and algorithm in algorithm_engine.ALGORITHMS:
+                try:
+                    algorithm_result = [algorithm_engine.ALGORITHMS[algorithm](series_statistics)]
+                except:
+                    record_algorithm_error(algorithm, traceback.format_exc())
+                    algorithm_result = [None]
+            else:
+                try:
+                    algorithm_result = [globals()[test_algorithm](timeseries) for test_algorithm in run_algorithm]
+                except:
+                    # logger.error('%s failed' % (algorithm))
+                    algorithm_result = [None]
 
             if send_algorithm_run_metrics:
                 end = timer()
@@ -9,7 +9,11 @@ from time import time, sleep, strftime, gmtime
 from threading import Thread
 from collections import defaultdict
 from multiprocessing import Process, Manager, Queue
-from msgpack import Unpacker, packb
+# @modified 20261018 - Binary timeseries codec
+# from msgpack import Unpacker, packb
+# @modified 20261018 - Skip unchanged metrics
+# from msgpack import packb
+from msgpack import packb, unpackb
 import os
 from os import path, kill, getpid
 from math import ceil
@@ -27,10 +31,18 @@ from skyline_functions import (
     filesafe_metricname,
     # @added 20170602 - Feature #2034: analyse_derivatives
     nonNegativeDerivative, strictly_increasing_monotonicity, in_list)
+# @added 20261018 - Binary timeseries codec
+from timeseries_codec import decode_timeseries
+# @added 20261018 - Redis shards
+from redis_shards import get_redis_shards
+# @added 20261018 - Alert rule index
+from alert_rule_index import AlertRuleIndex
 
 from alerters import trigger_alert
 from algorithms import run_selected_algorithm
 from algorithm_exceptions import TooShort, Stale, Boring
+# @added 20261018 - Batched algorithms
+from algorithm_engine import batch_algorithms
 
 try:
     send_algorithm_run_metrics = settings.ENABLE_ALGORITHM_RUN_METRICS
@@ -65,6 +77,30 @@ try:
 except:
     DO_NOT_ALERT_ON_STALE_METRICS = []
 
+# @added 20261018 - Batched algorithms
+# If ANALYZER_BATCH_ALGORITHMS is True the assigned metrics are decoded in
+# blocks of ANALYZER_BATCH_SIZE and the algorithm_engine BATCH_ALGORITHMS are
+# evaluated for the timeseries of the same length in each block as 2-D arrays
+# before the metrics are analysed one by one.
+try:
+    ANALYZER_BATCH_ALGORITHMS = settings.ANALYZER_BATCH_ALGORITHMS
+except:
+    ANALYZER_BATCH_ALGORITHMS = True
+try:
+    ANALYZER_BATCH_SIZE = int(settings.ANALYZER_BATCH_SIZE)
+except:
+    ANALYZER_BATCH_SIZE = 1000
+
+# @added 20261018 - Skip unchanged metrics
+# If ANALYZER_SKIP_UNCHANGED_METRICS is True the verdict of each metric is
+# kept in the analyzer.verdict.<base_name> key with the last datapoint and
+# length of its timeseries, and a metric with no new datapoints since the last
+# run reuses the verdict rather than running the algorithms again.
+try:
+    ANALYZER_SKIP_UNCHANGED_METRICS = settings.ANALYZER_SKIP_UNCHANGED_METRICS
+except:
+    ANALYZER_SKIP_UNCHANGED_METRICS = True
+
 skyline_app_graphite_namespace = 'skyline.%s%s' % (skyline_app, SERVER_METRIC_PATH)
 
 LOCAL_DEBUG = False
@@ -117,6 +153,10 @@ class Analyzer(Thread):
         # Adding lists of smtp_alerter_metrics and non_smtp_alerter_metrics
         self.smtp_alerter_metrics = Manager().list()
         self.non_smtp_alerter_metrics = Manager().list()
+        # @added 20261018 - Alert rule index
+        # The ALERTS that match each of the unique_metrics, updated each run
+        # and shared with the spin processes
+        self.alert_rule_index = AlertRuleIndex(settings.ALERTS)
 
     def check_if_parent_is_alive(self):
         """
@@ -128,6 +168,31 @@ class Analyzer(Thread):
         except:
             exit(0)
 
+    def get_last_verdict(self, raw_verdict, verdict_signature):
+        """
+        The verdict of the last run of a metric, if its timeseries has not
+        changed since.
+
+        :param raw_verdict: the analyzer.verdict key of the metric
+        :param verdict_signature: the last timestamp, last value, length and
+            known_derivative_metric of the timeseries
+        :type raw_verdict: str
+        :type verdict_signature: list
+        :return: the ``(anomalous, ensemble, datapoint)`` of the last run or
+            ``None``
+        :rtype: tuple
+        """
+        if not raw_verdict or not verdict_signature:
+            return None
+        try:
+            last_verdict = unpackb(raw_verdict)
+            if list(last_verdict[:4]) != verdict_signature:
+                return None
+            anomalous, ensemble, datapoint = last_verdict[4:]
+            return anomalous, list(ensemble), datapoint
+        except:
+            return None
+
     def spawn_alerter_process(self, alert, metric, context):
         """
         Spawn a process to trigger an alert.
@@ -218,7 +283,10 @@ class Analyzer(Thread):
         # @modified 20160801 - Adding additional exception handling to Analyzer
         raw_assigned_failed = True
         try:
-            raw_assigned = self.redis_conn.mget(assigned_metrics)
+            # @modified 20261018 - Redis shards
+            # Get the metrics from their REDIS_SHARDS shards
+            # raw_assigned = self.redis_conn.mget(assigned_metrics)
+            raw_assigned = get_redis_shards().mget(assigned_metrics)
             raw_assigned_failed = False
             if LOCAL_DEBUG:
                 logger.info('debug :: Memory usage spin_process after raw_assigned: %s (kb)' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
@@ -298,17 +366,85 @@ class Analyzer(Thread):
         # Added Redis sets for Boring, TooShort and Stale
         redis_set_errors = 0
 
+        # @added 20261018 - Batched algorithms
+        # The decoded timeseries and the batch algorithm SeriesStatistics of
+        # the current block of metrics, by index
+        batch_timeseries = {}
+        batch_statistics = {}
+        known_derivative_metrics = set(derivative_metrics)
+
+        # @added 20261018 - Skip unchanged metrics
+        # The verdicts of the last run, the verdicts of the metrics that are
+        # analysed are set with a pipeline
+        last_verdicts = [None] * len(assigned_metrics)
+        if ANALYZER_SKIP_UNCHANGED_METRICS:
+            try:
+                last_verdicts = self.redis_conn.mget([
+                    'analyzer.verdict.%s' % metric_name.replace(settings.FULL_NAMESPACE, '', 1)
+                    for metric_name in assigned_metrics])
+            except:
+                logger.info(traceback.format_exc())
+                logger.error('error :: failed to get the analyzer.verdict keys from Redis')
+            verdicts_pipe = self.redis_conn.pipeline(transaction=False)
+        unchanged_metrics = 0
+
         # Distill timeseries strings into lists
         for i, metric_name in enumerate(assigned_metrics):
             self.check_if_parent_is_alive()
 
+            # @added 20261018 - Batched algorithms
+            # Decode the next block of metrics and evaluate the batch
+            # algorithms for them, the known derivative metrics are analysed
+            # as derivatives so they are not evaluated
+            if ANALYZER_BATCH_ALGORITHMS and i % ANALYZER_BATCH_SIZE == 0:
+                batch_timeseries = {}
+                batch_indices = []
+                for block_index in range(i, min(i + ANALYZER_BATCH_SIZE, len(assigned_metrics))):
+                    try:
+                        batch_timeseries[block_index] = decode_timeseries(raw_assigned[block_index])
+                    except:
+                        continue
+                    if assigned_metrics[block_index] not in known_derivative_metrics:
+                        # @added 20261018 - Skip unchanged metrics
+                        # The algorithms are not run for unchanged metrics
+                        if last_verdicts[block_index]:
+                            block_timeseries = batch_timeseries[block_index]
+                            if block_timeseries and self.get_last_verdict(last_verdicts[block_index], [
+                                    block_timeseries[-1][0], block_timeseries[-1][1],
+                                    len(block_timeseries), False]):
+                                continue
+                        batch_indices.append(block_index)
+                try:
+                    batch_statistics = dict(zip(batch_indices, batch_algorithms(
+                        [batch_timeseries[block_index] for block_index in batch_indices])))
+                except:
+                    logger.info(traceback.format_exc())
+                    logger.error('error :: batch_algorithms failed, analysing the metrics one by one')
+                    batch_statistics = {}
+
             try:
                 raw_series = raw_assigned[i]
-                unpacker = Unpacker(use_list=False)
-                unpacker.feed(raw_series)
-                timeseries = list(unpacker)
+                # @modified 20261018 - Binary timeseries codec
+                # unpacker = Unpacker(use_list=False)
+                # unpacker.feed(raw_series)
+                # timeseries = list(unpacker)
+                # @modified 20261018 - Batched algorithms
+                # timeseries = decode_timeseries(raw_series)
+                if i in batch_timeseries:
+                    timeseries = batch_timeseries.pop(i)
+                else:
+                    timeseries = decode_timeseries(raw_series)
             except:
                 timeseries = []
+            # @added 20261018 - Batched algorithms
+            series_statistics = batch_statistics.pop(i, None)
+            # @added 20261018 - Skip unchanged metrics
+            verdict_signature = None
+            if ANALYZER_SKIP_UNCHANGED_METRICS and timeseries:
+                try:
+                    verdict_signature = [timeseries[-1][0], timeseries[-1][1], len(timeseries)]
+                except:
+                    verdict_signature = None
 
             # @added 20170602 - Feature #2034: analyse_derivatives
             # In order to convert monotonic, incrementing metrics to a deriative
@@ -389,9 +525,37 @@ class Analyzer(Thread):
                     timeseries = derivative_timeseries
                 except:
                     logger.error('error :: nonNegativeDerivative failed')
+                # @added 20261018 - Batched algorithms
+                # The batch results are for the timeseries, not the derivative
+                series_statistics = None
+
+            # @added 20261018 - Skip unchanged metrics
+            last_verdict = None
+            if verdict_signature:
+                verdict_signature.append(known_derivative_metric)
+                last_verdict = self.get_last_verdict(last_verdicts[i], verdict_signature)
 
             try:
-                anomalous, ensemble, datapoint = run_selected_algorithm(timeseries, metric_name)
+                # @modified 20261018 - Batched algorithms
+                # anomalous, ensemble, datapoint = run_selected_algorithm(timeseries, metric_name)
+                # @modified 20261018 - Skip unchanged metrics
+                # anomalous, ensemble, datapoint = run_selected_algorithm(timeseries, metric_name, series_statistics)
+                anomalous, ensemble, datapoint = run_selected_algorithm(
+                    timeseries, metric_name, series_statistics, last_verdict)
+
+                # @added 20261018 - Skip unchanged metrics
+                if last_verdict:
+                    unchanged_metrics += 1
+                elif verdict_signature:
+                    try:
+                        verdicts_pipe.setex(
+                            'analyzer.verdict.%s' % metric_name.replace(settings.FULL_NAMESPACE, '', 1),
+                            settings.STALE_PERIOD,
+                            packb(verdict_signature + [anomalous, ensemble, datapoint]))
+                        if len(verdicts_pipe) >= ANALYZER_BATCH_SIZE:
+                            verdicts_pipe.execute()
+                    except:
+                        logger.error('error :: failed to set the analyzer.verdict keys in Redis')
 
                 # If it's anomalous, add it to list
                 if anomalous:
@@ -463,7 +627,9 @@ class Analyzer(Thread):
                     # @added 20170108 - Feature #1830: Ionosphere alerts
                     # Only send smtp_alerter_metrics to Ionosphere
                     smtp_alert_enabled_metric = True
-                    if base_name in self.non_smtp_alerter_metrics:
+                    # @modified 20261018 - Alert rule index
+                    # if base_name in self.non_smtp_alerter_metrics:
+                    if not self.alert_rule_index.smtp_alerter(base_name):
                         smtp_alert_enabled_metric = False
 
                     if ionosphere_enabled:
@@ -727,6 +893,14 @@ class Analyzer(Thread):
                 exceptions['Other'] += 1
                 logger.info(traceback.format_exc())
 
+        # @added 20261018 - Skip unchanged metrics
+        if ANALYZER_SKIP_UNCHANGED_METRICS:
+            try:
+                verdicts_pipe.execute()
+            except:
+                logger.error('error :: failed to set the analyzer.verdict keys in Redis')
+            logger.info('%s unchanged metrics reused the verdict of the last run' % str(unchanged_metrics))
+
         # @added 20180519 - Feature #2378: Add redis auth to Skyline and rebrow
         # Added Redis sets for Boring, TooShort and Stale
         if redis_set_errors > 0:
@@ -897,7 +1071,15 @@ class Analyzer(Thread):
             # Discover unique metrics
             # @modified 20160803 - Adding additional exception handling to Analyzer
             try:
-                unique_metrics = list(self.redis_conn.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                # @modified 20261018 - Redis shards
+                # The unique_metrics of all the REDIS_SHARDS, ordered by
+                # shard so that each spin_process gets its metrics from as
+                # few shards as possible and the processes fetch from the
+                # shards in parallel
+                # unique_metrics = list(self.redis_conn.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                redis_shards = get_redis_shards()
+                unique_metrics = redis_shards.sort_by_shard(
+                    redis_shards.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
             except:
                 logger.error('error :: Analyzer could not get the unique_metrics list from Redis')
                 logger.info(traceback.format_exc())
@@ -909,6 +1091,18 @@ class Analyzer(Thread):
                 sleep(10)
                 continue
 
+            # @added 20261018 - Alert rule index
+            # Match the ALERTS against the metrics that have been added since
+            # the last run
+            try:
+                added_metrics, removed_metrics = self.alert_rule_index.update(
+                    [metric_name.replace(settings.FULL_NAMESPACE, '', 1) for metric_name in unique_metrics])
+                logger.info('alert_rule_index :: %s metrics added, %s metrics removed' % (
+                    str(added_metrics), str(removed_metrics)))
+            except:
+                logger.info(traceback.format_exc())
+                logger.error('error :: failed to update the alert_rule_index')
+
             # @added 20160922 - Branch #922: Ionosphere
             # Add a Redis set of mirage.unique_metrics
             if settings.ENABLE_MIRAGE:
@@ -977,62 +1171,44 @@ class Analyzer(Thread):
                     except:
                         logger.info('no Redis set to delete - analyzer.alert_on_stale_metrics')
 
-                for alert in settings.ALERTS:
-                    for metric in unique_metrics:
-                        ALERT_MATCH_PATTERN = alert[0]
-                        base_name = metric.replace(settings.FULL_NAMESPACE, '', 1)
-                        METRIC_PATTERN = base_name
-                        pattern_match = False
-                        matched_by = 'not matched'
-                        try:
-                            alert_match_pattern = re.compile(ALERT_MATCH_PATTERN)
-                            pattern_match = alert_match_pattern.match(METRIC_PATTERN)
-                            if pattern_match:
-                                matched_by = 'regex'
-                                pattern_match = True
-                        except:
-                            pattern_match = False
-
-                        if not pattern_match:
-                            if alert[0] in base_name:
-                                pattern_match = True
-                                matched_by = 'substring'
-
-                        if not pattern_match:
-                            continue
+                # @modified 20261018 - Alert rule index
+                # The alerts that match each metric are determined by the
+                # alert_rule_index rather than by compiling the regex of each
+                # alert for each metric
+                # for alert in settings.ALERTS:
+                #     for metric in unique_metrics:
+                #         ALERT_MATCH_PATTERN = alert[0]
+                #         ...
+                mirage_unique_metrics_set = set(mirage_unique_metrics)
+                for metric in unique_metrics:
+                    base_name = metric.replace(settings.FULL_NAMESPACE, '', 1)
+                    if not self.alert_rule_index.mirage_metric(base_name):
+                        continue
 
-                        mirage_metric = False
+                    if metric not in mirage_unique_metrics_set:
                         try:
-                            SECOND_ORDER_RESOLUTION_FULL_DURATION = alert[3]
-                            mirage_metric = True
+                            self.redis_conn.sadd('mirage.unique_metrics', metric)
+                            if LOCAL_DEBUG:
+                                logger.info('debug :: added %s to mirage.unique_metrics' % metric)
                         except:
-                            mirage_metric = False
-
-                        if mirage_metric:
-                            if metric not in mirage_unique_metrics:
-                                try:
-                                    self.redis_conn.sadd('mirage.unique_metrics', metric)
-                                    if LOCAL_DEBUG:
-                                        logger.info('debug :: added %s to mirage.unique_metrics' % metric)
-                                except:
-                                    if LOCAL_DEBUG:
-                                        logger.error('error :: failed to add %s to mirage.unique_metrics set' % metric)
-
-                                try:
-                                    key_timestamp = int(time())
-                                    self.redis_conn.setex('analyzer.manage_mirage_unique_metrics', 300, key_timestamp)
-                                except:
-                                    logger.error('error :: failed to set key :: analyzer.manage_mirage_unique_metrics')
+                            if LOCAL_DEBUG:
+                                logger.error('error :: failed to add %s to mirage.unique_metrics set' % metric)
 
-                        # Do we use list or dict, which is better performance?
-                        # With dict - Use EAFP (easier to ask forgiveness than
-                        # permission)
                         try:
-                            blah = dict["mykey"]
-                            # key exists in dict
+                            key_timestamp = int(time())
+                            self.redis_conn.setex('analyzer.manage_mirage_unique_metrics', 300, key_timestamp)
                         except:
-                            # key doesn't exist in dict
-                            blah = False
+                            logger.error('error :: failed to set key :: analyzer.manage_mirage_unique_metrics')
+
+                # Do we use list or dict, which is better performance?
+                # With dict - Use EAFP (easier to ask forgiveness than
+                # permission)
+                try:
+                    blah = dict["mykey"]
+                    # key exists in dict
+                except:
+                    # key doesn't exist in dict
+                    blah = False
 
                 # If they were refresh set them again
                 if mirage_unique_metrics == []:
@@ -1059,34 +1235,24 @@ class Analyzer(Thread):
             # @added 20170108 - Feature #1830: Ionosphere alerts
             # Adding lists of smtp_alerter_metrics and non_smtp_alerter_metrics
             # Timed this takes 0.013319 seconds on 689 unique_metrics
+            # @modified 20261018 - Alert rule index
+            # Determined by the alert_rule_index rather than by compiling the
+            # regex of each smtp alert for each metric, and the Manager lists
+            # are extended once rather than appended to for each metric
+            # for metric_name in unique_metrics:
+            #     base_name = metric_name.replace(settings.FULL_NAMESPACE, '', 1)
+            #     for alert in settings.ALERTS:
+            #         ...
+            smtp_alerter_metrics = []
+            non_smtp_alerter_metrics = []
             for metric_name in unique_metrics:
                 base_name = metric_name.replace(settings.FULL_NAMESPACE, '', 1)
-                for alert in settings.ALERTS:
-                    pattern_match = False
-                    if str(alert[1]) == 'smtp':
-                        ALERT_MATCH_PATTERN = alert[0]
-                        METRIC_PATTERN = base_name
-                        pattern_match = False
-                        try:
-                            # Match by regex
-                            alert_match_pattern = re.compile(ALERT_MATCH_PATTERN)
-                            pattern_match = alert_match_pattern.match(METRIC_PATTERN)
-                            if pattern_match:
-                                pattern_match = True
-                                if base_name not in self.smtp_alerter_metrics:
-                                    self.smtp_alerter_metrics.append(base_name)
-                        except:
-                            pattern_match = False
-
-                        if not pattern_match:
-                            # Match by substring
-                            if alert[0] in base_name:
-                                if base_name not in self.smtp_alerter_metrics:
-                                    self.smtp_alerter_metrics.append(base_name)
-
-                if base_name not in self.smtp_alerter_metrics:
-                    if base_name not in self.smtp_alerter_metrics:
-                        self.non_smtp_alerter_metrics.append(base_name)
+                if self.alert_rule_index.smtp_alerter(base_name):
+                    smtp_alerter_metrics.append(base_name)
+                else:
+                    non_smtp_alerter_metrics.append(base_name)
+            self.smtp_alerter_metrics.extend(smtp_alerter_metrics)
+            self.non_smtp_alerter_metrics.extend(non_smtp_alerter_metrics)
 
             logger.info('smtp_alerter_metrics     :: %s' % str(len(self.smtp_alerter_metrics)))
             logger.info('non_smtp_alerter_metrics :: %s' % str(len(self.non_smtp_alerter_metrics)))
@@ -1095,7 +1261,9 @@ class Analyzer(Thread):
             #                   Branch #2270: luminosity
             # Add a Redis set of smtp_alerter_metrics for Luminosity to only
             # cross correlate on metrics with an alert setting
-            for metric in self.smtp_alerter_metrics:
+            # @modified 20261018 - Alert rule index
+            # for metric in self.smtp_alerter_metrics:
+            for metric in smtp_alerter_metrics:
                 self.redis_conn.sadd('new_analyzer.smtp_alerter_metrics', metric)
             try:
                 self.redis_conn.rename('analyzer.smtp_alerter_metrics', 'analyzer.smtp_alerter_metrics.old')
@@ -1315,43 +1483,27 @@ class Analyzer(Thread):
 
             # Send alerts
             if settings.ENABLE_ALERTS:
-                for alert in settings.ALERTS:
+                # @added 20261018 - Alert rule index
+                # The alerts that match each anomalous metric
+                all_anomalous_metrics = list(self.all_anomalous_metrics)
+                anomalous_metric_matches = [
+                    dict(self.alert_rule_index.matches(str(metric[1])))
+                    for metric in all_anomalous_metrics]
+                # @modified 20261018 - Alert rule index
+                # for alert in settings.ALERTS:
+                for alert_index, alert in enumerate(self.alert_rule_index.alerts):
                     # @modified 20161229 - Feature #1830: Ionosphere alerts
                     # Handle alerting for Ionosphere
                     # for metric in self.anomalous_metrics:
-                    for metric in self.all_anomalous_metrics:
-                        pattern_match = False
-                        # Absolute match
-                        if str(metric[1]) == str(alert[0]):
-                            pattern_match = True
-
-                        if not pattern_match:
-                            ALERT_MATCH_PATTERN = alert[0]
-                            METRIC_PATTERN = metric[1]
-                            matched_by = 'not matched'
-                            try:
-                                alert_match_pattern = re.compile(ALERT_MATCH_PATTERN)
-                                pattern_match = alert_match_pattern.match(METRIC_PATTERN)
-                                # if LOCAL_DEBUG:
-                                #     logger.info(
-                                #         'debug :: regex alert pattern matched :: %s %s' %
-                                #         (alert[0], metric[1]))
-                                matched_by = 'regex'
-                            except:
-                                pattern_match = False
-                        # @modified 20160806 - Reintroduced the original
-                        # substring matching after wildcard matching, to allow
-                        # more flexibility
-                        if not pattern_match:
-                            if alert[0] in metric[1]:
-                                pattern_match = True
-                                # if LOCAL_DEBUG:
-                                #     logger.info(
-                                #         'debug :: substring alert pattern matched :: %s %s' %
-                                #         (alert[0], metric[1]))
-                                matched_by = 'substring'
-
-                        if not pattern_match:
+                    # @modified 20261018 - Alert rule index
+                    # The absolute, regex and substring matches are determined
+                    # by the alert_rule_index
+                    # for metric in self.all_anomalous_metrics:
+                    #     pattern_match = False
+                    #     ...
+                    for metric_index, metric in enumerate(all_anomalous_metrics):
+                        matched_by = anomalous_metric_matches[metric_index].get(alert_index)
+                        if not matched_by:
                             continue
 
                         mirage_metric = False
@@ -1836,7 +1988,9 @@ class Analyzer(Thread):
 
             # Check canary metric
             try:
-                raw_series = self.redis_conn.get(settings.FULL_NAMESPACE + settings.CANARY_METRIC)
+                # @modified 20261018 - Redis shards
+                # raw_series = self.redis_conn.get(settings.FULL_NAMESPACE + settings.CANARY_METRIC)
+                raw_series = get_redis_shards().get(settings.FULL_NAMESPACE + settings.CANARY_METRIC)
             except:
                 logger.error('error :: failed to get CANARY_METRIC from Redis')
                 raw_series = None
@@ -1844,9 +1998,11 @@ class Analyzer(Thread):
             projected = None
             if raw_series is not None:
                 try:
-                    unpacker = Unpacker(use_list=False)
-                    unpacker.feed(raw_series)
-                    timeseries = list(unpacker)
+                    # @modified 20261018 - Binary timeseries codec
+                    # unpacker = Unpacker(use_list=False)
+                    # unpacker.feed(raw_series)
+                    # timeseries = list(unpacker)
+                    timeseries = decode_timeseries(raw_series)
                     time_human = (timeseries[-1][0] - timeseries[0][0]) / 3600
                     projected = 24 * (time() - now) / time_human
                     logger.info('canary duration    :: %.2f' % time_human)
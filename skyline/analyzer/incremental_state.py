@@ -0,0 +1,223 @@
+"""
+incremental_state
+
+Keep the exponentially weighted moving average state of each metric between
+Analyzer runs, so that stddev_from_moving_average folds in the new datapoints
+rather than recalculating the ewm mean and std of the whole timeseries.
+
+The ewm with adjust=True weights the i-th of n values by r ** (n - 1 - i),
+where r = 1 - 1 / (1 + com), so the weighted sums of a run of values are
+scaled by r ** m when m values are appended after it.  The state of a metric
+is a list of blocks of up to STATE_BLOCK_SIZE consecutive datapoints, each
+with its first and last timestamp, its count, the sum of its weights and of
+its squared weights, its weighted mean and its weighted sum of squared
+deviations from the mean.  Each run:
+
+- drops the blocks that start before the first timestamp of the timeseries,
+  the expired datapoints
+- makes new blocks of the datapoints before the first block that is kept, at
+  most a block of datapoints of a block that was partly expired, and of the
+  datapoints after the last block, the new datapoints, filling the last block
+  first
+- combines the blocks, weighted by r ** the number of datapoints after each,
+  into the ewm mean and the bias corrected ewm std of the last datapoint
+
+so the cost is in the number of new datapoints and blocks rather than in the
+length of the timeseries.  If the blocks do not match the timestamps of the
+timeseries, e.g. after Roomba has removed a duplicate datapoint, the blocks
+are made again from the whole timeseries.  The timeseries must have strictly
+increasing timestamps, otherwise ``None`` is returned and the ewm is
+calculated as before.
+
+The blocks are stored as little-endian float64 arrays in the
+``analyzer.incremental_state.<metric_name>`` keys, which expire after
+FULL_DURATION.  The weighted means and deviations are combined in a different
+order to the pandas recursion, so the mean and std are the same as pandas to
+within floating point rounding rather than exactly.
+"""
+
+from __future__ import division
+
+import numpy as np
+
+from settings import FULL_DURATION
+
+STATE_KEY_PREFIX = 'analyzer.incremental_state.'
+STATE_BLOCK_SIZE = 60
+
+# The fields of a block
+FIRST_TIMESTAMP, LAST_TIMESTAMP, COUNT, WEIGHT, WEIGHT_SQUARED, MEAN, DEVIATION = range(7)
+
+
+class IncrementalState(object):
+    """
+    The ewm state of a metric.
+    """
+
+    def __init__(self, redis_conn, metric_name, com=50, block_size=STATE_BLOCK_SIZE):
+        """
+        :param redis_conn: the Redis connection
+        :param metric_name: the metric name
+        :param com: the center of mass of the ewm
+        :param block_size: the most datapoints in a block
+        :type redis_conn: StrictRedis
+        :type metric_name: str
+        :type com: int
+        :type block_size: int
+        """
+        self.redis_conn = redis_conn
+        self.key = '%s%s' % (STATE_KEY_PREFIX, metric_name)
+        self.decay = 1 - (1 / (1 + com))
+        self.block_size = block_size
+        # The weight of each position in a block, the last datapoint has a
+        # weight of 1
+        self.weights = self.decay ** np.arange(block_size - 1, -1, -1, dtype=np.float64)
+
+    def load(self):
+        """
+        The blocks of the metric, an array with a row per block, or ``None``.
+        """
+        raw_state = self.redis_conn.get(self.key)
+        if not raw_state or len(raw_state) % 56:
+            return None
+        return np.frombuffer(raw_state, dtype='<f8').reshape(-1, 7).copy()
+
+    def save(self, blocks):
+        self.redis_conn.setex(self.key, FULL_DURATION, blocks.astype('<f8').tobytes())
+
+    def make_blocks(self, timestamps, values):
+        """
+        The blocks of consecutive datapoints.
+
+        :param timestamps: the timestamps
+        :param values: the values
+        :type timestamps: numpy.ndarray
+        :type values: numpy.ndarray
+        :return: an array with a row per block
+        :rtype: numpy.ndarray
+        """
+        count = len(values)
+        block_size = self.block_size
+        full_blocks = count // block_size
+        blocks = np.empty((-(-count // block_size), 7))
+        if full_blocks:
+            full = values[:full_blocks * block_size].reshape(full_blocks, block_size)
+            weights = self.weights
+            weight = weights.sum()
+            mean = (full * weights).sum(axis=1) / weight
+            blocks[:full_blocks, FIRST_TIMESTAMP] = timestamps[:full_blocks * block_size:block_size]
+            blocks[:full_blocks, LAST_TIMESTAMP] = timestamps[block_size - 1:full_blocks * block_size:block_size]
+            blocks[:full_blocks, COUNT] = block_size
+            blocks[:full_blocks, WEIGHT] = weight
+            blocks[:full_blocks, WEIGHT_SQUARED] = (weights * weights).sum()
+            blocks[:full_blocks, MEAN] = mean
+            blocks[:full_blocks, DEVIATION] = (weights * (full - mean[:, None]) ** 2).sum(axis=1)
+        if count % block_size:
+            part = values[full_blocks * block_size:]
+            weights = self.weights[-len(part):]
+            weight = weights.sum()
+            mean = (part * weights).sum() / weight
+            blocks[-1] = (
+                timestamps[full_blocks * block_size], timestamps[-1], len(part), weight,
+                (weights * weights).sum(), mean, (weights * (part - mean) ** 2).sum())
+        return blocks
+
+    def append_datapoints(self, block, timestamps, values):
+        """
+        The block of the datapoints of a block followed by the datapoints.
+        """
+        decay = self.decay
+        first_timestamp, last_timestamp, count, weight, weight_squared, mean, deviation = block.tolist()
+        for value in values.tolist():
+            # The block followed by a block of the value, with a weight of 1
+            # and no deviation
+            weight *= decay
+            total_weight = weight + 1
+            deviation = (deviation * decay) + (weight / total_weight * (mean - value) ** 2)
+            mean = ((weight * mean) + value) / total_weight
+            weight = total_weight
+            weight_squared = (weight_squared * decay * decay) + 1
+        return (
+            first_timestamp, timestamps[-1], count + len(values), weight,
+            weight_squared, mean, deviation)
+
+    def update(self, timestamps, values):
+        """
+        Update the blocks of the metric to the timeseries.
+
+        :param timestamps: the timestamps, strictly increasing
+        :param values: the values
+        :type timestamps: numpy.ndarray
+        :type values: numpy.ndarray
+        :return: the blocks of the timeseries
+        :rtype: numpy.ndarray
+        """
+        length = len(values)
+        blocks = self.load()
+        if blocks is not None and len(blocks):
+            starts = np.searchsorted(timestamps, blocks[:, FIRST_TIMESTAMP])
+            ends = starts + blocks[:, COUNT].astype(np.intp) - 1
+            matched = (
+                (ends < length) &
+                (timestamps[np.minimum(starts, length - 1)] == blocks[:, FIRST_TIMESTAMP]) &
+                (timestamps[np.minimum(ends, length - 1)] == blocks[:, LAST_TIMESTAMP]))
+            first_kept = int(matched.argmax())
+            kept = slice(first_kept, None)
+            if not matched[kept].all() or (starts[first_kept + 1:] != ends[first_kept:-1] + 1).any():
+                blocks = None
+            else:
+                start = starts[first_kept]
+                end = ends[-1] + 1
+                blocks = blocks[kept]
+        if blocks is None or not len(blocks):
+            return self.make_blocks(timestamps, values)
+
+        parts = []
+        if start:
+            parts.append(self.make_blocks(timestamps[:start], values[:start]))
+        parts.append(blocks)
+        if end < length:
+            last_block = blocks[-1]
+            fill = min(int(self.block_size - last_block[COUNT]), length - end)
+            if fill:
+                blocks[-1] = self.append_datapoints(
+                    last_block, timestamps[end:end + fill], values[end:end + fill])
+            if end + fill < length:
+                parts.append(self.make_blocks(timestamps[end + fill:], values[end + fill:]))
+        if len(parts) == 1:
+            return blocks
+        return np.concatenate(parts)
+
+    def moving_average(self, timestamps, values):
+        """
+        The ewm mean and bias corrected std of the last datapoint of the
+        timeseries, as ``pandas.Series(values).ewm(com=com).mean()`` and
+        ``.std()``, and save the updated state.
+
+        :param timestamps: the timestamps
+        :param values: the values
+        :type timestamps: numpy.ndarray
+        :type values: numpy.ndarray
+        :return: the mean and std, or ``None`` if the timestamps are not
+            strictly increasing
+        :rtype: tuple
+        """
+        if len(values) < 2 or not (np.diff(timestamps) > 0).all():
+            return None
+        blocks = self.update(timestamps, values)
+        self.save(blocks)
+
+        after = np.cumsum(blocks[::-1, COUNT])[::-1] - blocks[:, COUNT]
+        scales = self.decay ** after
+        weights = scales * blocks[:, WEIGHT]
+        weight = weights.sum()
+        mean = (weights * blocks[:, MEAN]).sum() / weight
+        deviation = (scales * blocks[:, DEVIATION]).sum() + (weights * (blocks[:, MEAN] - mean) ** 2).sum()
+        denominator = (weight * weight) - (scales * scales * blocks[:, WEIGHT_SQUARED]).sum()
+        if denominator <= 0:
+            return mean, np.nan
+        variance = deviation * weight / denominator
+        # As pandas zsqrt
+        if variance < 0:
+            return mean, 0
+        return mean, np.sqrt(variance)
@@ -6,7 +6,9 @@ from time import time, sleep
 from threading import Thread
 from collections import defaultdict
 from multiprocessing import Process, Manager, Queue
-from msgpack import Unpacker, unpackb, packb
+# @modified 20261018 - Binary timeseries codec
+# from msgpack import Unpacker, unpackb, packb
+from msgpack import unpackb, packb
 import os
 from os import path, kill, getpid, system
 from math import ceil
@@ -21,6 +23,8 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
 sys.path.insert(0, os.path.dirname(__file__))
 import settings
+# @added 20261018 - Binary timeseries codec
+from timeseries_codec import decode_timeseries
 
 from alerters import trigger_alert
 from algorithms_dev import run_selected_algorithm
@@ -193,9 +197,11 @@ class Analyzer(Thread):
 
             try:
                 raw_series = raw_assigned[i]
-                unpacker = Unpacker(use_list=False)
-                unpacker.feed(raw_series)
-                timeseries = list(unpacker)
+                # @modified 20261018 - Binary timeseries codec
+                # unpacker = Unpacker(use_list=False)
+                # unpacker.feed(raw_series)
+                # timeseries = list(unpacker)
+                timeseries = decode_timeseries(raw_series)
 
                 anomalous, ensemble, datapoint = run_selected_algorithm(timeseries, metric_name)
 
@@ -516,9 +522,11 @@ class Analyzer(Thread):
             # Check canary metric
             raw_series = self.redis_conn.get(settings.FULL_NAMESPACE + settings.CANARY_METRIC)
             if raw_series is not None:
-                unpacker = Unpacker(use_list=False)
-                unpacker.feed(raw_series)
-                timeseries = list(unpacker)
+                # @modified 20261018 - Binary timeseries codec
+                # unpacker = Unpacker(use_list=False)
+                # unpacker.feed(raw_series)
+                # timeseries = list(unpacker)
+                timeseries = decode_timeseries(raw_series)
                 time_human = (timeseries[-1][0] - timeseries[0][0]) / 3600
                 projected = 24 * (time() - now) / time_human
 
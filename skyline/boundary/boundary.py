@@ -25,6 +25,10 @@ import settings
 # Added move_file
 from skyline_functions import (
     send_graphite_metric, write_data_to_file, move_file)
+# @added 20261018 - Binary timeseries codec
+from timeseries_codec import decode_timeseries
+# @added 20261018 - Redis shards
+from redis_shards import get_redis_shards
 
 from boundary_alerters import trigger_alert
 from boundary_algorithms import run_selected_algorithm
@@ -168,7 +172,9 @@ class Boundary(Thread):
 
         # Multi get series
         try:
-            raw_assigned = self.redis_conn.mget(unique_assigned_metrics)
+            # @modified 20261018 - Redis shards
+            # raw_assigned = self.redis_conn.mget(unique_assigned_metrics)
+            raw_assigned = get_redis_shards().mget(unique_assigned_metrics)
         except:
             logger.error('error :: failed to mget assigned_metrics from redis')
             return
@@ -197,9 +203,11 @@ class Boundary(Thread):
                 if ENABLE_BOUNDARY_DEBUG:
                     logger.info('debug :: unpacking timeseries for %s - %s' % (metric_name, str(i)))
                 raw_series = raw_assigned[i]
-                unpacker = Unpacker(use_list=False)
-                unpacker.feed(raw_series)
-                timeseries = list(unpacker)
+                # @modified 20261018 - Binary timeseries codec
+                # unpacker = Unpacker(use_list=False)
+                # unpacker.feed(raw_series)
+                # timeseries = list(unpacker)
+                timeseries = decode_timeseries(raw_series)
             except Exception as e:
                 exceptions['Other'] += 1
                 logger.error('error :: redis data error: ' + traceback.format_exc())
@@ -300,9 +308,11 @@ class Boundary(Thread):
                     logger.info('debug :: unpacking timeseries for %s - %s' % (metric_name, str(raw_assigned_id)))
 
                 raw_series = raw_assigned[metric_and_algo[0]]
-                unpacker = Unpacker(use_list=False)
-                unpacker.feed(raw_series)
-                timeseries = list(unpacker)
+                # @modified 20261018 - Binary timeseries codec
+                # unpacker = Unpacker(use_list=False)
+                # unpacker.feed(raw_series)
+                # timeseries = list(unpacker)
+                timeseries = decode_timeseries(raw_series)
 
                 if ENABLE_BOUNDARY_DEBUG:
                     logger.info('debug :: unpacked OK - %s - %s' % (metric_name, str(raw_assigned_id)))
@@ -635,7 +645,9 @@ class Boundary(Thread):
             self.redis_conn.setex(skyline_app, 120, now)
 
             # Discover unique metrics
-            unique_metrics = list(self.redis_conn.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+            # @modified 20261018 - Redis shards
+            # unique_metrics = list(self.redis_conn.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+            unique_metrics = list(get_redis_shards().smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
 
             if len(unique_metrics) == 0:
                 logger.info('no metrics in redis. try adding some - see README')
@@ -1044,11 +1056,15 @@ class Boundary(Thread):
                 send_graphite_metric(skyline_app, send_metric_name, str(value))
 
             # Check canary metric
-            raw_series = self.redis_conn.get(settings.FULL_NAMESPACE + settings.CANARY_METRIC)
+            # @modified 20261018 - Redis shards
+            # raw_series = self.redis_conn.get(settings.FULL_NAMESPACE + settings.CANARY_METRIC)
+            raw_series = get_redis_shards().get(settings.FULL_NAMESPACE + settings.CANARY_METRIC)
             if raw_series is not None:
-                unpacker = Unpacker(use_list=False)
-                unpacker.feed(raw_series)
-                timeseries = list(unpacker)
+                # @modified 20261018 - Binary timeseries codec
+                # unpacker = Unpacker(use_list=False)
+                # unpacker.feed(raw_series)
+                # timeseries = list(unpacker)
+                timeseries = decode_timeseries(raw_series)
                 time_human = (timeseries[-1][0] - timeseries[0][0]) / 3600
                 projected = 24 * (time() - now) / time_human
 
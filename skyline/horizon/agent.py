@@ -14,6 +14,10 @@ import settings
 from validate_settings import validate_settings_variables
 
 from listen import Listen
+# @added 20261018 - Shared memory ring buffer transport
+from ring_buffer import RingBuffer
+# @added 20261018 - Hash sharded workers
+from sharded_queue import ShardedQueue
 from roomba import Roomba
 from worker import Worker
 
@@ -40,6 +44,28 @@ class Horizon():
         self.pidfile_path = '%s/%s.pid' % (settings.PID_PATH, skyline_app)
         self.pidfile_timeout = 5
 
+    def new_listen_queue(self):
+        """
+        Create a queue for the listeners to put metrics on for the workers,
+        either a multiprocessing Queue of `MAX_QUEUE_SIZE` chunks or, if
+        `HORIZON_TRANSPORT` is ``ring_buffer``, a shared memory RingBuffer of
+        `HORIZON_RING_BUFFER_SIZE` bytes.
+
+        # @added 20261018 - Shared memory ring buffer transport
+        """
+        try:
+            transport = settings.HORIZON_TRANSPORT
+        except:
+            transport = 'queue'
+        if transport == 'ring_buffer':
+            try:
+                ring_buffer_size = int(settings.HORIZON_RING_BUFFER_SIZE)
+            except:
+                ring_buffer_size = 67108864
+            logger.info('%s :: using a %s byte ring buffer transport' % (skyline_app, str(ring_buffer_size)))
+            return RingBuffer(ring_buffer_size)
+        return Queue(maxsize=settings.MAX_QUEUE_SIZE)
+
     def run(self):
         """
         Determine the `MAX_QUEUE_SIZE` for the listen process.
@@ -49,14 +75,66 @@ class Horizon():
         Starts the defined number of `WORKER_PROCESSES`, with the first worker
         populating the canary metric.
 
-        Start the pickle (and UDP) listen processes.
+        Start the pickle, UDP (and plaintext line) listen processes.
 
         Start roomba.
         """
         logger.info('agent starting skyline %s' % skyline_app)
-        listen_queue = Queue(maxsize=settings.MAX_QUEUE_SIZE)
+        # @modified 20261018 - Shared memory ring buffer transport
+        # listen_queue = Queue(maxsize=settings.MAX_QUEUE_SIZE)
+        # @modified 20261018 - Hash sharded workers
+        # The listen_queue is created below as it is not used if the workers
+        # are sharded
         pid = getpid()
 
+        # @added 20261018 - SO_REUSEPORT sharded listeners
+        # Start HORIZON_LISTEN_PROCESSES listeners per port and, unless
+        # HORIZON_LISTEN_SHARED_QUEUE is True, give each listener its own
+        # queue with the workers assigned to the queues in turn
+        try:
+            listen_processes = int(settings.HORIZON_LISTEN_PROCESSES)
+        except:
+            listen_processes = 1
+        if listen_processes < 1:
+            listen_processes = 1
+        try:
+            shared_queue = settings.HORIZON_LISTEN_SHARED_QUEUE
+        except:
+            shared_queue = True
+        if not shared_queue and settings.WORKER_PROCESSES < listen_processes:
+            logger.error(
+                '%s :: WORKER_PROCESSES is less than HORIZON_LISTEN_PROCESSES, using a shared queue' % (
+                    skyline_app))
+            shared_queue = True
+        reuse_port = listen_processes > 1
+
+        # @added 20261018 - Hash sharded workers
+        # If HORIZON_SHARDED_WORKERS is True each worker has its own queue and
+        # the listeners route each metric to the queue of the worker that
+        # owns the metric, so every metric is only ever appended by one worker
+        try:
+            sharded_workers = settings.HORIZON_SHARDED_WORKERS
+        except:
+            sharded_workers = False
+        if sharded_workers:
+            logger.info('%s :: sharding metrics across %s workers' % (skyline_app, str(settings.WORKER_PROCESSES)))
+            worker_queues = [self.new_listen_queue() for i in range(settings.WORKER_PROCESSES)]
+            listen_queues = [ShardedQueue(worker_queues)]
+            canary_queues = worker_queues
+        else:
+            listen_queue = self.new_listen_queue()
+            if listen_processes == 1 or shared_queue:
+                listen_queues = [listen_queue]
+            else:
+                listen_queues = [listen_queue]
+                for i in range(1, listen_processes):
+                    # @modified 20261018 - Shared memory ring buffer transport
+                    # listen_queues.append(Queue(maxsize=settings.MAX_QUEUE_SIZE))
+                    listen_queues.append(self.new_listen_queue())
+            worker_queues = [
+                listen_queues[i % len(listen_queues)] for i in range(settings.WORKER_PROCESSES)]
+            canary_queues = listen_queues
+
         # If we're not using oculus, don't bother writing to mini
         try:
             skip_mini = True if settings.OCULUS_HOST == '' else False
@@ -64,19 +142,44 @@ class Horizon():
             skip_mini = True
 
         # Start the workers
+        # @modified 20261018 - SO_REUSEPORT sharded listeners
+        # Each worker takes from its worker_queues queue and the canary
+        # reports the size of all the queues
         for i in range(settings.WORKER_PROCESSES):
+            worker_queue = worker_queues[i]
             if i == 0:
                 logger.info('%s :: starting Worker - canary' % skyline_app)
-                Worker(listen_queue, pid, skip_mini, canary=True).start()
+                # Worker(listen_queue, pid, skip_mini, canary=True).start()
+                # @modified 20261018 - Horizon stage instrumentation
+                # Added process_number
+                Worker(
+                    worker_queue, pid, skip_mini, canary=True, canary_queues=canary_queues,
+                    process_number=i).start()
             else:
                 logger.info('%s :: starting Worker' % skyline_app)
-                Worker(listen_queue, pid, skip_mini).start()
+                # Worker(listen_queue, pid, skip_mini).start()
+                Worker(worker_queue, pid, skip_mini, process_number=i).start()
 
         # Start the listeners
-        logger.info('%s :: starting Listen - pickle' % skyline_app)
-        Listen(settings.PICKLE_PORT, listen_queue, pid, type="pickle").start()
-        logger.info('%s :: starting Listen - udp' % skyline_app)
-        Listen(settings.UDP_PORT, listen_queue, pid, type="udp").start()
+        # @modified 20261018 - SO_REUSEPORT sharded listeners
+        # logger.info('%s :: starting Listen - pickle' % skyline_app)
+        # Listen(settings.PICKLE_PORT, listen_queue, pid, type="pickle").start()
+        # logger.info('%s :: starting Listen - udp' % skyline_app)
+        # Listen(settings.UDP_PORT, listen_queue, pid, type="udp").start()
+        listeners = [('pickle', settings.PICKLE_PORT), ('udp', settings.UDP_PORT)]
+        # @added 20261018 - Plaintext line listener
+        try:
+            LINE_PORT = settings.LINE_PORT
+        except:
+            LINE_PORT = None
+        if LINE_PORT:
+            listeners.append(('line', LINE_PORT))
+        for listener_type, listener_port in listeners:
+            for i in range(listen_processes):
+                logger.info('%s :: starting Listen - %s' % (skyline_app, listener_type))
+                Listen(
+                    listener_port, listen_queues[i % len(listen_queues)], pid,
+                    type=listener_type, reuse_port=reuse_port, process_number=i).start()
 
         # Start the roomba
         logger.info('%s :: starting Roomba' % skyline_app)
@@ -84,7 +187,9 @@ class Horizon():
 
         # Warn the Mac users
         try:
-            listen_queue.qsize()
+            # @modified 20261018 - Hash sharded workers
+            # listen_queue.qsize()
+            listen_queues[0].qsize()
         except NotImplementedError:
             logger.info('WARNING: Queue().qsize() not implemented on Unix platforms like Mac OS X. Queue size logging will be unavailable.')
 
@@ -105,6 +210,15 @@ def run():
         print ('log directory does not exist at %s' % settings.LOG_PATH)
         sys.exit(1)
 
+    # @added 20261018 - Horizon disk spool
+    try:
+        HORIZON_SPOOL_DIR = settings.HORIZON_SPOOL_DIR
+    except:
+        HORIZON_SPOOL_DIR = None
+    if HORIZON_SPOOL_DIR and not isdir(HORIZON_SPOOL_DIR):
+        print ('spool directory does not exist at %s' % HORIZON_SPOOL_DIR)
+        sys.exit(1)
+
     logger.setLevel(logging.DEBUG)
     formatter = logging.Formatter("%(asctime)s :: %(process)s :: %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
     handler = logging.handlers.TimedRotatingFileHandler(
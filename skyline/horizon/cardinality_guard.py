@@ -0,0 +1,178 @@
+"""
+cardinality_guard
+
+Limit the rate at which new metrics are created, per namespace prefix.
+
+A client that sends unique metric names, e.g. with a request id in them, can
+add hundreds of thousands of keys to the unique_metrics set.  The guard counts
+the new metrics created under each namespace prefix, the first prefix_depth
+elements of the metric name, in each window of seconds in a Redis HyperLogLog
+shared by all the workers, and refuses to create more than the budget of new
+metrics per prefix per window.  Datapoints for metrics that are already in the
+unique_metrics set are always accepted.
+
+The names of the metrics that were refused are added to a HyperLogLog per
+prefix too, so that the rejected cardinality can be reported, with the set of
+the prefixes that had rejections.  The keys are:
+
+- ``horizon.cardinality.accepted.<window_start>.<prefix>``
+- ``horizon.cardinality.rejected.<window_start>.<prefix>``
+- ``horizon.cardinality.rejected_prefixes.<window_start>``
+
+and expire after two windows.  The budget is approximate, the HyperLogLog
+counts have a standard error of 0.81% and the workers check the count
+concurrently.
+"""
+
+import sys
+
+python_version = int(sys.version_info[0])
+
+
+class CardinalityGuard(object):
+    """
+    The new metric budget of a worker.
+    """
+
+    def __init__(self, redis_conn, redis_shards, full_namespace, budget, window, prefix_depth):
+        """
+        :param redis_conn: the connection for the cardinality keys
+        :param redis_shards: the RedisShards of the metric keys
+        :param full_namespace: the FULL_NAMESPACE
+        :param budget: the number of new metrics per prefix per window
+        :param window: the window in seconds
+        :param prefix_depth: the number of metric name elements in a prefix
+        :type redis_conn: StrictRedis
+        :type redis_shards: RedisShards
+        :type full_namespace: str
+        :type budget: int
+        :type window: int
+        :type prefix_depth: int
+        """
+        self.redis_conn = redis_conn
+        self.redis_shards = redis_shards
+        self.full_uniques = '%sunique_metrics' % full_namespace
+        self.full_namespace = full_namespace
+        self.budget = budget
+        self.window = window
+        self.prefix_depth = prefix_depth
+        self.window_start = None
+        # The metrics that are known to exist or were accepted in the window,
+        # and the prefixes that have used their budget in the window
+        self.known = set()
+        self.exhausted = set()
+
+    def prefix(self, metric_name):
+        """
+        The namespace prefix of a metric.
+        """
+        return '.'.join(metric_name.split('.', self.prefix_depth)[:self.prefix_depth])
+
+    def key(self, kind, prefix):
+        return 'horizon.cardinality.%s.%s.%s' % (kind, str(self.window_start), prefix)
+
+    def existing(self, metric_names):
+        """
+        The metrics that are in the unique_metrics set, on their shards.
+        """
+        keys = [''.join((self.full_namespace, metric_name)) for metric_name in metric_names]
+        existing = set()
+        for shard, shard_keys in enumerate(self.redis_shards.group_by_shard(keys)):
+            if not shard_keys:
+                continue
+            pipe = self.redis_shards.connections[shard].pipeline(transaction=False)
+            for position, key in shard_keys:
+                pipe.sismember(self.full_uniques, key)
+            for (position, key), is_member in zip(shard_keys, pipe.execute()):
+                if is_member:
+                    existing.add(metric_names[position])
+        return existing
+
+    def check(self, metric_names, now):
+        """
+        Check the metrics of a chunk against the budget.
+
+        :param metric_names: the metric names of the chunk
+        :param now: the current timestamp
+        :type metric_names: list
+        :type now: int
+        :return: the names of the new metrics that are over the budget
+        :rtype: set
+        """
+        window_start = int(now) // self.window * self.window
+        if window_start != self.window_start:
+            # Start the window again, the known metrics are checked against
+            # Redis again so that euthanized metrics are new again
+            self.window_start = window_start
+            self.known = set()
+            self.exhausted = set()
+
+        known = self.known
+        unknown = list(set([metric_name for metric_name in metric_names if metric_name not in known]))
+        if not unknown:
+            return set()
+        existing = self.existing(unknown)
+        known.update(existing)
+
+        new_metrics = {}
+        for metric_name in unknown:
+            if metric_name not in existing:
+                new_metrics.setdefault(self.prefix(metric_name), []).append(metric_name)
+        if not new_metrics:
+            return set()
+
+        prefixes = [prefix for prefix in new_metrics if prefix not in self.exhausted]
+        counts = {}
+        if prefixes:
+            pipe = self.redis_conn.pipeline(transaction=False)
+            for prefix in prefixes:
+                pipe.pfcount(self.key('accepted', prefix))
+            counts = dict(zip(prefixes, pipe.execute()))
+
+        rejected = set()
+        expire = self.window * 2
+        pipe = self.redis_conn.pipeline(transaction=False)
+        for prefix, prefix_metrics in new_metrics.items():
+            if prefix in self.exhausted:
+                remaining = 0
+            else:
+                remaining = max(self.budget - counts[prefix], 0)
+            accepted = prefix_metrics[:remaining]
+            if accepted:
+                pipe.pfadd(self.key('accepted', prefix), *accepted)
+                pipe.expire(self.key('accepted', prefix), expire)
+                known.update(accepted)
+            if len(prefix_metrics) >= remaining:
+                self.exhausted.add(prefix)
+            if len(prefix_metrics) > remaining:
+                refused = prefix_metrics[remaining:]
+                rejected.update(refused)
+                pipe.pfadd(self.key('rejected', prefix), *refused)
+                pipe.expire(self.key('rejected', prefix), expire)
+                rejected_prefixes = 'horizon.cardinality.rejected_prefixes.%s' % str(self.window_start)
+                pipe.sadd(rejected_prefixes, prefix)
+                pipe.expire(rejected_prefixes, expire)
+        pipe.execute()
+        return rejected
+
+    def rejected_cardinality(self, now):
+        """
+        The number of distinct new metrics refused in the current window for
+        each prefix that had rejections.
+
+        :param now: the current timestamp
+        :type now: int
+        :return: a dict of the rejected cardinality of each prefix
+        :rtype: dict
+        """
+        window_start = int(now) // self.window * self.window
+        prefixes = self.redis_conn.smembers('horizon.cardinality.rejected_prefixes.%s' % str(window_start))
+        if not prefixes:
+            return {}
+        if python_version == 3:
+            prefixes = [prefix.decode('utf-8') for prefix in prefixes]
+        prefixes = sorted(prefixes)
+        pipe = self.redis_conn.pipeline(transaction=False)
+        for prefix in prefixes:
+            pipe.pfcount('horizon.cardinality.rejected.%s.%s' % (str(window_start), prefix))
+        return dict(zip(prefixes, pipe.execute()))
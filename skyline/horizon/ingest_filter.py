@@ -0,0 +1,183 @@
+"""
+ingest_filter
+
+Normalise the datapoints of each metric in a Horizon worker before they are
+appended to Redis.
+
+The filter keeps a small per metric cache of the last timestamp seen, or the
+open resolution bucket, and:
+
+- drops a datapoint with the same timestamp as the last datapoint of the
+  metric, the duplicates that Roomba would otherwise remove
+- rejects a datapoint with a timestamp more than max_future seconds ahead of
+  now, if max_future is set
+- if resolution is set, aggregates the datapoints of each resolution bucket
+  into one datapoint, at the start of the bucket, with the last, sum or mean
+  of the values.  A bucket is emitted when a datapoint for a later bucket
+  arrives or, for a metric that has stopped sending, by :meth:`sweep` once
+  the bucket is two resolutions old.  A datapoint for a bucket that has
+  already been emitted is rejected as late.
+
+Datapoints replayed from the disk spool are older than the live datapoints
+that arrived after the queue drained, so they would all be rejected as late
+or duplicates.  With ``replayed`` only the future check is made and they are
+appended as they are, without being aggregated, Roomba sorts them.
+
+The cache is per worker process, so duplicates are only all caught if each
+metric is only handled by one worker, as with HORIZON_SHARDED_WORKERS.
+"""
+
+AGGREGATIONS = ('last', 'sum', 'mean')
+
+
+class IngestFilter(object):
+    """
+    The per metric duplicate, resolution and window filter of a worker.
+    """
+
+    def __init__(
+            self, drop_duplicates=True, resolution=0, aggregation='last',
+            max_future=0, window=1000):
+        """
+        :param drop_duplicates: drop datapoints with the same timestamp as the
+            last datapoint of the metric
+        :param resolution: the resolution bucket in seconds, 0 to not aggregate
+        :param aggregation: last, sum or mean
+        :param max_future: the number of seconds a timestamp can be ahead of
+            now, 0 to not check
+        :param window: the number of seconds the worker accepts datapoints
+            for, the cache entries older than this are pruned by sweep
+        :type drop_duplicates: boolean
+        :type resolution: int
+        :type aggregation: str
+        :type max_future: int
+        :type window: int
+        """
+        if aggregation not in AGGREGATIONS:
+            raise ValueError('unknown aggregation - %s' % str(aggregation))
+        self.drop_duplicates = drop_duplicates
+        self.resolution = int(resolution)
+        self.aggregation = aggregation
+        self.max_future = max_future
+        self.window = window
+        self.active = bool(drop_duplicates or self.resolution or max_future)
+        # The last timestamp of each metric or, with a resolution, the last
+        # bucket emitted
+        self.last_timestamps = {}
+        # The [bucket, timestamp, value, sum, count] of the open bucket of
+        # each metric
+        self.buckets = {}
+        self.counts = dict((name, 0) for name in ('duplicate', 'future', 'late', 'aggregated'))
+
+    def filter(self, metric_name, datapoint, now, replayed=False):
+        """
+        Filter a datapoint.
+
+        :param metric_name: the metric name
+        :param datapoint: the ``(timestamp, value)`` datapoint
+        :param now: the current timestamp
+        :param replayed: the datapoint was replayed from the spool, only the
+            future check is made
+        :type metric_name: str
+        :type datapoint: tuple
+        :type now: int
+        :type replayed: boolean
+        :return: the datapoint to append, the datapoint of a closed bucket or
+            ``None`` if there is nothing to append
+        :rtype: tuple
+        """
+        timestamp = datapoint[0]
+        if self.max_future and timestamp > now + self.max_future:
+            self.counts['future'] += 1
+            return None
+        if replayed:
+            return datapoint
+        if not self.resolution:
+            if self.drop_duplicates:
+                last_timestamp = self.last_timestamps.get(metric_name)
+                if last_timestamp == timestamp:
+                    self.counts['duplicate'] += 1
+                    return None
+                if last_timestamp is None or timestamp > last_timestamp:
+                    self.last_timestamps[metric_name] = timestamp
+            return datapoint
+
+        try:
+            value = float(datapoint[1])
+            bucket = int(timestamp) // self.resolution * self.resolution
+        except (TypeError, ValueError):
+            return None
+        open_bucket = self.buckets.get(metric_name)
+        if open_bucket is None:
+            if bucket <= self.last_timestamps.get(metric_name, bucket - 1):
+                self.counts['late'] += 1
+                return None
+            self.buckets[metric_name] = [bucket, timestamp, value, value, 1]
+            return None
+        if bucket == open_bucket[0]:
+            if timestamp == open_bucket[1] and self.drop_duplicates:
+                self.counts['duplicate'] += 1
+                return None
+            if timestamp >= open_bucket[1]:
+                open_bucket[1] = timestamp
+                open_bucket[2] = value
+            open_bucket[3] += value
+            open_bucket[4] += 1
+            self.counts['aggregated'] += 1
+            return None
+        if bucket < open_bucket[0]:
+            self.counts['late'] += 1
+            return None
+        closed = self.close_bucket(metric_name, open_bucket)
+        self.buckets[metric_name] = [bucket, timestamp, value, value, 1]
+        return closed
+
+    def close_bucket(self, metric_name, open_bucket):
+        """
+        The aggregated datapoint of a bucket.
+        """
+        self.last_timestamps[metric_name] = open_bucket[0]
+        if self.aggregation == 'sum':
+            value = open_bucket[3]
+        elif self.aggregation == 'mean':
+            value = open_bucket[3] / open_bucket[4]
+        else:
+            value = open_bucket[2]
+        return (open_bucket[0], value)
+
+    def sweep(self, now):
+        """
+        Emit the buckets that are two resolutions old and prune the cache
+        entries that are older than the window.
+
+        :param now: the current timestamp
+        :type now: int
+        :return: a list of the ``(metric_name, datapoint)`` of the closed
+            buckets
+        :rtype: list
+        """
+        closed = []
+        if self.resolution:
+            cutoff = now - (2 * self.resolution)
+            for metric_name, open_bucket in list(self.buckets.items()):
+                if open_bucket[0] <= cutoff:
+                    closed.append((metric_name, self.close_bucket(metric_name, open_bucket)))
+                    del self.buckets[metric_name]
+        cutoff = now - self.window - self.resolution
+        for metric_name, last_timestamp in list(self.last_timestamps.items()):
+            if last_timestamp < cutoff and metric_name not in self.buckets:
+                del self.last_timestamps[metric_name]
+        return closed
+
+    def pop_counts(self):
+        """
+        The counts of the dropped and aggregated datapoints since the last
+        call.
+
+        :return: a list of ``(name, count)`` tuples
+        :rtype: list
+        """
+        counts = [(name, count) for name, count in self.counts.items() if count]
+        for name, count in counts:
+            self.counts[name] = 0
+        return counts
@@ -1,4 +1,7 @@
 import socket
+# @added 20261018 - Multi-client pickle listener
+import select
+import errno
 from os import kill, getpid
 try:
     from Queue import Full
@@ -15,6 +18,10 @@ import os.path
 from os import remove as os_remove
 import settings
 from skyline_functions import send_graphite_metric
+# @added 20261018 - Horizon disk spool
+from spool import SpoolWriter
+# @added 20261018 - Horizon stage instrumentation
+from stage_stats import StageStats
 
 parent_skyline_app = 'horizon'
 child_skyline_app = 'listen'
@@ -37,6 +44,81 @@ skyline_app_graphite_namespace = 'skyline.%s%s.%s' % (
 
 python_version = int(sys.version_info[0])
 
+# @added 20261018 - Multi-client pickle listener
+# The pickle listener serves multiple concurrent connections, reading at most
+# PICKLE_RECV_SIZE bytes from each readable connection per select round so
+# that one busy or slow relay cannot starve the others.  Frames declaring a
+# length greater than PICKLE_MAX_FRAME_SIZE are considered garbage and the
+# connection is dropped.
+try:
+    PICKLE_MAX_CONNECTIONS = int(settings.PICKLE_MAX_CONNECTIONS)
+except:
+    PICKLE_MAX_CONNECTIONS = 64
+PICKLE_RECV_SIZE = 65536
+PICKLE_MAX_FRAME_SIZE = 64 * 1024 * 1024
+LISTEN_SELECT_TIMEOUT = 1
+
+# @added 20261018 - Zero-copy framed reads
+# When a connection is part way through a large frame, up to
+# PICKLE_MAX_RECV_SIZE bytes are read in one recv_into rather than
+# PICKLE_RECV_SIZE, to reduce the number of syscalls for many MB
+# carbon-relay batches.
+PICKLE_MAX_RECV_SIZE = 4 * 1024 * 1024
+pickle_length_struct = Struct('!I')
+
+# @added 20261018 - Batched UDP ingestion
+# The UDP listener receives into a reusable buffer large enough for the
+# largest possible datagram and drains up to UDP_DRAIN_MAX_DATAGRAMS
+# datagrams from the socket each time it becomes readable.
+try:
+    UDP_RECEIVE_BUFFER_SIZE = int(settings.UDP_RECEIVE_BUFFER_SIZE)
+except:
+    UDP_RECEIVE_BUFFER_SIZE = 8388608
+UDP_MAX_DATAGRAM_SIZE = 65535
+UDP_DRAIN_MAX_DATAGRAMS = 1000
+try:
+    string_types = (str, unicode, bytes)
+except NameError:
+    string_types = (str, bytes)
+
+# @added 20261018 - Plaintext line listener
+# Lines longer than LINE_MAX_LENGTH are considered garbage and the connection
+# is dropped.
+LINE_RECV_SIZE = 65536
+LINE_MAX_LENGTH = 4096
+
+# @added 20261018 - SO_REUSEPORT sharded listeners
+# socket.SO_REUSEPORT is not defined in python 2, 15 is the Linux value
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+
+# @added 20261018 - Horizon disk spool
+# If HORIZON_SPOOL_DIR is set, chunks that cannot be put on the queue because
+# it is full are appended to the disk spool, for the workers to replay, rather
+# than being dropped.  The number of datapoints spooled is reported every
+# SPOOL_REPORT_INTERVAL seconds.
+try:
+    HORIZON_SPOOL_DIR = settings.HORIZON_SPOOL_DIR
+except:
+    HORIZON_SPOOL_DIR = None
+try:
+    HORIZON_SPOOL_MAX_BYTES = int(settings.HORIZON_SPOOL_MAX_BYTES)
+except:
+    HORIZON_SPOOL_MAX_BYTES = 1073741824
+SPOOL_REPORT_INTERVAL = 10
+# Once the queue accepts chunks again the open spool segment is closed, if it
+# has been open for at least SPOOL_MIN_SEGMENT_AGE seconds, so that a queue
+# that is only just full does not create many tiny segments.
+SPOOL_MIN_SEGMENT_AGE = 1
+
+# @added 20261018 - Horizon stage instrumentation
+# The socket_read, deserialise and queue_put stage metrics are sent every
+# HORIZON_STAGE_METRICS_INTERVAL seconds, if it is 0 they are not sent
+try:
+    HORIZON_STAGE_METRICS_INTERVAL = int(settings.HORIZON_STAGE_METRICS_INTERVAL)
+except:
+    HORIZON_STAGE_METRICS_INTERVAL = 60
+LISTEN_STAGES = ('socket_read', 'deserialise', 'queue_put')
+
 # SafeUnpickler taken from Carbon: https://github.com/graphite-project/carbon/blob/master/lib/carbon/util.py
 if python_version == 2:
     try:
@@ -103,15 +185,182 @@ else:
 
         @classmethod
         def loads(cls, pickle_string):
-            return cls(StringIO(pickle_string)).load()
+            # @modified 20261018 - Zero-copy framed reads
+            # StringIO is not defined under python3
+            # return cls(StringIO(pickle_string)).load()
+            return cls(io.BytesIO(pickle_string)).load()
 # //SafeUnpickler
 
 
+class FrameBuffer(object):
+    """
+    A reusable receive buffer for a stream of length prefixed frames.
+
+    # @added 20261018 - Zero-copy framed reads
+    Data is received directly into a preallocated bytearray with recv_into and
+    all the complete frames in the buffer are returned as memoryview slices of
+    it, so a single recv can yield multiple frames without building a new
+    string per recv.  The buffer is only compacted or grown when there is not
+    enough room for the next recv.  A frame memoryview is only valid until the
+    next call to :meth:`recv_into`.
+    """
+
+    def __init__(self, size=PICKLE_RECV_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        # The start of the data that has not been returned as a frame yet and
+        # the end of the received data
+        self.start = 0
+        self.end = 0
+
+    def pending_frame_bytes(self):
+        """
+        The number of bytes still required to complete the current frame.
+        """
+        pending = self.end - self.start
+        if pending < 4:
+            return 4 - pending
+        length = pickle_length_struct.unpack_from(self.buffer, self.start)[0]
+        return max(length + 4 - pending, 0)
+
+    def _make_room(self, nbytes):
+        pending = self.end - self.start
+        required = pending + nbytes
+        if required > len(self.buffer):
+            new_buffer = bytearray(max(required, len(self.buffer) * 2))
+            new_buffer[0:pending] = self.view[self.start:self.end]
+            self.buffer = new_buffer
+            self.view = memoryview(self.buffer)
+        elif pending:
+            self.buffer[0:pending] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+    def recv_into(self, sock, nbytes):
+        """
+        Receive up to nbytes from the socket into the buffer.
+
+        :return: the number of bytes received, 0 if the connection closed
+        :rtype: int
+        """
+        if len(self.buffer) - self.end < nbytes:
+            self._make_room(nbytes)
+        count = sock.recv_into(self.view[self.end:self.end + nbytes], nbytes)
+        self.end += count
+        return count
+
+    def frames(self):
+        """
+        Generate a memoryview of the body of each complete frame in the buffer.
+        """
+        while self.end - self.start >= 4:
+            length = pickle_length_struct.unpack_from(self.buffer, self.start)[0]
+            if length > PICKLE_MAX_FRAME_SIZE:
+                raise ValueError('frame length %s exceeds PICKLE_MAX_FRAME_SIZE' % str(length))
+            if self.end - self.start < length + 4:
+                break
+            body = self.view[self.start + 4:self.start + 4 + length]
+            self.start += length + 4
+            yield body
+        if self.start == self.end:
+            self.start = 0
+            self.end = 0
+
+
+class LineBuffer(FrameBuffer):
+    """
+    A reusable receive buffer for a stream of newline terminated lines.
+
+    # @added 20261018 - Plaintext line listener
+    Data is received directly into the preallocated buffer and split into
+    lines incrementally, a partial line at the end of a recv is kept in the
+    buffer until the rest of it is received.
+    """
+
+    def __init__(self, size=LINE_RECV_SIZE):
+        super(LineBuffer, self).__init__(size)
+
+    def lines(self):
+        """
+        Generate each complete line in the buffer, without the line ending.
+        """
+        buffer = self.buffer
+        while self.start < self.end:
+            line_end = buffer.find(b'\n', self.start, self.end)
+            if line_end == -1:
+                if self.end - self.start > LINE_MAX_LENGTH:
+                    raise ValueError('line length exceeds LINE_MAX_LENGTH')
+                break
+            line = self.view[self.start:line_end].tobytes()
+            self.start = line_end + 1
+            yield line
+        if self.start == self.end:
+            self.start = 0
+            self.end = 0
+
+
+def parse_line(line):
+    """
+    Parse a Graphite plaintext protocol line, ``<metric> <value> <timestamp>``,
+    into a ``(metric, (timestamp, value))`` datapoint, the same as the
+    datapoints in a pickle.  A timestamp of -1 is the current time, as it is
+    in carbon.
+
+    # @added 20261018 - Plaintext line listener
+
+    :param line: the line
+    :type line: bytes
+    :return: the datapoint or ``None`` if the line is not valid
+    :rtype: tuple
+    """
+    parts = line.split()
+    if len(parts) != 3:
+        return None
+    metric, value, timestamp = parts
+    try:
+        value = float(value)
+        timestamp = int(float(timestamp))
+    except ValueError:
+        return None
+    # Drop nan values as carbon does
+    if value != value:
+        return None
+    if timestamp == -1:
+        timestamp = int(time())
+    if python_version == 3:
+        metric = metric.decode('utf-8', 'replace')
+    return (metric, (timestamp, value))
+
+
+def valid_datapoint(datapoint):
+    """
+    Whether a datapoint unpacked from a UDP datagram has the shape of a
+    ``[<metric>, [<timestamp>, <value>]]`` datapoint.
+
+    # @added 20261018 - Batched UDP ingestion
+
+    :param datapoint: the unpacked datapoint
+    :return: whether the datapoint is valid
+    :rtype: boolean
+    """
+    if not isinstance(datapoint, (list, tuple)) or len(datapoint) != 2:
+        return False
+    if not isinstance(datapoint[0], string_types):
+        return False
+    if not isinstance(datapoint[1], (list, tuple)) or len(datapoint[1]) != 2:
+        return False
+    return True
+
+
 class Listen(Process):
     """
     The listener is responsible for listening on a port.
     """
-    def __init__(self, port, queue, parent_pid, type="pickle"):
+    # @modified 20261018 - SO_REUSEPORT sharded listeners
+    # Added reuse_port
+    # @modified 20261018 - Horizon stage instrumentation
+    # Added process_number
+    def __init__(self, port, queue, parent_pid, type="pickle", reuse_port=False, process_number=0):
         super(Listen, self).__init__()
         try:
             self.ip = settings.HORIZON_IP
@@ -124,6 +373,24 @@ class Listen(Process):
         self.parent_pid = parent_pid
         self.current_pid = getpid()
         self.type = type
+        # @added 20261018 - SO_REUSEPORT sharded listeners
+        # When multiple listener processes are started for a port they all
+        # bind it with SO_REUSEPORT and the kernel distributes the
+        # connections and datagrams between them
+        self.reuse_port = reuse_port
+        # @added 20261018 - Horizon disk spool
+        if HORIZON_SPOOL_DIR:
+            self.spool = SpoolWriter(HORIZON_SPOOL_DIR, HORIZON_SPOOL_MAX_BYTES)
+        else:
+            self.spool = None
+        self.datapoints_spooled = 0
+        self.spool_last_reported = time()
+        # @added 20261018 - Horizon stage instrumentation
+        # Each listener process reports its own stage metrics, under
+        # listen.<type>.<process_number>
+        self.stage_stats = StageStats(
+            skyline_app, '%s.%s.%s' % (skyline_app_graphite_namespace, type, str(process_number)),
+            LISTEN_STAGES, HORIZON_STAGE_METRICS_INTERVAL)
 
         # Use the safe unpickler that comes with carbon rather than standard python pickle/cpickle
         self.unpickler = SafeUnpickler
@@ -141,23 +408,39 @@ class Listen(Process):
     def read_all(self, sock, n):
         """
         Read n bytes from a stream
+
+        # @modified 20261018 - Zero-copy framed reads
+        Receive into a preallocated bytearray with recv_into rather than
+        building the data with repeated string concatenation, which is
+        quadratic for large frames.
         """
-        data = ''
-        while n > 0:
+        data = bytearray(n)
+        view = memoryview(data)
+        received = 0
+        while received < n:
             # Break the loop when connection closes. #8 @earthgecko
             # https://github.com/earthgecko/skyline/pull/8/files
             # @earthgecko merged 1 commit into earthgecko:master from
             # mlowicki:fix_infinite_loop on 16 Mar 2015
             # Break the loop when connection closes. #115 @etsy
-            chunk = sock.recv(n)
-            count = len(chunk)
+            count = sock.recv_into(view[received:], n - received)
 
             if count == 0:
                 break
 
-            n -= count
-            data += chunk
-        return data
+            received += count
+        return bytes(data[:received])
+
+    def bind_socket(self, s):
+        """
+        Bind the socket to the listener ip and port, with SO_REUSEPORT if this
+        is one of multiple listener processes for the port.
+
+        # @added 20261018 - SO_REUSEPORT sharded listeners
+        """
+        if self.reuse_port:
+            s.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        s.bind((self.ip, self.port))
 
     def check_if_parent_is_alive(self):
         """
@@ -169,100 +452,475 @@ class Listen(Process):
         except:
             exit(0)
 
+    def put_chunk(self, chunk, protocol):
+        """
+        Put a chunk of metrics on the queue, dropping the chunk if the queue
+        is full.
+
+        # @added 20261018 - Multi-client pickle listener
+        This was previously inline in each listener.
+
+        # @modified 20261018 - Horizon disk spool
+        If the disk spool is enabled the chunk is spooled rather than dropped
+        when the queue is full, it is only dropped if the spool is full too.
+
+        :param chunk: the list of metrics
+        :param protocol: the listener protocol, used in the log and the
+            ``<protocol>_chunks_dropped`` metric
+        :type chunk: list
+        :type protocol: str
+        :return: ``True`` if the chunk was queued, ``False`` if spooled or
+            dropped
+        :rtype: boolean
+        """
+        # @added 20261018 - Horizon stage instrumentation
+        put_start = time()
+        try:
+            self.q.put(list(chunk), block=False)
+            self.stage_stats.record('queue_put', time() - put_start, len(chunk))
+            # @added 20261018 - Horizon disk spool
+            # The queue is accepting chunks again, make the spooled chunks
+            # available to be replayed
+            if self.spool:
+                self.spool.rotate_if_due(SPOOL_MIN_SEGMENT_AGE)
+                self.report_spooled(protocol)
+            return True
+
+        # Drop chunk if queue is full
+        # @modified 20261018 - Hash sharded workers
+        # A ShardedQueue only drops the datapoints of the shards that are full
+        # except Full:
+        #     chunks_dropped = str(len(chunk))
+        except Full as e:
+            self.stage_stats.record('queue_put', time() - put_start, 0)
+            # @added 20261018 - Horizon disk spool
+            if self.spool:
+                full_chunk = getattr(e, 'dropped_chunk', None) or list(chunk)
+                try:
+                    spooled = self.spool.write(full_chunk)
+                except Exception as err:
+                    logger.error(
+                        '%s :: failed to spool chunk - %s' % (skyline_app, err))
+                    spooled = False
+                if spooled:
+                    self.datapoints_spooled += len(full_chunk)
+                    self.report_spooled(protocol)
+                    return False
+                logger.info(
+                    '%s :: %s queue is full and the spool is full' % (skyline_app, protocol))
+
+            chunks_dropped = str(getattr(e, 'dropped', len(chunk)))
+            logger.info(
+                '%s :: %s queue is full, dropping %s datapoints'
+                % (skyline_app, protocol, chunks_dropped))
+#            self.send_graphite_metric(
+#                'skyline.horizon.' + SERVER_METRIC_PATH + 'pickle_chunks_dropped',
+#                chunks_dropped)
+            send_metric_name = '%s.%s_chunks_dropped' % (
+                skyline_app_graphite_namespace, protocol.lower())
+            send_graphite_metric(skyline_app, send_metric_name, chunks_dropped)
+            return False
+
+    def report_spooled(self, protocol):
+        """
+        Log and send the number of datapoints spooled, at most every
+        SPOOL_REPORT_INTERVAL seconds.
+
+        # @added 20261018 - Horizon disk spool
+        """
+        now = time()
+        if now - self.spool_last_reported < SPOOL_REPORT_INTERVAL:
+            return
+        self.spool_last_reported = now
+        if not self.datapoints_spooled:
+            return
+        logger.info(
+            '%s :: %s queue is full, spooled %s datapoints in the last %s seconds'
+            % (skyline_app, protocol, str(self.datapoints_spooled), str(SPOOL_REPORT_INTERVAL)))
+        send_metric_name = '%s.%s_datapoints_spooled' % (
+            skyline_app_graphite_namespace, protocol.lower())
+        send_graphite_metric(skyline_app, send_metric_name, str(self.datapoints_spooled))
+        self.datapoints_spooled = 0
+
     def listen_pickle(self):
         """
         Listen for pickles over tcp
+
+        # @modified 20261018 - Multi-client pickle listener
+        Previously the listener accepted a single connection and served it
+        until it dropped, so only one carbon-relay could send to Horizon and a
+        slow sender stalled all ingestion.  The listener now uses select to
+        serve up to PICKLE_MAX_CONNECTIONS concurrent connections, each with
+        its own framing buffer, and reads at most PICKLE_RECV_SIZE bytes from
+        each readable connection per round.  A slow relay only ever delays its
+        own partially received frame.
         """
         while 1:
             try:
                 # Set up the TCP listening socket
                 s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                s.bind((self.ip, self.port))
-                s.setblocking(1)
-                s.listen(5)
+                # @modified 20261018 - SO_REUSEPORT sharded listeners
+                # s.bind((self.ip, self.port))
+                self.bind_socket(s)
+                s.setblocking(0)
+                s.listen(PICKLE_MAX_CONNECTIONS)
                 logger.info('%s :: listening over tcp for pickles on %s' % (skyline_app, self.port))
+            except Exception as e:
+                logger.info('%s :: can not connect to socket: %s' % (skyline_app, str(e)))
+                break
 
-                (conn, address) = s.accept()
-                logger.info('%s :: connection from %s:%s' % (skyline_app, address[0], self.port))
-
-                chunk = []
+            # The framing buffer of each connection
+            connections = {}
+            addresses = {}
+            chunk = []
+            # @added 20261018 - Horizon stage instrumentation
+            stage_stats = self.stage_stats
+            try:
                 while 1:
                     self.check_if_parent_is_alive()
+                    stage_stats.send_if_due()
+                    read_sockets = [s] + list(connections.keys())
                     try:
-                        length = Struct('!I').unpack(self.read_all(conn, 4))
-                        body = self.read_all(conn, length[0])
-
-                        # Iterate and chunk each individual datapoint
-                        for bunch in self.gen_unpickle(body):
-                            for metric in bunch:
-                                chunk.append(metric)
-
-                                # Queue the chunk and empty the variable
-                                if len(chunk) > settings.CHUNK_SIZE:
-                                    try:
-                                        self.q.put(list(chunk), block=False)
-                                        chunk[:] = []
-
-                                    # Drop chunk if queue is full
-                                    except Full:
-                                        chunks_dropped = str(len(chunk))
-                                        logger.info(
-                                            '%s :: pickle queue is full, dropping %s datapoints'
-                                            % (skyline_app, chunks_dropped))
-#                                        self.send_graphite_metric(
-#                                            'skyline.horizon.' + SERVER_METRIC_PATH + 'pickle_chunks_dropped',
-#                                            chunks_dropped)
-                                        send_metric_name = '%s.pickle_chunks_dropped' % skyline_app_graphite_namespace
-                                        send_graphite_metric(skyline_app, send_metric_name, chunks_dropped)
-                                        chunk[:] = []
-
-                    except Exception as e:
-                        logger.info(e)
-                        logger.info('%s :: incoming pickle connection dropped, attempting to reconnect' % skyline_app)
-                        break
+                        readable, writable, errored = select.select(
+                            read_sockets, [], read_sockets, LISTEN_SELECT_TIMEOUT)
+                    except select.error as e:
+                        if e.args[0] == errno.EINTR:
+                            continue
+                        raise
+
+                    # Do not leave a partial chunk waiting when the connections
+                    # are idle
+                    if not readable and not errored and chunk:
+                        self.put_chunk(chunk, 'pickle')
+                        chunk[:] = []
+                        continue
+
+                    close_sockets = set(errored)
+                    for sock in readable:
+                        if sock is s:
+                            try:
+                                (conn, address) = s.accept()
+                            except socket.error:
+                                continue
+                            if len(connections) >= PICKLE_MAX_CONNECTIONS:
+                                logger.error(
+                                    '%s :: refusing connection from %s, PICKLE_MAX_CONNECTIONS of %s reached' % (
+                                        skyline_app, address[0], str(PICKLE_MAX_CONNECTIONS)))
+                                conn.close()
+                                continue
+                            conn.setblocking(0)
+                            # @modified 20261018 - Zero-copy framed reads
+                            # connections[conn] = b''
+                            connections[conn] = FrameBuffer()
+                            addresses[conn] = address
+                            logger.info('%s :: connection from %s:%s' % (skyline_app, address[0], self.port))
+                            continue
+
+                        if sock in close_sockets:
+                            continue
+
+                        # @modified 20261018 - Zero-copy framed reads
+                        # Receive into the connection FrameBuffer and process
+                        # every complete frame it holds
+                        frame_buffer = connections[sock]
+                        recv_size = min(
+                            max(PICKLE_RECV_SIZE, frame_buffer.pending_frame_bytes()),
+                            PICKLE_MAX_RECV_SIZE)
+                        read_start = time()
+                        try:
+                            count = frame_buffer.recv_into(sock, recv_size)
+                        except socket.error as e:
+                            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                                continue
+                            count = 0
+                        stage_stats.record('socket_read', time() - read_start, count)
+
+                        # Break the loop when connection closes. #115 @etsy
+                        if not count:
+                            close_sockets.add(sock)
+                            continue
 
+                        try:
+                            for body in frame_buffer.frames():
+                                # @modified 20261018 - Horizon stage instrumentation
+                                # Unpickle the frame before chunking it so that
+                                # the deserialise stage is timed on its own
+                                # for bunch in self.gen_unpickle(body):
+                                deserialise_start = time()
+                                bunches = list(self.gen_unpickle(body))
+                                stage_stats.record(
+                                    'deserialise', time() - deserialise_start,
+                                    sum(len(bunch) for bunch in bunches))
+                                # Iterate and chunk each individual datapoint
+                                for bunch in bunches:
+                                    for metric in bunch:
+                                        chunk.append(metric)
+
+                                        # Queue the chunk and empty the variable
+                                        if len(chunk) > settings.CHUNK_SIZE:
+                                            self.put_chunk(chunk, 'pickle')
+                                            chunk[:] = []
+                        except Exception as e:
+                            logger.info(e)
+                            close_sockets.add(sock)
+
+                    for sock in close_sockets:
+                        address = addresses.pop(sock, ('unknown', None))
+                        connections.pop(sock, None)
+                        try:
+                            sock.close()
+                        except:
+                            pass
+                        logger.info('%s :: incoming pickle connection from %s dropped' % (skyline_app, address[0]))
             except Exception as e:
-                logger.info('%s :: can not connect to socket: %s' % (skyline_app, str(e)))
-                break
+                logger.info('%s :: pickle listener error, closing connections and reconnecting: %s' % (skyline_app, str(e)))
+                for sock in list(connections.keys()) + [s]:
+                    try:
+                        sock.close()
+                    except:
+                        pass
+                sleep(1)
 
     def listen_udp(self):
         """
         Listen over udp for MessagePack strings
+
+        # @modified 20261018 - Batched UDP ingestion
+        A datagram can be a single ``[<metric>, [<timestamp>, <value>]]`` or an
+        array of them, ``[[<metric>, [<timestamp>, <value>]], ...]``, so that
+        emitters can batch.  Previously recvfrom(1024) truncated any datagram
+        over 1 KB.  Datagrams are now received into a reusable 64 KB buffer
+        with a UDP_RECEIVE_BUFFER_SIZE socket receive buffer and the socket is
+        drained before the datapoints are queued.  Datapoints are queued in
+        the order they were received, so per metric ordering is preserved.
         """
         while 1:
             try:
                 s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                s.bind((self.ip, self.port))
+                try:
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RECEIVE_BUFFER_SIZE)
+                except socket.error as e:
+                    logger.error('%s :: failed to set UDP SO_RCVBUF to %s: %s' % (
+                        skyline_app, str(UDP_RECEIVE_BUFFER_SIZE), str(e)))
+                # @modified 20261018 - SO_REUSEPORT sharded listeners
+                # s.bind((self.ip, self.port))
+                self.bind_socket(s)
+                s.setblocking(0)
                 logger.info('%s :: listening over udp for messagepack on %s' % (skyline_app, self.port))
 
+                datagram_buffer = bytearray(UDP_MAX_DATAGRAM_SIZE)
+                datagram_view = memoryview(datagram_buffer)
                 chunk = []
+                # @added 20261018 - Horizon stage instrumentation
+                stage_stats = self.stage_stats
                 while 1:
                     self.check_if_parent_is_alive()
-                    data, addr = s.recvfrom(1024)
-                    metric = unpackb(data)
-                    chunk.append(metric)
-
-                    # Queue the chunk and empty the variable
-                    if len(chunk) > settings.CHUNK_SIZE:
+                    stage_stats.send_if_due()
+                    try:
+                        readable, writable, errored = select.select(
+                            [s], [], [], LISTEN_SELECT_TIMEOUT)
+                    except select.error as e:
+                        if e.args[0] == errno.EINTR:
+                            continue
+                        raise
+                    if not readable:
+                        continue
+
+                    # Drain the socket
+                    for datagram_count in range(UDP_DRAIN_MAX_DATAGRAMS):
+                        read_start = time()
+                        try:
+                            nbytes, addr = s.recvfrom_into(datagram_buffer, UDP_MAX_DATAGRAM_SIZE)
+                        except socket.error as e:
+                            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                                break
+                            raise
+                        deserialise_start = time()
+                        stage_stats.record('socket_read', deserialise_start - read_start, nbytes)
+                        chunk_length = len(chunk)
+                        # @modified 20261018 - Batched UDP ingestion
+                        # Only datapoints with a valid shape are added to the
+                        # chunk and an error in a datagram is handled here,
+                        # so that a bad datagram is dropped rather than
+                        # reaching the outer except, which stops the listener
                         try:
-                            self.q.put(list(chunk), block=False)
+                            data = unpackb(datagram_view[:nbytes])
+                            if not isinstance(data, (list, tuple)) or not data:
+                                logger.info('%s :: invalid UDP datagram from %s' % (
+                                    skyline_app, str(addr[0])))
+                                continue
+                            if isinstance(data[0], string_types):
+                                # A single [<metric>, [<timestamp>, <value>]]
+                                data = [data]
+                            invalid_datapoints = 0
+                            for metric in data:
+                                if valid_datapoint(metric):
+                                    chunk.append(metric)
+                                else:
+                                    invalid_datapoints += 1
+                            if invalid_datapoints:
+                                logger.info('%s :: %s invalid datapoints in UDP datagram from %s' % (
+                                    skyline_app, str(invalid_datapoints), str(addr[0])))
+                        except Exception as e:
+                            logger.info('%s :: invalid UDP datagram from %s: %s' % (
+                                skyline_app, str(addr[0]), str(e)))
+                            continue
+                        stage_stats.record(
+                            'deserialise', time() - deserialise_start, len(chunk) - chunk_length)
+
+                        # Queue the chunk and empty the variable
+                        if len(chunk) > settings.CHUNK_SIZE:
+                            # @modified 20261018 - Multi-client pickle listener
+                            # Use put_chunk
+                            self.put_chunk(chunk, 'UDP')
                             chunk[:] = []
 
-                        # Drop chunk if queue is full
-                        except Full:
-                            chunks_dropped = str(len(chunk))
-                            logger.info(
-                                '%s :: UDP queue is full, dropping %s datapoints'
-                                % (skyline_app, chunks_dropped))
-                            send_metric_name = '%s.udp_chunks_dropped' % skyline_app_graphite_namespace
-                            send_graphite_metric(skyline_app, send_metric_name, chunks_dropped)
-                            chunk[:] = []
+                    # Do not leave a partial chunk waiting once the socket
+                    # has been drained
+                    if chunk:
+                        self.put_chunk(chunk, 'UDP')
+                        chunk[:] = []
 
             except Exception as e:
                 logger.info('%s :: cannot connect to socket: %s' % (skyline_app, str(e)))
                 break
 
+    def listen_line(self):
+        """
+        Listen for Graphite plaintext protocol lines over tcp
+
+        # @added 20261018 - Plaintext line listener
+        Accepts ``<metric> <value> <timestamp>\\n`` lines, the same as the
+        carbon plaintext protocol, so that senders do not need to go through
+        a relay to reach Horizon.  Like the pickle listener, select is used to
+        serve up to PICKLE_MAX_CONNECTIONS concurrent connections, each with
+        its own LineBuffer, and the parsed datapoints are queued in chunks.
+        Invalid lines are counted and logged once per connection.
+        """
+        while 1:
+            try:
+                # Set up the TCP listening socket
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                # @modified 20261018 - SO_REUSEPORT sharded listeners
+                # s.bind((self.ip, self.port))
+                self.bind_socket(s)
+                s.setblocking(0)
+                s.listen(PICKLE_MAX_CONNECTIONS)
+                logger.info('%s :: listening over tcp for plaintext lines on %s' % (skyline_app, self.port))
+            except Exception as e:
+                logger.info('%s :: can not connect to socket: %s' % (skyline_app, str(e)))
+                break
+
+            connections = {}
+            addresses = {}
+            invalid_lines = {}
+            chunk = []
+            # @added 20261018 - Horizon stage instrumentation
+            stage_stats = self.stage_stats
+            try:
+                while 1:
+                    self.check_if_parent_is_alive()
+                    stage_stats.send_if_due()
+                    read_sockets = [s] + list(connections.keys())
+                    try:
+                        readable, writable, errored = select.select(
+                            read_sockets, [], read_sockets, LISTEN_SELECT_TIMEOUT)
+                    except select.error as e:
+                        if e.args[0] == errno.EINTR:
+                            continue
+                        raise
+
+                    # Do not leave a partial chunk waiting when the connections
+                    # are idle
+                    if not readable and not errored and chunk:
+                        self.put_chunk(chunk, 'line')
+                        chunk[:] = []
+                        continue
+
+                    close_sockets = set(errored)
+                    for sock in readable:
+                        if sock is s:
+                            try:
+                                (conn, address) = s.accept()
+                            except socket.error:
+                                continue
+                            if len(connections) >= PICKLE_MAX_CONNECTIONS:
+                                logger.error(
+                                    '%s :: refusing connection from %s, PICKLE_MAX_CONNECTIONS of %s reached' % (
+                                        skyline_app, address[0], str(PICKLE_MAX_CONNECTIONS)))
+                                conn.close()
+                                continue
+                            conn.setblocking(0)
+                            connections[conn] = LineBuffer()
+                            addresses[conn] = address
+                            invalid_lines[conn] = 0
+                            logger.info('%s :: connection from %s:%s' % (skyline_app, address[0], self.port))
+                            continue
+
+                        if sock in close_sockets:
+                            continue
+
+                        line_buffer = connections[sock]
+                        read_start = time()
+                        try:
+                            count = line_buffer.recv_into(sock, LINE_RECV_SIZE)
+                        except socket.error as e:
+                            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                                continue
+                            count = 0
+                        stage_stats.record('socket_read', time() - read_start, count)
+
+                        if not count:
+                            close_sockets.add(sock)
+                            continue
+
+                        try:
+                            # @modified 20261018 - Horizon stage instrumentation
+                            # Parse the lines before chunking them so that the
+                            # deserialise stage is timed on its own
+                            deserialise_start = time()
+                            metrics = []
+                            for line in line_buffer.lines():
+                                metric = parse_line(line)
+                                if metric is None:
+                                    invalid_lines[sock] += 1
+                                    continue
+                                metrics.append(metric)
+                            stage_stats.record('deserialise', time() - deserialise_start, len(metrics))
+                            for metric in metrics:
+                                chunk.append(metric)
+
+                                # Queue the chunk and empty the variable
+                                if len(chunk) > settings.CHUNK_SIZE:
+                                    self.put_chunk(chunk, 'line')
+                                    chunk[:] = []
+                        except Exception as e:
+                            logger.info(e)
+                            close_sockets.add(sock)
+
+                    for sock in close_sockets:
+                        address = addresses.pop(sock, ('unknown', None))
+                        connections.pop(sock, None)
+                        invalid = invalid_lines.pop(sock, 0)
+                        if invalid:
+                            logger.info('%s :: %s invalid lines received from %s' % (
+                                skyline_app, str(invalid), address[0]))
+                        try:
+                            sock.close()
+                        except:
+                            pass
+                        logger.info('%s :: incoming line connection from %s dropped' % (skyline_app, address[0]))
+            except Exception as e:
+                logger.info('%s :: line listener error, closing connections and reconnecting: %s' % (skyline_app, str(e)))
+                for sock in list(connections.keys()) + [s]:
+                    try:
+                        sock.close()
+                    except:
+                        pass
+                sleep(1)
+
     def run(self):
         """
         Called when process intializes.
@@ -304,5 +962,8 @@ class Listen(Process):
             self.listen_pickle()
         elif self.type == 'udp':
             self.listen_udp()
+        # @added 20261018 - Plaintext line listener
+        elif self.type == 'line':
+            self.listen_line()
         else:
             logger.error('%s :: unknown listener format' % skyline_app)
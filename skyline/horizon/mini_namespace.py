@@ -0,0 +1,87 @@
+"""
+mini_namespace
+
+The datapoints that a Horizon worker appends to the MINI_NAMESPACE keys, as
+set by the MINI_NAMESPACE_MODE:
+
+- ``append`` - every datapoint is appended to the mini key as well as the
+  full key
+- ``rollup`` - the datapoints of each metric are aggregated into
+  MINI_ROLLUP_RESOLUTION buckets by an :class:`ingest_filter.IngestFilter`
+  with the mean aggregation, and the mean of a bucket is appended to the mini
+  key, at the start of the bucket, when a datapoint for a later bucket arrives
+  or, for a metric that has stopped sending, by :meth:`MiniNamespace.sweep`
+  once the bucket is two resolutions old.  The sweep also prunes the metrics
+  that have not sent a datapoint for longer than the window.  The open bucket
+  of each metric is only held in the worker, so the datapoints of the open
+  buckets are only in the full keys if the worker is restarted.
+- ``view`` - nothing is appended to the mini keys and
+  :func:`skyline_functions.get_mini_timeseries` returns the last MINI_DURATION
+  of the full key.
+"""
+
+from ingest_filter import IngestFilter
+
+MINI_NAMESPACE_MODES = ('append', 'rollup', 'view')
+
+
+class MiniNamespace(object):
+    """
+    The mini namespace datapoints of a worker.
+    """
+
+    def __init__(self, mode='append', resolution=300, window=1000):
+        """
+        :param mode: append, rollup or view
+        :param resolution: the rollup resolution in seconds
+        :param window: the number of seconds the worker accepts datapoints
+            for, the rollups of the metrics that have not sent a datapoint for
+            longer are pruned by sweep
+        :type mode: str
+        :type resolution: int
+        :type window: int
+        """
+        if mode not in MINI_NAMESPACE_MODES:
+            raise ValueError('unknown mini namespace mode - %s' % str(mode))
+        self.mode = mode
+        if mode == 'rollup':
+            self.rollups = IngestFilter(
+                drop_duplicates=False, resolution=resolution,
+                aggregation='mean', window=window)
+        else:
+            self.rollups = None
+
+    def datapoint(self, metric_name, datapoint, now):
+        """
+        The datapoint to append to the mini key of a metric for a datapoint
+        appended to its full key.
+
+        :param metric_name: the metric name
+        :param datapoint: the ``(timestamp, value)`` datapoint
+        :param now: the current timestamp
+        :type metric_name: str
+        :type datapoint: tuple
+        :type now: int
+        :return: the datapoint, the mean of a closed rollup bucket or ``None``
+            if there is nothing to append
+        :rtype: tuple
+        """
+        if self.mode == 'append':
+            return datapoint
+        if self.rollups is None:
+            return None
+        return self.rollups.filter(metric_name, datapoint, now)
+
+    def sweep(self, now):
+        """
+        The means of the rollup buckets that are two resolutions old.
+
+        :param now: the current timestamp
+        :type now: int
+        :return: a list of the ``(metric_name, datapoint)`` to append to the
+            mini keys
+        :rtype: list
+        """
+        if self.rollups is None:
+            return []
+        return self.rollups.sweep(now)
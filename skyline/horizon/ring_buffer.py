@@ -0,0 +1,196 @@
+"""
+ring_buffer
+
+A shared memory ring buffer transport between the Horizon listeners and
+workers.
+
+The listeners put chunks of ``(metric, (timestamp, value))`` datapoints on a
+:class:`multiprocessing.Queue`, which pickles each chunk in a feeder thread,
+writes it to a pipe and the worker reads it from the pipe and unpickles it.
+The :class:`RingBuffer` is an alternative with the same ``put``, ``get`` and
+``qsize`` interface, which writes each encoded chunk directly into an
+anonymous shared memory map that is inherited by the forked listener and
+worker processes, with no feeder thread, pipe or extra copies.
+
+Each chunk is written as one message, ``[u32 length][encoded chunk]``.  Chunks
+are encoded with marshal, which only handles the basic types that a chunk is
+made of and round trips a chunk several times faster than pickle or packing
+fixed layout records with struct in Python.  The marshal format is specific to
+the Python version, which is not a concern as the buffer only ever exists
+between the processes of one Horizon.  The timestamp and value types are
+preserved, so the worker gets the same datapoints as the listener received
+and the msgpack encoded data in Redis is unchanged.
+
+A single lock protects the read and write positions, the copies in and out of
+the buffer happen under the lock and a semaphore counts the messages
+available to the consumers.  ``put`` never blocks, if there is not enough free
+space in the buffer the chunk is dropped and :class:`Full` is raised, as with
+``Queue.put(block=False)``.
+"""
+
+import ctypes
+import marshal
+import mmap
+from multiprocessing import Lock, Semaphore, RawArray
+from struct import Struct
+try:
+    from Queue import Empty, Full
+except ImportError:
+    from queue import Empty, Full
+
+DEFAULT_RING_BUFFER_SIZE = 64 * 1024 * 1024
+
+message_header_struct = Struct('<I')
+
+# The marshal format version, version 2 supports floats in binary
+MARSHAL_VERSION = 2
+
+# The indices of the shared counters
+HEAD = 0
+TAIL = 1
+USED = 2
+MESSAGES = 3
+HIGH_WATER_MARK = 4
+DROPPED_CHUNKS = 5
+DROPPED_DATAPOINTS = 6
+COUNTERS = 7
+
+
+def encode_datapoints(chunk):
+    """
+    Encode a chunk of datapoints.
+
+    :param chunk: the list of ``(metric, (timestamp, value))`` datapoints
+    :type chunk: list
+    :return: the encoded chunk
+    :rtype: bytes
+    """
+    return marshal.dumps(chunk, MARSHAL_VERSION)
+
+
+def decode_datapoints(data):
+    """
+    Decode an encoded chunk of datapoints.
+
+    :param data: the encoded chunk
+    :type data: bytes
+    :return: the list of ``(metric, (timestamp, value))`` datapoints
+    :rtype: list
+    """
+    return marshal.loads(data)
+
+
+class RingBuffer(object):
+    """
+    A bounded multiple producer, multiple consumer queue of datapoint chunks
+    in shared memory.  It must be created before the processes that use it
+    are forked.
+    """
+
+    def __init__(self, size=DEFAULT_RING_BUFFER_SIZE):
+        """
+        :param size: the size of the buffer in bytes
+        :type size: int
+        """
+        self.size = int(size)
+        self.buffer = mmap.mmap(-1, self.size)
+        self.counters = RawArray(ctypes.c_longlong, COUNTERS)
+        self.lock = Lock()
+        self.available = Semaphore(0)
+
+    def _write(self, position, data):
+        length = len(data)
+        first = min(length, self.size - position)
+        self.buffer[position:position + first] = bytes(data[:first])
+        if first < length:
+            self.buffer[0:length - first] = bytes(data[first:])
+        return (position + length) % self.size
+
+    def _read(self, position, length):
+        first = min(length, self.size - position)
+        data = self.buffer[position:position + first]
+        if first < length:
+            data += self.buffer[0:length - first]
+        return data, (position + length) % self.size
+
+    def put(self, chunk, block=False, timeout=None):
+        """
+        Put a chunk of datapoints in the buffer.  This never blocks, the block
+        and timeout arguments are only accepted for compatibility with
+        ``Queue.put``.
+
+        :param chunk: the list of ``(metric, (timestamp, value))`` datapoints
+        :type chunk: list
+        :raises Full: if there is not enough free space for the chunk
+        """
+        encoded_chunk = encode_datapoints(chunk)
+        message = message_header_struct.pack(len(encoded_chunk)) + encoded_chunk
+        counters = self.counters
+        with self.lock:
+            if counters[USED] + len(message) > self.size:
+                counters[DROPPED_CHUNKS] += 1
+                counters[DROPPED_DATAPOINTS] += len(chunk)
+                raise Full
+            counters[HEAD] = self._write(counters[HEAD], message)
+            counters[USED] += len(message)
+            counters[MESSAGES] += 1
+            if counters[USED] > counters[HIGH_WATER_MARK]:
+                counters[HIGH_WATER_MARK] = counters[USED]
+        self.available.release()
+
+    def get(self, block=True, timeout=None):
+        """
+        Get the next chunk of datapoints from the buffer.
+
+        :return: the list of ``(metric, (timestamp, value))`` datapoints
+        :rtype: list
+        :raises Empty: if there is no chunk within the timeout
+        """
+        if not block:
+            acquired = self.available.acquire(False)
+        elif timeout is None:
+            acquired = self.available.acquire()
+        else:
+            acquired = self.available.acquire(True, timeout)
+        if not acquired:
+            raise Empty
+        counters = self.counters
+        with self.lock:
+            header, tail = self._read(counters[TAIL], message_header_struct.size)
+            length = message_header_struct.unpack(header)[0]
+            encoded_chunk, tail = self._read(tail, length)
+            counters[TAIL] = tail
+            counters[USED] -= message_header_struct.size + length
+            counters[MESSAGES] -= 1
+        return decode_datapoints(encoded_chunk)
+
+    def qsize(self):
+        """
+        The number of chunks in the buffer.
+        """
+        return self.counters[MESSAGES]
+
+    def stats(self, reset=True):
+        """
+        The buffer usage and drop counters.
+
+        :param reset: reset the high water mark to the current usage and the
+            drop counts to 0
+        :type reset: boolean
+        :return: a dict of used_bytes, high_water_mark, dropped_chunks and
+            dropped_datapoints
+        :rtype: dict
+        """
+        counters = self.counters
+        with self.lock:
+            stats = {
+                'used_bytes': counters[USED],
+                'high_water_mark': counters[HIGH_WATER_MARK],
+                'dropped_chunks': counters[DROPPED_CHUNKS],
+                'dropped_datapoints': counters[DROPPED_DATAPOINTS],
+            }
+            if reset:
+                counters[HIGH_WATER_MARK] = counters[USED]
+                counters[DROPPED_CHUNKS] = 0
+                counters[DROPPED_DATAPOINTS] = 0
+        return stats
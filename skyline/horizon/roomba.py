@@ -3,13 +3,18 @@ from os import kill, getpid
 from redis import StrictRedis, WatchError
 from multiprocessing import Process
 from threading import Thread
-from msgpack import Unpacker, packb
+# @modified 20261018 - Binary timeseries codec
+# from msgpack import Unpacker, packb
 try:
     from types import TupleType
 except ImportError:
     eliminated_in_python3 = True
 from time import time, sleep
 from math import ceil
+# @added 20261018 - Roomba Lua trimming
+from zlib import crc32
+# @added 20261018 - Incremental Roomba
+from bisect import bisect_right
 import traceback
 import logging
 
@@ -19,6 +24,12 @@ from os import remove as os_remove
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
 sys.path.insert(0, os.path.dirname(__file__))
 import settings
+# @added 20261018 - Binary timeseries codec
+from timeseries_codec import TIMESERIES_CODEC, decode_timeseries, encode_timeseries
+# @added 20261018 - Gorilla timeseries blocks
+from timeseries_codec import get_namespace_codec
+# @added 20261018 - Redis shards
+from redis_shards import get_redis_shards
 
 parent_skyline_app = 'horizon'
 child_skyline_app = 'roomba'
@@ -31,6 +42,293 @@ skyline_app_logwait = '%s.wait' % skyline_app_logfile
 
 python_version = int(sys.version_info[0])
 
+# @added 20261018 - Hash sharded workers
+# When the workers are sharded each metric is only appended to by one worker,
+# in the order that the datapoints were received, so the timeseries only
+# need to be sorted if they are found to be out of order.
+try:
+    HORIZON_SHARDED_WORKERS = settings.HORIZON_SHARDED_WORKERS
+except:
+    HORIZON_SHARDED_WORKERS = False
+
+# @added 20261018 - Roomba Lua trimming
+# If ROOMBA_LUA_TRIM is True the keys are trimmed in Redis by the
+# ROOMBA_TRIM_LUA script in batches of ROOMBA_LUA_BATCH_SIZE keys, rather
+# than each key being fetched, trimmed and set by the vacuum process.
+try:
+    ROOMBA_LUA_TRIM = settings.ROOMBA_LUA_TRIM
+except:
+    ROOMBA_LUA_TRIM = False
+try:
+    ROOMBA_LUA_BATCH_SIZE = int(settings.ROOMBA_LUA_BATCH_SIZE)
+except:
+    ROOMBA_LUA_BATCH_SIZE = 20
+# @added 20261018 - Incremental Roomba
+# If ROOMBA_INCREMENTAL is True the workers and Roomba maintain a
+# <namespace>head_timestamps sorted set of the timestamp of the oldest
+# datapoint in each key and Roomba only vacuums the keys with a head timestamp
+# older than the cutoff, with a full vacuum every
+# ROOMBA_INCREMENTAL_FULL_INTERVAL seconds to handle any keys that are not in
+# the sorted set.
+try:
+    ROOMBA_INCREMENTAL = settings.ROOMBA_INCREMENTAL
+except:
+    ROOMBA_INCREMENTAL = False
+try:
+    ROOMBA_INCREMENTAL_FULL_INTERVAL = int(settings.ROOMBA_INCREMENTAL_FULL_INTERVAL)
+except:
+    ROOMBA_INCREMENTAL_FULL_INTERVAL = 3600
+
+# @added 20261018 - Mini namespace rollups
+try:
+    MINI_NAMESPACE_MODE = settings.MINI_NAMESPACE_MODE
+except:
+    MINI_NAMESPACE_MODE = 'append'
+
+# The maximum number of keys fetched from the head_timestamps sorted set at
+# a time
+ROOMBA_INCREMENTAL_BATCH_SIZE = 1000
+
+# KEYS[1] is the namespace unique_metrics set, KEYS[2] the namespace
+# head_timestamps sorted set and KEYS[3..n] the metric keys, ARGV[1] is the
+# timestamp before which datapoints are removed and if ARGV[2] is 1 the
+# head_timestamps of the keys are updated.  The script has
+# the same semantics as vacuum, a key is deleted and removed from the
+# unique_metrics set if it has no datapoints newer than ARGV[1] or it cannot
+# be decoded, otherwise the datapoints are sorted if they are out of order and
+# the old and duplicate timestamp datapoints are removed.  The retained
+# datapoints keep their original msgpack bytes and a key is only set if it has
+# changed.  Returns the number of keys euthanized, active and trimmed.
+ROOMBA_TRIM_LUA = """
+local unique_metrics = KEYS[1]
+local head_timestamps = KEYS[2]
+local oldest = tonumber(ARGV[1])
+local record_heads = ARGV[2] == '1'
+local euthanized = 0
+local active = 0
+local trimmed = 0
+
+local function datapoint_less_than(a, b)
+    if a[1] ~= b[1] then
+        return a[1] < b[1]
+    end
+    local a_is_number = type(a[2]) == 'number'
+    local b_is_number = type(b[2]) == 'number'
+    if a_is_number and b_is_number then
+        return a[2] < b[2]
+    end
+    return a_is_number and not b_is_number
+end
+
+local function euthanize(key)
+    redis.call('DEL', key)
+    redis.call('SREM', unique_metrics, key)
+    if record_heads then
+        redis.call('ZREM', head_timestamps, key)
+    end
+    euthanized = euthanized + 1
+end
+
+local function record_head(key, timestamp)
+    if record_heads then
+        redis.call('ZADD', head_timestamps, timestamp, key)
+    end
+end
+
+-- Trim a key by decoding each datapoint with its bytes, sorting if needed
+local function trim_timeseries(key, raw_series)
+    -- Like the msgpack Unpacker an incomplete datapoint at the end is ignored
+    local timeseries = {}
+    local count = 0
+    local offset = 0
+    local in_order = true
+    local valid = true
+    local truncated = false
+    local single_value = nil
+    while offset >= 0 and offset < #raw_series do
+        local ok, next_offset, datapoint = pcall(cmsgpack.unpack_limit, raw_series, 1, offset)
+        if not ok then
+            if string.find(next_offset, 'Missing bytes') then
+                truncated = true
+            else
+                valid = false
+            end
+            break
+        end
+        if type(datapoint) ~= 'table' or type(datapoint[1]) ~= 'number' then
+            if count == 0 then
+                single_value = datapoint
+            else
+                valid = false
+            end
+            break
+        end
+        local datapoint_end = next_offset
+        if next_offset < 0 then
+            datapoint_end = #raw_series
+        end
+        count = count + 1
+        timeseries[count] = {datapoint[1], datapoint[2], string.sub(raw_series, offset + 1, datapoint_end)}
+        if count > 1 and in_order and datapoint_less_than(timeseries[count], timeseries[count - 1]) then
+            in_order = false
+        end
+        offset = next_offset
+    end
+
+    if not valid then
+        euthanize(key)
+        return
+    end
+    if single_value ~= nil then
+        -- There's one value. Purge if it's too old
+        if type(single_value) ~= 'number' or single_value < oldest then
+            euthanize(key)
+        end
+        return
+    end
+    if count == 0 then
+        return
+    end
+    if not in_order then
+        table.sort(timeseries, datapoint_less_than)
+    end
+    if timeseries[count][1] < oldest then
+        euthanize(key)
+        return
+    end
+    -- Remove old datapoints and duplicates from timeseries
+    local seen = {}
+    local retained = {}
+    local retained_count = 0
+    local head_timestamp = nil
+    for i = 1, count do
+        local timestamp = timeseries[i][1]
+        if timestamp > oldest and not seen[timestamp] then
+            seen[timestamp] = true
+            retained_count = retained_count + 1
+            retained[retained_count] = timeseries[i][3]
+            if not head_timestamp then
+                head_timestamp = timestamp
+            end
+        end
+    end
+    if retained_count == 0 then
+        euthanize(key)
+        return
+    end
+    record_head(key, head_timestamp)
+    if retained_count < count or not in_order or truncated then
+        redis.call('SET', key, table.concat(retained))
+        trimmed = trimmed + 1
+    end
+    active = active + 1
+end
+
+-- The size of a msgpack encoded number or nil from its first byte
+local function number_size(first_byte)
+    if first_byte < 0x80 or first_byte >= 0xe0 or first_byte == 0xc0 then
+        return 1
+    end
+    if first_byte == 0xcb or first_byte == 0xcf or first_byte == 0xd3 then
+        return 9
+    end
+    if first_byte == 0xca or first_byte == 0xce or first_byte == 0xd2 then
+        return 5
+    end
+    if first_byte == 0xcd or first_byte == 0xd1 then
+        return 3
+    end
+    if first_byte == 0xcc or first_byte == 0xd0 then
+        return 2
+    end
+    return nil
+end
+
+-- Scan a timeseries of [timestamp, value] datapoints without decoding them
+-- into tables.  Returns the position and timestamp of the first datapoint
+-- with a timestamp newer than oldest (#raw_series + 1 if there is none), or
+-- nil if the timestamps are not strictly increasing or any datapoint is not
+-- encoded as expected, in which case the key is handled by trim_timeseries.
+local function scan_timeseries(raw_series)
+    local byte = string.byte
+    local unpack = struct.unpack
+    local length = #raw_series
+    local position = 1
+    local first_retained = nil
+    local first_retained_timestamp = nil
+    local previous_timestamp = nil
+    while position <= length do
+        local array_header, timestamp_type = byte(raw_series, position, position + 1)
+        if array_header ~= 0x92 or not timestamp_type then
+            return nil
+        end
+        local timestamp
+        if timestamp_type < 0x80 then
+            timestamp = timestamp_type
+        elseif timestamp_type == 0xce then
+            timestamp = unpack('>I4', raw_series, position + 2)
+        elseif timestamp_type == 0xcb then
+            timestamp = unpack('>d', raw_series, position + 2)
+        elseif timestamp_type == 0xca then
+            timestamp = unpack('>f', raw_series, position + 2)
+        else
+            return nil
+        end
+        local value_position = position + 1 + number_size(timestamp_type)
+        local value_type = byte(raw_series, value_position)
+        if not value_type then
+            return nil
+        end
+        local value_size = number_size(value_type)
+        if not value_size or value_position + value_size - 1 > length then
+            return nil
+        end
+        if previous_timestamp and timestamp <= previous_timestamp then
+            return nil
+        end
+        if not first_retained and timestamp > oldest then
+            first_retained = position
+            first_retained_timestamp = timestamp
+        end
+        previous_timestamp = timestamp
+        position = value_position + value_size
+    end
+    return first_retained or (length + 1), first_retained_timestamp
+end
+
+for k = 3, #KEYS do
+    local key = KEYS[k]
+    local raw_series = redis.pcall('GET', key)
+    if type(raw_series) ~= 'string' then
+        euthanize(key)
+    else
+        -- The usual case is a timeseries with strictly increasing
+        -- timestamps, where only the datapoints before the first datapoint
+        -- newer than oldest need to be removed and the rest of the key can be
+        -- kept as is.  Anything else is handled by trim_timeseries.
+        local first_retained = nil
+        local head_timestamp = nil
+        if #raw_series > 0 then
+            first_retained, head_timestamp = scan_timeseries(raw_series)
+        end
+        if not first_retained then
+            trim_timeseries(key, raw_series)
+        elseif first_retained > #raw_series then
+            euthanize(key)
+        else
+            if first_retained > 1 then
+                redis.call('SET', key, string.sub(raw_series, first_retained))
+                trimmed = trimmed + 1
+            end
+            record_head(key, head_timestamp)
+            active = active + 1
+        end
+    end
+end
+
+return {euthanized, active, trimmed}
+"""
+
 
 class Roomba(Thread):
     """
@@ -56,16 +354,291 @@ class Roomba(Thread):
         except:
             exit(0)
 
-    def vacuum(self, i, namespace, duration):
+    def out_of_order(self, timeseries):
+        """
+        Determine if any datapoint in the timeseries has an older timestamp
+        than the datapoint before it.
+
+        # @added 20261018 - Hash sharded workers
+        """
+        try:
+            previous_timestamp = timeseries[0][0]
+        except (IndexError, TypeError):
+            return False
+        for datapoint in timeseries:
+            if datapoint[0] < previous_timestamp:
+                return True
+            previous_timestamp = datapoint[0]
+        return False
+
+    def strictly_increasing(self, timestamps):
+        """
+        Determine if every timestamp is newer than the timestamp before it, in
+        one pass that stops at the first that is not.
+
+        # @added 20261018 - Incremental Roomba
+        """
+        previous_timestamp = None
+        for timestamp in timestamps:
+            if previous_timestamp is not None and timestamp <= previous_timestamp:
+                return False
+            previous_timestamp = timestamp
+        return True
+
+    def vacuum_lua(self, i, namespace, duration):
+        """
+        Trim metrics that are older than settings.FULL_DURATION and purge old
+        metrics in Redis with the ROOMBA_TRIM_LUA script.
+
+        # @added 20261018 - Roomba Lua trimming
+        The unique_metrics set is walked with SSCAN rather than SMEMBERS and
+        this vacuum process handles the keys where crc32(key) modulo
+        ROOMBA_PROCESSES is i - 1.  The keys are trimmed in batches of
+        ROOMBA_LUA_BATCH_SIZE per EVALSHA, as Redis scripts are atomic there
+        is no WATCH and no retrying of blocked keys, and only the counts are
+        returned to Roomba.
+        """
+        begin = time()
+        logger.info('%s :: started lua vacuum' % (skyline_app))
+
+        namespace_unique_metrics = '%sunique_metrics' % str(namespace)
+        # @added 20261018 - Incremental Roomba
+        namespace_head_timestamps = '%shead_timestamps' % str(namespace)
+        if ROOMBA_INCREMENTAL:
+            record_heads = 1
+        else:
+            record_heads = 0
+        trim_script = self.redis_conn.register_script(ROOMBA_TRIM_LUA)
+        processes = settings.ROOMBA_PROCESSES
+
+        euthanized = 0
+        trimmed_keys = 0
+        active_keys = 0
+        operated_on = 0
+        batches = 0
+
+        def trim_batch(batch):
+            oldest = time() - duration
+            return trim_script(
+                keys=[namespace_unique_metrics, namespace_head_timestamps] + batch,
+                args=[oldest, record_heads])
+
+        batch = []
+        cursor = 0
+        while True:
+            self.check_if_parent_is_alive()
+            cursor, keys = self.redis_conn.sscan(
+                namespace_unique_metrics, cursor=cursor, count=ROOMBA_LUA_BATCH_SIZE)
+            for key in keys:
+                if processes > 1:
+                    if (crc32(key) & 0xffffffff) % processes != i - 1:
+                        continue
+                batch.append(key)
+                if len(batch) >= ROOMBA_LUA_BATCH_SIZE:
+                    batch_euthanized, batch_active, batch_trimmed = trim_batch(batch)
+                    euthanized += batch_euthanized
+                    active_keys += batch_active
+                    trimmed_keys += batch_trimmed
+                    operated_on += len(batch)
+                    batches += 1
+                    batch = []
+            if int(cursor) == 0:
+                break
+        if batch:
+            batch_euthanized, batch_active, batch_trimmed = trim_batch(batch)
+            euthanized += batch_euthanized
+            active_keys += batch_active
+            trimmed_keys += batch_trimmed
+            operated_on += len(batch)
+            batches += 1
+
+        logger.info(
+            '%s :: vacuum operated on %s %d keys in %d batches in %f seconds' %
+            (skyline_app, namespace, operated_on, batches, time() - begin))
+        logger.info('%s :: vaccum %s keyspace is now %d keys' % (skyline_app, namespace, (operated_on - euthanized)))
+        logger.info('%s :: vacuum euthanized %d geriatric keys' % (skyline_app, euthanized))
+        logger.info('%s :: vacuum processed %d active keys' % (skyline_app, active_keys))
+        logger.info('%s :: vacuum trimmed %d keys' % (skyline_app, trimmed_keys))
+
+    def vacuum_incremental(self, i, namespace, duration):
+        """
+        Trim only the metrics that have datapoints older than
+        settings.FULL_DURATION and purge old metrics.
+
+        # @added 20261018 - Incremental Roomba
+        The keys to vacuum are the keys in the namespace head_timestamps
+        sorted set with a head timestamp older than the cutoff, this vacuum
+        process handles the keys where crc32(key) modulo ROOMBA_PROCESSES is
+        i - 1.  If the timestamps of a key are strictly increasing, which is
+        the norm, the datapoints to remove are found with a binary search of
+        the timestamps, otherwise the timeseries is sorted and deduped as in
+        vacuum.  The head timestamp of the key is updated in the same
+        transaction as the key is trimmed.  A key that is being written to
+        while it is trimmed is retried, as in vacuum.
+        """
+        begin = time()
+        logger.info('%s :: started incremental vacuum' % (skyline_app))
+
+        namespace_unique_metrics = '%sunique_metrics' % str(namespace)
+        namespace_head_timestamps = '%shead_timestamps' % str(namespace)
+        processes = settings.ROOMBA_PROCESSES
+        cutoff = time() - duration
+        # @added 20261018 - Gorilla timeseries blocks
+        codec = get_namespace_codec(namespace)
+
+        # Discover the assigned metrics that need to be trimmed
+        assigned_metrics = []
+        start = 0
+        while True:
+            keys = self.redis_conn.zrangebyscore(
+                namespace_head_timestamps, '-inf', cutoff, start=start,
+                num=ROOMBA_INCREMENTAL_BATCH_SIZE)
+            for key in keys:
+                if processes > 1:
+                    if (crc32(key) & 0xffffffff) % processes != i - 1:
+                        continue
+                assigned_metrics.append(key)
+            if len(keys) < ROOMBA_INCREMENTAL_BATCH_SIZE:
+                break
+            start += ROOMBA_INCREMENTAL_BATCH_SIZE
+
+        euthanized = 0
+        blocked = 0
+        trimmed_keys = 0
+        sorted_keys = 0
+
+        for key in assigned_metrics:
+            self.check_if_parent_is_alive()
+
+            pipe = self.redis_conn.pipeline()
+            now = time()
+            delta = now - duration
+            try:
+                pipe.watch(key)
+                raw_series = pipe.get(key)
+                # @modified 20261018 - Binary timeseries codec
+                timeseries = decode_timeseries(raw_series)
+                pipe.multi()
+
+                # @modified 20261018 - Incremental Roomba
+                # A missing or empty key is euthanized as in vacuum, rather
+                # than being left in the unique_metrics set until the next
+                # full vacuum
+                if not timeseries:
+                    pipe.delete(key)
+                    pipe.srem(namespace_unique_metrics, key)
+                    pipe.zrem(namespace_head_timestamps, key)
+                    pipe.execute()
+                    euthanized += 1
+                    continue
+
+                resorted = False
+                try:
+                    timestamps = [datapoint[0] for datapoint in timeseries]
+                except TypeError:
+                    # The single value format
+                    timestamps = None
+                if timestamps is None:
+                    if timeseries[0] < delta:
+                        trimmed = []
+                    else:
+                        pipe.zrem(namespace_head_timestamps, key)
+                        pipe.execute()
+                        continue
+                # @modified 20261018 - Incremental Roomba
+                # Checked in one linear pass rather than sorting and building
+                # a set of the timestamps of every key
+                # elif timestamps == sorted(timestamps) and len(set(timestamps)) == len(timestamps):
+                elif self.strictly_increasing(timestamps):
+                    # The timestamps are strictly increasing, binary search for
+                    # the first datapoint to retain
+                    first_retained = bisect_right(timestamps, delta)
+                    trimmed = timeseries[first_retained:]
+                else:
+                    # Sort, remove old datapoints and duplicates as in vacuum
+                    resorted = True
+                    sorted_keys += 1
+                    temp = set()
+                    temp_add = temp.add
+                    trimmed = [
+                        datapoint for datapoint in sorted(timeseries)
+                        if datapoint[0] > delta and
+                        datapoint[0] not in temp and not
+                        temp_add(datapoint[0])
+                    ]
+
+                if trimmed:
+                    if len(trimmed) < len(timeseries) or resorted:
+                        # @modified 20261018 - Binary timeseries codec
+                        # Written in the TIMESERIES_CODEC format
+                        # @modified 20261018 - Gorilla timeseries blocks
+                        # pipe.set(key, encode_timeseries(trimmed))
+                        pipe.set(key, encode_timeseries(trimmed, codec))
+                        trimmed_keys += 1
+                    pipe.zadd(namespace_head_timestamps, trimmed[0][0], key)
+                else:
+                    pipe.delete(key)
+                    pipe.srem(namespace_unique_metrics, key)
+                    pipe.zrem(namespace_head_timestamps, key)
+                    euthanized += 1
+                pipe.execute()
+
+            except WatchError:
+                blocked += 1
+                assigned_metrics.append(key)
+            except Exception as e:
+                # If something bad happens, zap the key and hope it goes away
+                pipe.reset()
+                pipe.delete(key)
+                pipe.srem(namespace_unique_metrics, key)
+                pipe.zrem(namespace_head_timestamps, key)
+                pipe.execute()
+                euthanized += 1
+                logger.info(e)
+                logger.info('%s :: vacuum Euthanizing %s' % (skyline_app, key))
+            finally:
+                pipe.reset()
+
+        logger.info(
+            '%s :: incremental vacuum operated on %s %d keys in %f seconds' %
+            (skyline_app, namespace, len(assigned_metrics), time() - begin))
+        logger.info('%s :: vaccum blocked %d times' % (skyline_app, blocked))
+        logger.info('%s :: vacuum euthanized %d geriatric keys' % (skyline_app, euthanized))
+        logger.info('%s :: vacuum trimmed %d keys' % (skyline_app, trimmed_keys))
+        logger.info('%s :: vacuum sorted %d out of order keys' % (skyline_app, sorted_keys))
+
+    # @modified 20261018 - Incremental Roomba
+    # Added incremental
+    def vacuum(self, i, namespace, duration, incremental=False, shard=0):
         """
         Trim metrics that are older than settings.FULL_DURATION and purge old
         metrics.
         """
+        # @added 20261018 - Redis shards
+        # Each vacuum process trims the keys on one of the REDIS_SHARDS
+        redis_shards = get_redis_shards()
+        if redis_shards.count > 1:
+            self.redis_conn = redis_shards.connections[shard]
+
+        # @added 20261018 - Incremental Roomba
+        if incremental:
+            return self.vacuum_incremental(i, namespace, duration)
+
+        # @added 20261018 - Roomba Lua trimming
+        # @modified 20261018 - Binary timeseries codec
+        # The Lua script only handles msgpack keys, with the binary codec the
+        # keys are trimmed and migrated by the Python vacuum
+        # if ROOMBA_LUA_TRIM:
+        if ROOMBA_LUA_TRIM and TIMESERIES_CODEC == 'msgpack':
+            return self.vacuum_lua(i, namespace, duration)
+
         begin = time()
         logger.info('%s :: started vacuum' % (skyline_app))
 
         # Discover assigned metrics
         namespace_unique_metrics = '%sunique_metrics' % str(namespace)
+        # @added 20261018 - Incremental Roomba
+        namespace_head_timestamps = '%shead_timestamps' % str(namespace)
         unique_metrics = list(self.redis_conn.smembers(namespace_unique_metrics))
         keys_per_processor = int(ceil(float(len(unique_metrics)) / float(settings.ROOMBA_PROCESSES)))
         if i == settings.ROOMBA_PROCESSES:
@@ -78,6 +651,10 @@ class Roomba(Thread):
         # Compile assigned metrics
         assigned_metrics = [unique_metrics[index] for index in assigned_keys]
 
+        # @added 20261018 - Gorilla timeseries blocks
+        # The FULL_NAMESPACE keys are sealed into gorilla blocks
+        codec = get_namespace_codec(namespace)
+
         euthanized = 0
         blocked = 0
         trimmed_keys = 0
@@ -98,9 +675,18 @@ class Roomba(Thread):
                 # comes in. If your data has a very small resolution (<.1s),
                 # this technique may not suit you.
                 raw_series = pipe.get(key)
-                unpacker = Unpacker(use_list=False)
-                unpacker.feed(raw_series)
-                timeseries = sorted([unpacked for unpacked in unpacker])
+                # @modified 20261018 - Binary timeseries codec
+                # Decode msgpack, binary and mixed keys with decode_timeseries
+                # unpacker = Unpacker(use_list=False)
+                # unpacker.feed(raw_series)
+                timeseries = decode_timeseries(raw_series)
+                # @modified 20261018 - Hash sharded workers
+                # timeseries = sorted([unpacked for unpacked in unpacker])
+                if HORIZON_SHARDED_WORKERS:
+                    if self.out_of_order(timeseries):
+                        timeseries.sort()
+                else:
+                    timeseries.sort()
 
                 # Put pipe back in multi mode
                 pipe.multi()
@@ -112,6 +698,9 @@ class Roomba(Thread):
                             if timeseries[0] < now - duration:
                                 pipe.delete(key)
                                 pipe.srem(namespace_unique_metrics, key)
+                                # @added 20261018 - Incremental Roomba
+                                if ROOMBA_INCREMENTAL:
+                                    pipe.zrem(namespace_head_timestamps, key)
                                 pipe.execute()
                                 euthanized += 1
                             continue
@@ -120,6 +709,9 @@ class Roomba(Thread):
                             if timeseries[0] < now - duration:
                                 pipe.delete(key)
                                 pipe.srem(namespace_unique_metrics, key)
+                                # @added 20261018 - Incremental Roomba
+                                if ROOMBA_INCREMENTAL:
+                                    pipe.zrem(namespace_head_timestamps, key)
                                 pipe.execute()
                                 euthanized += 1
                             continue
@@ -130,6 +722,9 @@ class Roomba(Thread):
                 if timeseries[-1][0] < now - duration:
                     pipe.delete(key)
                     pipe.srem(namespace_unique_metrics, key)
+                    # @added 20261018 - Incremental Roomba
+                    if ROOMBA_INCREMENTAL:
+                        pipe.zrem(namespace_head_timestamps, key)
                     pipe.execute()
                     euthanized += 1
                     continue
@@ -148,20 +743,34 @@ class Roomba(Thread):
                 # Purge if everything was deleted, set key otherwise
                 if len(trimmed) > 0:
                     # Serialize and turn key back into not-an-array
-                    btrimmed = packb(trimmed)
-                    if len(trimmed) <= 15:
-                        value = btrimmed[1:]
-                    elif len(trimmed) <= 65535:
-                        value = btrimmed[3:]
-                        trimmed_keys += 1
-                    else:
-                        value = btrimmed[5:]
+                    # @modified 20261018 - Binary timeseries codec
+                    # Written in the TIMESERIES_CODEC format, which migrates
+                    # the key if the TIMESERIES_CODEC has been changed
+                    # btrimmed = packb(trimmed)
+                    # if len(trimmed) <= 15:
+                    #     value = btrimmed[1:]
+                    # elif len(trimmed) <= 65535:
+                    #     value = btrimmed[3:]
+                    #     trimmed_keys += 1
+                    # else:
+                    #     value = btrimmed[5:]
+                    #     trimmed_keys += 1
+                    # @modified 20261018 - Gorilla timeseries blocks
+                    # value = encode_timeseries(trimmed)
+                    value = encode_timeseries(trimmed, codec)
+                    if len(trimmed) > 15:
                         trimmed_keys += 1
                     pipe.set(key, value)
+                    # @added 20261018 - Incremental Roomba
+                    if ROOMBA_INCREMENTAL:
+                        pipe.zadd(namespace_head_timestamps, trimmed[0][0], key)
                     active_keys += 1
                 else:
                     pipe.delete(key)
                     pipe.srem(namespace_unique_metrics, key)
+                    # @added 20261018 - Incremental Roomba
+                    if ROOMBA_INCREMENTAL:
+                        pipe.zrem(namespace_head_timestamps, key)
                     euthanized += 1
 
                 pipe.execute()
@@ -173,6 +782,9 @@ class Roomba(Thread):
                 # If something bad happens, zap the key and hope it goes away
                 pipe.delete(key)
                 pipe.srem(namespace_unique_metrics, key)
+                # @added 20261018 - Incremental Roomba
+                if ROOMBA_INCREMENTAL:
+                    pipe.zrem(namespace_head_timestamps, key)
                 pipe.execute()
                 euthanized += 1
                 logger.info(e)
@@ -231,6 +843,9 @@ class Roomba(Thread):
 
         logger.info('%s :: started roomba' % skyline_app)
 
+        # @added 20261018 - Incremental Roomba
+        last_full_vacuum = 0
+
         while 1:
             now = time()
 
@@ -249,17 +864,41 @@ class Roomba(Thread):
                     self.redis_conn = StrictRedis(unix_socket_path=settings.REDIS_SOCKET_PATH)
                 continue
 
+            # @added 20261018 - Incremental Roomba
+            # Only vacuum the keys that need to be trimmed, with a full vacuum
+            # every ROOMBA_INCREMENTAL_FULL_INTERVAL to update the
+            # head_timestamps of any keys that are not in the sorted sets
+            incremental = False
+            if ROOMBA_INCREMENTAL:
+                if now - last_full_vacuum < ROOMBA_INCREMENTAL_FULL_INTERVAL:
+                    incremental = True
+                else:
+                    logger.info('%s :: running a full vacuum' % skyline_app)
+                    last_full_vacuum = now
+
             # Spawn processes
             pids = []
-            for i in range(1, settings.ROOMBA_PROCESSES + 1):
-                if not self.skip_mini:
+            # @modified 20261018 - Redis shards
+            # The ROOMBA_PROCESSES vacuum each of the REDIS_SHARDS
+            # for i in range(1, settings.ROOMBA_PROCESSES + 1):
+            for shard, i in [
+                    (shard, i) for shard in range(get_redis_shards().count)
+                    for i in range(1, settings.ROOMBA_PROCESSES + 1)]:
+                # @modified 20261018 - Mini namespace rollups
+                # There are no mini keys to vacuum with MINI_NAMESPACE_MODE view
+                # if not self.skip_mini:
+                if not self.skip_mini and MINI_NAMESPACE_MODE != 'view':
                     logger.info('%s :: starting vacuum process on mini namespace' % skyline_app)
-                    p = Process(target=self.vacuum, args=(i, settings.MINI_NAMESPACE, settings.MINI_DURATION + settings.ROOMBA_GRACE_TIME))
+                    # @modified 20261018 - Incremental Roomba
+                    # p = Process(target=self.vacuum, args=(i, settings.MINI_NAMESPACE, settings.MINI_DURATION + settings.ROOMBA_GRACE_TIME))
+                    p = Process(target=self.vacuum, args=(i, settings.MINI_NAMESPACE, settings.MINI_DURATION + settings.ROOMBA_GRACE_TIME, incremental, shard))
                     pids.append(p)
                     p.start()
 
                 logger.info('%s :: starting vacuum process' % skyline_app)
-                p = Process(target=self.vacuum, args=(i, settings.FULL_NAMESPACE, settings.FULL_DURATION + settings.ROOMBA_GRACE_TIME))
+                # @modified 20261018 - Incremental Roomba
+                # p = Process(target=self.vacuum, args=(i, settings.FULL_NAMESPACE, settings.FULL_DURATION + settings.ROOMBA_GRACE_TIME))
+                p = Process(target=self.vacuum, args=(i, settings.FULL_NAMESPACE, settings.FULL_DURATION + settings.ROOMBA_GRACE_TIME, incremental, shard))
                 pids.append(p)
                 p.start()
 
@@ -0,0 +1,113 @@
+"""
+sharded_queue
+
+Route the metrics the Horizon listeners receive to the worker that owns them.
+
+When HORIZON_SHARDED_WORKERS is enabled each worker has its own queue and
+every metric is owned by one worker, chosen by a stable hash of the metric
+name.  The :class:`ShardedQueue` has the same ``put`` and ``qsize`` interface
+as the queue the listeners put chunks on, it splits each chunk into a chunk
+per worker and puts each one on the worker's queue.  As only one worker ever
+appends to a metric's Redis key, and in the order that the listener received
+the datapoints, the datapoints are appended in order.
+"""
+
+import zlib
+try:
+    from Queue import Full
+except ImportError:
+    from queue import Full
+
+# The maximum number of metric names to cache the shard of, when the cache is
+# full it is cleared.
+SHARD_CACHE_SIZE = 100000
+
+
+def metric_shard(metric_name, shards):
+    """
+    The shard that a metric belongs to.
+
+    :param metric_name: the metric name
+    :param shards: the number of shards
+    :type metric_name: str
+    :type shards: int
+    :return: the shard, from 0 to shards - 1
+    :rtype: int
+    """
+    if not isinstance(metric_name, bytes):
+        metric_name = metric_name.encode('utf-8')
+    return (zlib.crc32(metric_name) & 0xffffffff) % shards
+
+
+class ShardedQueueFull(Full):
+    """
+    Raised when the queue of one or more shards was full, the datapoints for
+    the other shards were queued.  The datapoints that were not queued are
+    available as ``dropped_chunk`` so that they can be spooled.
+    """
+
+    def __init__(self, dropped, dropped_chunk=None):
+        super(ShardedQueueFull, self).__init__()
+        self.dropped = dropped
+        self.dropped_chunk = dropped_chunk
+
+
+class ShardedQueue(object):
+    """
+    Split chunks of ``(metric, (timestamp, value))`` datapoints between the
+    queues of the workers, by the shard of each metric name.
+    """
+
+    def __init__(self, queues):
+        """
+        :param queues: the queue of each worker
+        :type queues: list
+        """
+        self.queues = queues
+        self.shards = len(queues)
+        self.shard_cache = {}
+
+    def shard(self, metric_name):
+        """
+        The shard that a metric belongs to.
+        """
+        try:
+            return self.shard_cache[metric_name]
+        except KeyError:
+            pass
+        if len(self.shard_cache) >= SHARD_CACHE_SIZE:
+            self.shard_cache.clear()
+        shard = metric_shard(metric_name, self.shards)
+        self.shard_cache[metric_name] = shard
+        return shard
+
+    def put(self, chunk, block=False, timeout=None):
+        """
+        Put each metric in the chunk on the queue of its shard, preserving the
+        order of the datapoints.
+
+        :param chunk: the list of ``(metric, (timestamp, value))`` datapoints
+        :type chunk: list
+        :raises ShardedQueueFull: if the queue of any shard was full, with the
+            number of datapoints that were dropped and the datapoints
+        """
+        shard_chunks = [[] for i in range(self.shards)]
+        shard = self.shard
+        for metric in chunk:
+            shard_chunks[shard(metric[0])].append(metric)
+        dropped_chunk = []
+        for queue, shard_chunk in zip(self.queues, shard_chunks):
+            if not shard_chunk:
+                continue
+            try:
+                queue.put(shard_chunk, block, timeout)
+            except Full:
+                dropped_chunk.extend(shard_chunk)
+        if dropped_chunk:
+            raise ShardedQueueFull(len(dropped_chunk), dropped_chunk)
+
+    def qsize(self):
+        """
+        The total number of chunks in the queues of all the shards.
+        """
+        return sum(queue.qsize() for queue in self.queues)
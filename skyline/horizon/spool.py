@@ -0,0 +1,296 @@
+"""
+spool
+
+A disk spool for the chunks that the Horizon listeners cannot put on the
+queue because it is full, which the workers replay once the queue has
+drained, rather than the chunks being dropped.
+
+The listeners append each chunk to a segment file as a msgpack encoded array
+of ``[metric, [timestamp, value]]`` datapoints.  A segment is written as
+``<ms timestamp>-<pid>-<sequence>.spool.writing`` and renamed to
+``.spool`` when it is complete, which is when it reaches SEGMENT_SIZE bytes,
+when it has been open for SEGMENT_MAX_AGE seconds or when the queue accepts
+chunks again.  A worker claims a complete segment by renaming it to
+``.spool.replaying-<pid>``, replays the chunks in it and then removes it.
+The segment names sort in the order they were created so the oldest data is
+replayed first.  Segments left by a listener or worker process that is no
+longer running are claimed by the workers too.
+
+With HORIZON_SHARDED_WORKERS each metric must only be appended by the worker
+that owns it, so a worker only replays the datapoints of its own metrics and
+spools the datapoints of the other metrics again, to a segment for the shard
+of each metric, ``<ms timestamp>-<pid>-<sequence>-shard<shard>.spool``.  A
+segment for a shard is only claimed by the worker of that shard, or by any
+worker if there is no longer a worker for the shard.
+"""
+
+import errno
+import os
+import sys
+from time import time
+
+from msgpack import packb, Unpacker
+
+python_version = int(sys.version_info[0])
+
+SPOOL_SUFFIX = '.spool'
+WRITING_SUFFIX = '.spool.writing'
+REPLAYING_SUFFIX = '.spool.replaying-'
+SEGMENT_SIZE = 16 * 1024 * 1024
+SEGMENT_MAX_AGE = 10
+# How often the size of the spool directory is checked by a writer and how
+# often an empty spool directory is checked by a reader
+SPOOL_CHECK_INTERVAL = 1
+
+
+def pid_is_alive(pid):
+    """
+    Determine if a process is running.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return False
+    return True
+
+
+def segment_pid(segment):
+    """
+    The pid of the process that wrote or is replaying a segment.
+    """
+    try:
+        if REPLAYING_SUFFIX in segment:
+            return int(segment.rsplit('-', 1)[1])
+        return int(segment.split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def segment_shard(segment):
+    """
+    The shard of a segment that was spooled for a shard, or ``None``.
+    """
+    parts = segment.split(SPOOL_SUFFIX)[0].split('-')
+    if len(parts) < 4 or not parts[3].startswith('shard'):
+        return None
+    try:
+        return int(parts[3][5:])
+    except ValueError:
+        return None
+
+
+def spool_stats(spool_dir):
+    """
+    The number of segments and bytes in the spool and the age in seconds of
+    the oldest segment, which is how far behind the replay is.
+
+    :param spool_dir: the spool directory
+    :type spool_dir: str
+    :return: a dict of segments, bytes and replay_lag
+    :rtype: dict
+    """
+    stats = {'segments': 0, 'bytes': 0, 'replay_lag': 0}
+    try:
+        segments = [segment for segment in os.listdir(spool_dir) if SPOOL_SUFFIX in segment]
+    except OSError:
+        return stats
+    oldest = None
+    for segment in segments:
+        try:
+            stats['bytes'] += os.path.getsize(os.path.join(spool_dir, segment))
+        except OSError:
+            continue
+        stats['segments'] += 1
+        try:
+            created = int(segment.split('-')[0]) / 1000.0
+        except ValueError:
+            continue
+        if oldest is None or created < oldest:
+            oldest = created
+    if oldest is not None:
+        stats['replay_lag'] = max(int(time() - oldest), 0)
+    return stats
+
+
+class SpoolWriter(object):
+    """
+    Append chunks to spool segments, used by a listener.
+    """
+
+    def __init__(self, spool_dir, max_bytes, shard=None):
+        """
+        :param spool_dir: the spool directory
+        :param max_bytes: the maximum size of the spool, when it is reached
+            chunks are dropped
+        :param shard: the worker shard the segments are for, ``None`` for any
+            worker
+        :type spool_dir: str
+        :type max_bytes: int
+        :type shard: int
+        """
+        self.spool_dir = spool_dir
+        self.max_bytes = int(max_bytes)
+        self.shard = shard
+        self.segment = None
+        self.segment_path = None
+        self.segment_bytes = 0
+        self.segment_opened = 0
+        self.sequence = 0
+        self.spool_bytes = 0
+        self.last_checked = 0
+
+    def _open_segment(self):
+        self.sequence += 1
+        if self.shard is None:
+            name = '%d-%d-%d%s' % (int(time() * 1000), os.getpid(), self.sequence, WRITING_SUFFIX)
+        else:
+            name = '%d-%d-%d-shard%d%s' % (
+                int(time() * 1000), os.getpid(), self.sequence, self.shard, WRITING_SUFFIX)
+        self.segment_path = os.path.join(self.spool_dir, name)
+        self.segment = open(self.segment_path, 'ab')
+        self.segment_bytes = 0
+        self.segment_opened = time()
+
+    def rotate(self):
+        """
+        Close the open segment, if there is one, and make it available to be
+        replayed.
+        """
+        if not self.segment:
+            return
+        self.segment.close()
+        self.segment = None
+        os.rename(self.segment_path, self.segment_path[:-len(WRITING_SUFFIX)] + SPOOL_SUFFIX)
+        self.segment_path = None
+
+    def rotate_if_due(self, max_age=SEGMENT_MAX_AGE):
+        """
+        Rotate the open segment if it is full or has been open for max_age
+        seconds.
+
+        :param max_age: the age in seconds to rotate the segment at
+        :type max_age: int
+        """
+        if self.segment:
+            if self.segment_bytes >= SEGMENT_SIZE or time() - self.segment_opened >= max_age:
+                self.rotate()
+
+    def write(self, chunk):
+        """
+        Append a chunk to the spool.
+
+        :param chunk: the list of ``(metric, (timestamp, value))`` datapoints
+        :type chunk: list
+        :return: ``True`` if the chunk was spooled, ``False`` if the spool is
+            full
+        :rtype: boolean
+        """
+        now = time()
+        if now - self.last_checked >= SPOOL_CHECK_INTERVAL:
+            self.spool_bytes = spool_stats(self.spool_dir)['bytes']
+            self.last_checked = now
+        if self.spool_bytes >= self.max_bytes:
+            return False
+        self.rotate_if_due()
+        if not self.segment:
+            self._open_segment()
+        data = packb(chunk)
+        self.segment.write(data)
+        self.segment.flush()
+        self.segment_bytes += len(data)
+        self.spool_bytes += len(data)
+        return True
+
+
+class SpoolReader(object):
+    """
+    Claim spool segments and read the chunks from them, used by a worker.
+    """
+
+    def __init__(self, spool_dir, shard=None, shards=None):
+        """
+        :param spool_dir: the spool directory
+        :param shard: the shard of the worker, ``None`` to claim every segment
+        :param shards: the number of worker shards
+        :type spool_dir: str
+        :type shard: int
+        :type shards: int
+        """
+        self.spool_dir = spool_dir
+        self.shard = shard
+        self.shards = shards
+        self.segment = None
+        self.segment_path = None
+        self.unpacker = None
+        self.last_checked = 0
+
+    def _claim_segment(self):
+        try:
+            segments = sorted(
+                segment for segment in os.listdir(self.spool_dir) if SPOOL_SUFFIX in segment)
+        except OSError:
+            return False
+        pid = os.getpid()
+        for segment in segments:
+            if self.shard is not None:
+                shard = segment_shard(segment)
+                if shard is not None and shard != self.shard and shard < self.shards:
+                    continue
+            if not segment.endswith(SPOOL_SUFFIX):
+                # Only claim a segment being written or replayed if the
+                # process has gone
+                owner = segment_pid(segment)
+                if owner is None or owner == pid or pid_is_alive(owner):
+                    continue
+                base = segment.split(SPOOL_SUFFIX)[0]
+            else:
+                base = segment[:-len(SPOOL_SUFFIX)]
+            claimed_path = os.path.join(self.spool_dir, '%s%s%d' % (base, REPLAYING_SUFFIX, pid))
+            try:
+                os.rename(os.path.join(self.spool_dir, segment), claimed_path)
+            except OSError:
+                # Claimed by another worker
+                continue
+            self.segment_path = claimed_path
+            self.segment = open(claimed_path, 'rb')
+            if python_version == 3:
+                self.unpacker = Unpacker(self.segment, use_list=False, encoding='utf-8')
+            else:
+                self.unpacker = Unpacker(self.segment, use_list=False)
+            return True
+        return False
+
+    def _finish_segment(self):
+        self.segment.close()
+        try:
+            os.remove(self.segment_path)
+        except OSError:
+            pass
+        self.segment = None
+        self.segment_path = None
+        self.unpacker = None
+
+    def read_chunk(self):
+        """
+        Read the next chunk from the spool.
+
+        :return: the list of ``(metric, (timestamp, value))`` datapoints or
+            ``None`` if the spool is empty
+        :rtype: list
+        """
+        while True:
+            if not self.segment:
+                now = time()
+                if now - self.last_checked < SPOOL_CHECK_INTERVAL:
+                    return None
+                if not self._claim_segment():
+                    self.last_checked = now
+                    return None
+            try:
+                return list(next(self.unpacker))
+            except StopIteration:
+                self._finish_segment()
+            except Exception:
+                # A corrupt segment, discard the rest of it
+                self._finish_segment()
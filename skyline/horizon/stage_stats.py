@@ -0,0 +1,220 @@
+"""
+stage_stats
+
+Per stage counters and latency histograms for the Horizon listeners and
+workers.
+
+Each listener and worker process records the time each stage of the ingest
+takes and the number of items it handled, e.g. the bytes read from a socket
+or the datapoints deserialised, and every HORIZON_STAGE_METRICS_INTERVAL
+seconds sends them for the interval to Graphite in one batch.  For each stage
+the metrics are:
+
+- ``<namespace>.<stage>.calls`` - the number of times the stage ran
+- ``<namespace>.<stage>.items`` - the number of items the stage handled
+- ``<namespace>.<stage>.items_per_second``
+- ``<namespace>.<stage>.latency_avg`` and ``latency_max`` in seconds
+- ``<namespace>.<stage>.latency_p50``, ``latency_p95`` and ``latency_p99`` in
+  seconds, the upper bound of the histogram bucket the percentile falls in
+- ``<namespace>.<stage>.latency_le_<bound>`` - the number of times the stage
+  took no more than the bucket bound and more than the previous bound, with
+  the ``.`` of the bound replaced by ``_``, e.g. ``latency_le_0_001``
+
+Counters of events that are not stages, e.g. the datapoints a worker dropped
+as duplicates, are sent as ``<namespace>.<counter>`` for the interval.
+
+The batches are sent by a daemon thread of the process, so that a Graphite
+that is slow or unreachable cannot stall the receive loop of a listener or a
+worker.  Only one batch waits to be sent, if the previous batch is still
+waiting when the next is due the next batch is dropped and counted in the
+``<namespace>.dropped_metric_batches`` counter.
+"""
+
+from threading import Thread
+from time import time
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+
+from skyline_functions import send_graphite_metrics
+
+# The upper bounds of the latency histogram buckets in seconds, the last
+# bucket is for anything slower
+LATENCY_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1, 10)
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+def bucket_label(bound):
+    """
+    The metric name element for a latency bucket bound.
+    """
+    if bound is None:
+        return 'inf'
+    return ('%f' % bound).rstrip('0').rstrip('.').replace('.', '_')
+
+
+class StageStats(object):
+    """
+    Aggregate the latency and item counts of the stages of a process.
+    """
+
+    def __init__(self, skyline_app, namespace, stages, interval):
+        """
+        :param skyline_app: the skyline app, used by send_graphite_metrics
+        :param namespace: the Graphite namespace of the process
+        :param stages: the names of the stages
+        :param interval: the interval in seconds to send the metrics at, if
+            0 the metrics are not sent
+        :type skyline_app: str
+        :type namespace: str
+        :type stages: list
+        :type interval: int
+        """
+        self.skyline_app = skyline_app
+        self.namespace = namespace
+        self.stages = list(stages)
+        self.interval = interval
+        self.bucket_labels = [bucket_label(bound) for bound in LATENCY_BUCKETS] + ['inf']
+        self.last_sent = time()
+        # The queue of the sender thread, which is started by the first
+        # send_if_due in the process, after the Process has started
+        self.send_queue = None
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the counters for a new interval.
+        """
+        self.calls = dict((stage, 0) for stage in self.stages)
+        self.items = dict((stage, 0) for stage in self.stages)
+        self.total_latency = dict((stage, 0.0) for stage in self.stages)
+        self.max_latency = dict((stage, 0.0) for stage in self.stages)
+        self.buckets = dict((stage, [0] * (len(LATENCY_BUCKETS) + 1)) for stage in self.stages)
+        self.counters = {}
+
+    def record(self, stage, latency, items=1):
+        """
+        Record a run of a stage.
+
+        :param stage: the stage name
+        :param latency: the time the stage took in seconds
+        :param items: the number of items the stage handled
+        :type stage: str
+        :type latency: float
+        :type items: int
+        """
+        self.calls[stage] += 1
+        self.items[stage] += items
+        self.total_latency[stage] += latency
+        if latency > self.max_latency[stage]:
+            self.max_latency[stage] = latency
+        buckets = self.buckets[stage]
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                buckets[index] += 1
+                return
+        buckets[-1] += 1
+
+    def increment(self, counter, count=1):
+        """
+        Add to a counter.
+
+        :param counter: the counter name
+        :param count: the number to add
+        :type counter: str
+        :type count: int
+        """
+        self.counters[counter] = self.counters.get(counter, 0) + count
+
+    def percentile(self, stage, percentile):
+        """
+        The upper bound of the histogram bucket that a latency percentile of a
+        stage falls in, for the slowest bucket the max latency.
+        """
+        calls = self.calls[stage]
+        if not calls:
+            return 0
+        rank = calls * percentile / 100.0
+        count = 0
+        for index, bucket_count in enumerate(self.buckets[stage]):
+            count += bucket_count
+            if count >= rank:
+                if index < len(LATENCY_BUCKETS):
+                    return min(LATENCY_BUCKETS[index], self.max_latency[stage])
+                break
+        return self.max_latency[stage]
+
+    def graphite_metrics(self, elapsed):
+        """
+        The metrics for the interval.
+
+        :param elapsed: the length of the interval in seconds
+        :type elapsed: float
+        :return: a list of ``(metric, value)`` tuples
+        :rtype: list
+        """
+        metrics = []
+        for stage in self.stages:
+            stage_namespace = '%s.%s' % (self.namespace, stage)
+            calls = self.calls[stage]
+            if calls:
+                latency_avg = self.total_latency[stage] / calls
+            else:
+                latency_avg = 0
+            metrics.append(('%s.calls' % stage_namespace, calls))
+            metrics.append(('%s.items' % stage_namespace, self.items[stage]))
+            metrics.append(('%s.items_per_second' % stage_namespace, '%.2f' % (self.items[stage] / max(elapsed, 1))))
+            metrics.append(('%s.latency_avg' % stage_namespace, '%.6f' % latency_avg))
+            metrics.append(('%s.latency_max' % stage_namespace, '%.6f' % self.max_latency[stage]))
+            for percentile in LATENCY_PERCENTILES:
+                metrics.append((
+                    '%s.latency_p%d' % (stage_namespace, percentile),
+                    '%.6f' % self.percentile(stage, percentile)))
+            for label, bucket_count in zip(self.bucket_labels, self.buckets[stage]):
+                metrics.append(('%s.latency_le_%s' % (stage_namespace, label), bucket_count))
+        for counter in sorted(self.counters):
+            metrics.append(('%s.%s' % (self.namespace, counter), self.counters[counter]))
+        return metrics
+
+    def sender(self):
+        """
+        Send the batches on the send_queue to Graphite.
+        """
+        while True:
+            metrics = self.send_queue.get()
+            try:
+                send_graphite_metrics(self.skyline_app, metrics)
+            except Exception:
+                pass
+
+    def send_if_due(self):
+        """
+        Queue the metrics for the interval to be sent to Graphite in one batch
+        by the sender thread and reset the counters, if the interval has
+        elapsed.
+
+        :return: ``True`` if the metrics were queued
+        :rtype: boolean
+        """
+        if not self.interval:
+            return False
+        now = time()
+        elapsed = now - self.last_sent
+        if elapsed < self.interval:
+            return False
+        metrics = self.graphite_metrics(elapsed)
+        self.reset()
+        self.last_sent = now
+        if self.send_queue is None:
+            self.send_queue = Queue(1)
+            sender = Thread(target=self.sender)
+            sender.daemon = True
+            sender.start()
+        try:
+            self.send_queue.put_nowait(metrics)
+        except Full:
+            # The previous batch has not been sent
+            self.increment('dropped_metric_batches')
+            return False
+        return True
@@ -7,19 +7,43 @@ try:
     from Queue import Empty
 except ImportError:
     from queue import Empty
-from msgpack import packb
+# @modified 20261018 - Binary timeseries codec
+# from msgpack import packb
 from time import time, sleep
 
 # import traceback
 import logging
 # import socket
 
+# @modified 20261018 - Hash sharded workers
 # import sys
+import sys
 import os.path
 from os import remove as os_remove
 
 import settings
 from skyline_functions import send_graphite_metric
+# @added 20261018 - Compiled SKIP_LIST matcher
+from namespace_matcher import NamespaceMatcher
+# @added 20261018 - Horizon disk spool
+from spool import SpoolReader, spool_stats
+# @added 20261018 - Hash sharded workers
+from spool import SpoolWriter
+from sharded_queue import metric_shard
+# @added 20261018 - Horizon stage instrumentation
+from stage_stats import StageStats
+# @added 20261018 - Binary timeseries codec
+from timeseries_codec import get_datapoint_encoder
+# @added 20261018 - Redis shards
+from redis_shards import get_redis_shards
+# @added 20261018 - Horizon worker pipeline batching
+from redis_shards import ShardedPipelineError
+# @added 20261018 - Ingest normalisation
+from ingest_filter import IngestFilter
+# @added 20261018 - Cardinality guard
+from cardinality_guard import CardinalityGuard
+# @added 20261018 - Mini namespace rollups
+from mini_namespace import MiniNamespace
 
 parent_skyline_app = 'horizon'
 child_skyline_app = 'worker'
@@ -48,13 +72,152 @@ try:
 except:
     DO_NOT_SKIP_LIST = []
 
+# @added 20261018 - Horizon worker pipeline batching
+# Rather than executing the Redis pipeline for every datapoint, datapoints are
+# collected into the pipeline over one or more chunks and flushed when either
+# the size or the latency bound is reached.
+try:
+    WORKER_PIPELINE_MAX_DATAPOINTS = int(settings.WORKER_PIPELINE_MAX_DATAPOINTS)
+except:
+    WORKER_PIPELINE_MAX_DATAPOINTS = 1000
+try:
+    WORKER_PIPELINE_MAX_LATENCY = float(settings.WORKER_PIPELINE_MAX_LATENCY)
+except:
+    WORKER_PIPELINE_MAX_LATENCY = 1.0
+
+# @added 20261018 - Incremental Roomba
+# If ROOMBA_INCREMENTAL is True the timestamp of the first datapoint of each
+# key is added to the <namespace>head_timestamps sorted set, only if the key is
+# not already in it (ZADD NX), which requires Redis >= 3.0.2.
+try:
+    ROOMBA_INCREMENTAL = settings.ROOMBA_INCREMENTAL
+except:
+    ROOMBA_INCREMENTAL = False
+
+# @added 20261018 - Horizon disk spool
+# If HORIZON_SPOOL_DIR is set the chunks the listeners spooled when the queue
+# was full are replayed by the workers, at up to HORIZON_SPOOL_REPLAY_RATE
+# datapoints per second per worker, while there are no more than
+# SPOOL_REPLAY_MAX_QUEUE_SIZE chunks on the queue.
+try:
+    HORIZON_SPOOL_DIR = settings.HORIZON_SPOOL_DIR
+except:
+    HORIZON_SPOOL_DIR = None
+try:
+    HORIZON_SPOOL_REPLAY_RATE = int(settings.HORIZON_SPOOL_REPLAY_RATE)
+except:
+    HORIZON_SPOOL_REPLAY_RATE = 10000
+SPOOL_REPLAY_MAX_QUEUE_SIZE = 10
+# @added 20261018 - Horizon worker pipeline batching
+# The datapoints of a pipeline that could not be flushed are retried once with
+# the next flush and if that fails they are spooled, up to the
+# HORIZON_SPOOL_MAX_BYTES, for the worker to replay.
+try:
+    HORIZON_SPOOL_MAX_BYTES = int(settings.HORIZON_SPOOL_MAX_BYTES)
+except:
+    HORIZON_SPOOL_MAX_BYTES = 1073741824
+# @added 20261018 - Hash sharded workers
+# With HORIZON_SHARDED_WORKERS a worker only replays the spooled datapoints of
+# the metrics it owns and spools the others again for the workers that own
+# them, in segments that are rotated every RESPOOL_SEGMENT_MAX_AGE seconds.
+# The datapoints are moved rather than added to the spool so they are spooled
+# again even if the spool has reached HORIZON_SPOOL_MAX_BYTES.
+try:
+    HORIZON_SHARDED_WORKERS = settings.HORIZON_SHARDED_WORKERS
+except:
+    HORIZON_SHARDED_WORKERS = False
+RESPOOL_SEGMENT_MAX_AGE = 1
+
+# @added 20261018 - Horizon stage instrumentation
+# The queue_wait, skip_list, append and redis_flush stage metrics are sent
+# every HORIZON_STAGE_METRICS_INTERVAL seconds, if it is 0 they are not sent
+try:
+    HORIZON_STAGE_METRICS_INTERVAL = int(settings.HORIZON_STAGE_METRICS_INTERVAL)
+except:
+    HORIZON_STAGE_METRICS_INTERVAL = 60
+# @modified 20261018 - Ingest normalisation
+# Added normalise
+# WORKER_STAGES = ('queue_wait', 'skip_list', 'append', 'redis_flush')
+# @modified 20261018 - Cardinality guard
+# Added cardinality_guard
+# WORKER_STAGES = ('queue_wait', 'skip_list', 'normalise', 'append', 'redis_flush')
+WORKER_STAGES = (
+    'queue_wait', 'skip_list', 'normalise', 'cardinality_guard', 'append',
+    'redis_flush')
+
+# @added 20261018 - Mini namespace rollups
+# With MINI_NAMESPACE_MODE append each datapoint is appended to the mini key
+# as well as the full key, with rollup only the mean of each
+# MINI_ROLLUP_RESOLUTION bucket is appended to the mini key, when the bucket
+# has closed, and with view nothing is written to the mini keys.
+try:
+    MINI_NAMESPACE_MODE = settings.MINI_NAMESPACE_MODE
+except:
+    MINI_NAMESPACE_MODE = 'append'
+try:
+    MINI_ROLLUP_RESOLUTION = int(settings.MINI_ROLLUP_RESOLUTION)
+except:
+    MINI_ROLLUP_RESOLUTION = 300
+
+# @added 20261018 - Ingest normalisation
+# Each worker drops the datapoints with the same timestamp as the last
+# datapoint of the metric, rejects datapoints more than
+# HORIZON_MAX_FUTURE_SECONDS in the future and, if HORIZON_RESOLUTION is set,
+# aggregates the datapoints of each HORIZON_RESOLUTION bucket with
+# HORIZON_RESOLUTION_AGGREGATION before they are appended.
+try:
+    HORIZON_DROP_DUPLICATE_DATAPOINTS = settings.HORIZON_DROP_DUPLICATE_DATAPOINTS
+except:
+    HORIZON_DROP_DUPLICATE_DATAPOINTS = True
+try:
+    HORIZON_RESOLUTION = int(settings.HORIZON_RESOLUTION)
+except:
+    HORIZON_RESOLUTION = 0
+try:
+    HORIZON_RESOLUTION_AGGREGATION = settings.HORIZON_RESOLUTION_AGGREGATION
+except:
+    HORIZON_RESOLUTION_AGGREGATION = 'last'
+try:
+    HORIZON_MAX_FUTURE_SECONDS = int(settings.HORIZON_MAX_FUTURE_SECONDS)
+except:
+    HORIZON_MAX_FUTURE_SECONDS = 0
+# How often the closed buckets are emitted and the cache is pruned, if there
+# is no HORIZON_RESOLUTION
+INGEST_FILTER_SWEEP_INTERVAL = 60
+
+# @added 20261018 - Cardinality guard
+# If HORIZON_CARDINALITY_GUARD is True no more than HORIZON_NEW_METRICS_BUDGET
+# new metrics are created per HORIZON_CARDINALITY_PREFIX_DEPTH namespace prefix
+# per HORIZON_CARDINALITY_WINDOW seconds, datapoints for new metrics over the
+# budget are dropped.
+try:
+    HORIZON_CARDINALITY_GUARD = settings.HORIZON_CARDINALITY_GUARD
+except:
+    HORIZON_CARDINALITY_GUARD = False
+try:
+    HORIZON_NEW_METRICS_BUDGET = int(settings.HORIZON_NEW_METRICS_BUDGET)
+except:
+    HORIZON_NEW_METRICS_BUDGET = 1000
+try:
+    HORIZON_CARDINALITY_WINDOW = int(settings.HORIZON_CARDINALITY_WINDOW)
+except:
+    HORIZON_CARDINALITY_WINDOW = 3600
+try:
+    HORIZON_CARDINALITY_PREFIX_DEPTH = int(settings.HORIZON_CARDINALITY_PREFIX_DEPTH)
+except:
+    HORIZON_CARDINALITY_PREFIX_DEPTH = 2
+
 
 class Worker(Process):
     """
     The worker processes chunks from the queue and appends
     the latest datapoints to their respective timesteps in Redis.
     """
-    def __init__(self, queue, parent_pid, skip_mini, canary=False):
+    # @modified 20261018 - SO_REUSEPORT sharded listeners
+    # Added canary_queues
+    # @modified 20261018 - Horizon stage instrumentation
+    # Added process_number
+    def __init__(self, queue, parent_pid, skip_mini, canary=False, canary_queues=None, process_number=0):
         super(Worker, self).__init__()
         # @modified 20180519 - Feature #2378: Add redis auth to Skyline and rebrow
         if settings.REDIS_PASSWORD:
@@ -66,6 +229,65 @@ class Worker(Process):
         self.daemon = True
         self.canary = canary
         self.skip_mini = skip_mini
+        # @added 20261018 - SO_REUSEPORT sharded listeners
+        # When each listener has its own queue the canary reports the total
+        # size of all the queues
+        if canary_queues:
+            self.canary_queues = canary_queues
+        else:
+            self.canary_queues = [queue]
+        # @added 20261018 - Compiled SKIP_LIST matcher
+        # Compile the SKIP_LIST and DO_NOT_SKIP_LIST once, with a per process
+        # cache of the skip decision for each metric name
+        self.skip_list_matcher = NamespaceMatcher(settings.SKIP_LIST, DO_NOT_SKIP_LIST)
+        # @added 20261018 - Horizon disk spool
+        # @modified 20261018 - Hash sharded workers
+        # With HORIZON_SHARDED_WORKERS the worker only claims the segments
+        # spooled for its shard or for any worker
+        # if HORIZON_SPOOL_DIR:
+        #     self.spool = SpoolReader(HORIZON_SPOOL_DIR)
+        self.process_number = process_number
+        self.respool_writers = {}
+        if HORIZON_SPOOL_DIR and HORIZON_SHARDED_WORKERS:
+            self.spool = SpoolReader(HORIZON_SPOOL_DIR, process_number, settings.WORKER_PROCESSES)
+        elif HORIZON_SPOOL_DIR:
+            self.spool = SpoolReader(HORIZON_SPOOL_DIR)
+        else:
+            self.spool = None
+        # @added 20261018 - Horizon worker pipeline batching
+        # The spool the datapoints of failed flushes are written to
+        self.flush_spool = None
+        # @added 20261018 - Horizon stage instrumentation
+        # Each worker process reports its own stage metrics, under
+        # worker.<process_number>
+        self.stage_stats = StageStats(
+            skyline_app, '%s.%s' % (skyline_app_graphite_namespace, str(process_number)),
+            WORKER_STAGES, HORIZON_STAGE_METRICS_INTERVAL)
+        # @added 20261018 - Ingest normalisation
+        # Spooled datapoints are replayed for up to FULL_DURATION
+        if HORIZON_SPOOL_DIR:
+            ingest_window = settings.FULL_DURATION
+        else:
+            ingest_window = settings.MAX_RESOLUTION
+        self.ingest_filter = IngestFilter(
+            HORIZON_DROP_DUPLICATE_DATAPOINTS, HORIZON_RESOLUTION,
+            HORIZON_RESOLUTION_AGGREGATION, HORIZON_MAX_FUTURE_SECONDS,
+            ingest_window)
+        # @added 20261018 - Mini namespace rollups
+        # Nothing is appended to the mini keys with MINI_NAMESPACE_MODE view
+        if self.skip_mini or MINI_NAMESPACE_MODE == 'view':
+            self.mini_namespace = None
+        else:
+            self.mini_namespace = MiniNamespace(
+                MINI_NAMESPACE_MODE, MINI_ROLLUP_RESOLUTION, ingest_window)
+        # @added 20261018 - Cardinality guard
+        if HORIZON_CARDINALITY_GUARD:
+            self.cardinality_guard = CardinalityGuard(
+                self.redis_conn, get_redis_shards(), settings.FULL_NAMESPACE,
+                HORIZON_NEW_METRICS_BUDGET, HORIZON_CARDINALITY_WINDOW,
+                HORIZON_CARDINALITY_PREFIX_DEPTH)
+        else:
+            self.cardinality_guard = None
 
     def check_if_parent_is_alive(self):
         """
@@ -93,35 +315,138 @@ class Worker(Process):
         #        return True
         # return False
 
-        metric_namespace_elements = metric_name.split('.')
-        process_metric = True
-
-        for to_skip in settings.SKIP_LIST:
-            if to_skip in metric_name:
-                process_metric = False
-                break
-            to_skip_namespace_elements = to_skip.split('.')
-            elements_matched = set(metric_namespace_elements) & set(to_skip_namespace_elements)
-            if len(elements_matched) == len(to_skip_namespace_elements):
-                process_metric = False
-                break
-
-        if not process_metric:
-            for do_not_skip in DO_NOT_SKIP_LIST:
-                if do_not_skip in metric_name:
-                    process_metric = True
-                    break
-                do_not_skip_namespace_elements = do_not_skip.split('.')
-                elements_matched = set(metric_namespace_elements) & set(do_not_skip_namespace_elements)
-                if len(elements_matched) == len(do_not_skip_namespace_elements):
-                    process_metric = True
-                    break
-
-        if not process_metric:
-            # skip
-            return True
+        # @modified 20261018 - Compiled SKIP_LIST matcher
+        # The SKIP_LIST and DO_NOT_SKIP_LIST are compiled once into a
+        # NamespaceMatcher with the same string and dotted element semantics
+        # rather than splitting every item for every datapoint
+        return self.skip_list_matcher.match(metric_name)
+
+    def respool_other_shards(self, chunk):
+        """
+        Spool the datapoints of a replayed chunk that are for the metrics of
+        other workers again, for their workers.
+
+        # @added 20261018 - Hash sharded workers
 
-        return False
+        :param chunk: the replayed chunk
+        :type chunk: list
+        :return: the datapoints of the metrics of this worker
+        :rtype: list
+        """
+        worker_processes = settings.WORKER_PROCESSES
+        own_chunk = []
+        shard_chunks = {}
+        for metric in chunk:
+            shard = metric_shard(metric[0], worker_processes)
+            if shard == self.process_number:
+                own_chunk.append(metric)
+            else:
+                shard_chunks.setdefault(shard, []).append(metric)
+        for shard, shard_chunk in shard_chunks.items():
+            writer = self.respool_writers.get(shard)
+            if writer is None:
+                writer = SpoolWriter(HORIZON_SPOOL_DIR, sys.maxsize, shard)
+                self.respool_writers[shard] = writer
+            try:
+                writer.write(shard_chunk)
+            except Exception as e:
+                logger.error('%s :: failed to spool %s datapoints for worker %s - %s' % (
+                    skyline_app, str(len(shard_chunk)), str(shard), str(e)))
+        return own_chunk
+
+    def retry_appends(self, pipe, appends, retries, failed_shards=None):
+        """
+        Append the datapoints of a pipeline that failed to be flushed to the
+        pipeline again, to be retried once with the next flush.  The
+        datapoints that have already been retried are spooled if
+        HORIZON_SPOOL_DIR is set, otherwise they are discarded.
+
+        # @added 20261018 - Horizon worker pipeline batching
+
+        :param pipe: the pipeline, which must have been reset
+        :param appends: the ``(key, datapoint, timestamp, metric)`` appends of
+            the pipeline, the metric is ``None`` for the mini keys
+        :param retries: the number of appends at the start of appends that
+            were retries
+        :param failed_shards: the shards that failed, ``None`` if the whole
+            pipeline failed
+        :type pipe: ShardedPipeline
+        :type appends: list
+        :type retries: int
+        :type failed_shards: list
+        :return: the appends in the pipeline, the number of datapoints, the
+            full keys, the mini keys and the head timestamps of the keys
+        :rtype: tuple
+        """
+        retry = []
+        retried_metrics = []
+        for index, append in enumerate(appends):
+            if failed_shards is not None and pipe.shard(append[0]) not in failed_shards:
+                continue
+            if index < retries:
+                if append[3] is not None:
+                    retried_metrics.append(append[3])
+            else:
+                retry.append(append)
+
+        if retried_metrics:
+            spooled = False
+            if HORIZON_SPOOL_DIR:
+                if self.flush_spool is None:
+                    if HORIZON_SHARDED_WORKERS:
+                        shard = self.process_number
+                    else:
+                        shard = None
+                    self.flush_spool = SpoolWriter(HORIZON_SPOOL_DIR, HORIZON_SPOOL_MAX_BYTES, shard)
+                try:
+                    spooled = self.flush_spool.write(retried_metrics)
+                    self.flush_spool.rotate()
+                except Exception as e:
+                    logger.error('%s :: failed to spool %s datapoints of a failed flush - %s' % (
+                        skyline_app, str(len(retried_metrics)), str(e)))
+            if spooled:
+                logger.info('%s :: spooled %s datapoints that failed to be flushed twice' % (
+                    skyline_app, str(len(retried_metrics))))
+                self.stage_stats.increment('redis_flush.spooled_datapoints', len(retried_metrics))
+            else:
+                logger.error('%s :: discarded %s datapoints that failed to be flushed twice' % (
+                    skyline_app, str(len(retried_metrics))))
+                self.stage_stats.increment('redis_flush.discarded_datapoints', len(retried_metrics))
+
+        datapoints = 0
+        full_keys = set()
+        mini_keys = set()
+        head_timestamps = {}
+        for key, datapoint, timestamp, metric in retry:
+            pipe.append(key, datapoint)
+            if metric is not None:
+                full_keys.add(key)
+                datapoints += 1
+            else:
+                mini_keys.add(key)
+            if ROOMBA_INCREMENTAL:
+                if timestamp < head_timestamps.get(key, timestamp + 1):
+                    head_timestamps[key] = timestamp
+        if retry:
+            logger.info('%s :: retrying %s appends that failed to be flushed' % (
+                skyline_app, str(len(retry))))
+            self.stage_stats.increment('redis_flush.retried_datapoints', datapoints)
+            # The mini rollups of the metrics that have stopped sending are
+            # counted as datapoints
+            datapoints = max(datapoints, 1)
+        return retry, datapoints, full_keys, mini_keys, head_timestamps
+
+    def queue_drained(self):
+        """
+        Determine if the queue is drained enough to replay spooled chunks.
+
+        # @added 20261018 - Horizon disk spool
+        """
+        try:
+            return self.q.qsize() <= SPOOL_REPLAY_MAX_QUEUE_SIZE
+        except NotImplementedError:
+            # qsize is not implemented on Mac OSX
+            return True
 
     def run(self):
         """
@@ -164,62 +489,335 @@ class Worker(Process):
         MAX_RESOLUTION = settings.MAX_RESOLUTION
         full_uniques = '%sunique_metrics' % FULL_NAMESPACE
         mini_uniques = '%sunique_metrics' % MINI_NAMESPACE
-        pipe = self.redis_conn.pipeline()
+        # @added 20261018 - Incremental Roomba
+        full_head_timestamps = '%shead_timestamps' % FULL_NAMESPACE
+        mini_head_timestamps = '%shead_timestamps' % MINI_NAMESPACE
+        # @modified 20261018 - Redis shards
+        # The metric keys are appended to on their REDIS_SHARDS shard
+        # pipe = self.redis_conn.pipeline()
+        redis_shards = get_redis_shards()
+        pipe = redis_shards.pipeline()
 
         last_send_to_graphite = time()
         queue_sizes = []
 
+        # @added 20261018 - Horizon worker pipeline batching
+        # The number of datapoints in the pipeline, when the first of them was
+        # added and the keys that need to be added to the unique_metrics sets
+        # when the pipeline is flushed.
+        pipe_datapoints = 0
+        pipe_started = None
+        pipe_full_keys = set()
+        pipe_mini_keys = set()
+        # @added 20261018 - Incremental Roomba
+        # The oldest timestamp appended to each key in the pipeline
+        pipe_head_timestamps = {}
+        # @added 20261018 - Horizon worker pipeline batching
+        # The (key, datapoint, timestamp, metric) of the appends in the
+        # pipeline, to retry them if the flush fails, the first pipe_retries
+        # of them are already retries
+        pipe_appends = []
+        pipe_retries = 0
+        flush_sizes = []
+        flush_latencies = []
+
+        # @added 20261018 - Horizon disk spool
+        # The replay rate is bounded with a token bucket of up to one second
+        # of HORIZON_SPOOL_REPLAY_RATE datapoints
+        FULL_DURATION = settings.FULL_DURATION
+        replay_tokens = 0
+        replay_last = time()
+
+        # @added 20261018 - Horizon stage instrumentation
+        stage_stats = self.stage_stats
+
+        # @added 20261018 - Binary timeseries codec
+        # Encode the datapoints in the TIMESERIES_CODEC format
+        encode_datapoint = get_datapoint_encoder()
+
+        # @added 20261018 - Mini namespace rollups
+        # The datapoints appended to the mini keys, as set by the
+        # MINI_NAMESPACE_MODE.  The rollup buckets of the metrics that have
+        # stopped sending are swept every MINI_ROLLUP_RESOLUTION seconds.
+        mini_namespace = self.mini_namespace
+        last_mini_sweep = time()
+
+        # @added 20261018 - Ingest normalisation
+        ingest_filter = self.ingest_filter
+        ingest_filter_active = ingest_filter.active
+        if HORIZON_RESOLUTION:
+            sweep_interval = HORIZON_RESOLUTION
+        else:
+            sweep_interval = INGEST_FILTER_SWEEP_INTERVAL
+        last_sweep = time()
+
+        # @added 20261018 - Cardinality guard
+        cardinality_guard = self.cardinality_guard
+
+        # @added 20261018 - Redis shards
+        # If the metric keys are not only in the REDIS_SOCKET_PATH Redis, the
+        # shards are pinged too
+        ping_redis_shards = redis_shards.socket_paths != [settings.REDIS_SOCKET_PATH]
+
         # python-2.x and python3.x handle while 1 and while True differently
         # while 1:
         running = True
         while running:
 
             # Make sure Redis is up
+            # @modified 20261018 - Redis shards
+            # The REDIS_SHARDS are checked as well as the REDIS_SOCKET_PATH
+            # Redis, the pipeline of a shard that is down would discard the
+            # datapoints of its metrics on every flush
             try:
                 self.redis_conn.ping()
+                redis_up = True
             except:
                 logger.error('%s :: can\'t connect to redis at socket path %s' % (skyline_app, settings.REDIS_SOCKET_PATH))
+                redis_up = False
+            if redis_up and ping_redis_shards:
+                failed_shards = redis_shards.ping()
+                if failed_shards:
+                    logger.error('%s :: can\'t connect to the redis shards at socket paths %s' % (
+                        skyline_app, ', '.join(redis_shards.socket_paths[shard] for shard in failed_shards)))
+                    redis_up = False
+            if not redis_up:
                 sleep(10)
                 # @modified 20180519 - Feature #2378: Add redis auth to Skyline and rebrow
                 if settings.REDIS_PASSWORD:
                     self.redis_conn = StrictRedis(password=settings.REDIS_PASSWORD, unix_socket_path=settings.REDIS_SOCKET_PATH)
                 else:
                     self.redis_conn = StrictRedis(unix_socket_path=settings.REDIS_SOCKET_PATH)
-                pipe = self.redis_conn.pipeline()
+                # @modified 20261018 - Redis shards
+                # The pipeline is made again on new connections to all the
+                # shards
+                # pipe = self.redis_conn.pipeline()
+                pipe.reset()
+                redis_shards.reconnect()
+                pipe = redis_shards.pipeline()
+                # @added 20261018 - Horizon worker pipeline batching
+                # Anything in the old pipeline is lost with the connection
+                # @modified 20261018 - Horizon worker pipeline batching
+                # The appends in the old pipeline are retried once in the new
+                # pipeline, rather than being discarded
+                # if pipe_datapoints:
+                #     logger.error('%s :: discarded %s datapoints in the pipeline' % (skyline_app, str(pipe_datapoints)))
+                # pipe_datapoints = 0
+                # pipe_started = None
+                # pipe_full_keys = set()
+                # pipe_mini_keys = set()
+                # pipe_head_timestamps = {}
+                pipe_appends, pipe_datapoints, pipe_full_keys, pipe_mini_keys, pipe_head_timestamps = self.retry_appends(
+                    pipe, pipe_appends, pipe_retries)
+                pipe_retries = len(pipe_appends)
+                if pipe_appends:
+                    pipe_started = time()
+                else:
+                    pipe_started = None
                 continue
 
             try:
                 # Get a chunk from the queue with a 15 second timeout
-                chunk = self.q.get(True, 15)
+                # @modified 20261018 - Horizon worker pipeline batching
+                # If there are datapoints in the pipeline only wait until the
+                # WORKER_PIPELINE_MAX_LATENCY is reached
+                # chunk = self.q.get(True, 15)
+                if pipe_datapoints:
+                    get_timeout = max(
+                        (pipe_started + WORKER_PIPELINE_MAX_LATENCY) - time(), 0.01)
+                else:
+                    get_timeout = 15
+                # @modified 20261018 - Horizon disk spool
+                # Replay a spooled chunk rather than getting one from the
+                # queue if the queue has drained and the replay rate allows
+                # chunk = self.q.get(True, get_timeout)
+                replaying = False
+                if self.spool:
+                    replay_now = time()
+                    replay_tokens = min(
+                        replay_tokens + ((replay_now - replay_last) * HORIZON_SPOOL_REPLAY_RATE),
+                        HORIZON_SPOOL_REPLAY_RATE)
+                    replay_last = replay_now
+                    if replay_tokens > 0 and self.queue_drained():
+                        chunk = self.spool.read_chunk()
+                        if chunk:
+                            replaying = True
+                            replay_tokens -= len(chunk)
+                            # @added 20261018 - Hash sharded workers
+                            if HORIZON_SHARDED_WORKERS:
+                                chunk = self.respool_other_shards(chunk)
+                    # @added 20261018 - Hash sharded workers
+                    # Make the datapoints spooled for the other workers
+                    # available to them
+                    for writer in self.respool_writers.values():
+                        writer.rotate_if_due(RESPOOL_SEGMENT_MAX_AGE)
+                    # Do not wait long on the queue while there is a spool
+                    # segment being replayed
+                    if self.spool.segment:
+                        get_timeout = min(get_timeout, 1)
+                if not replaying:
+                    # @modified 20261018 - Horizon stage instrumentation
+                    # chunk = self.q.get(True, get_timeout)
+                    wait_start = time()
+                    chunk = self.q.get(True, get_timeout)
+                    stage_stats.record('queue_wait', time() - wait_start, len(chunk))
                 # @modified 20170317 - Feature #1978: worker - DO_NOT_SKIP_LIST
                 # now = time()
                 now = int(time())
 
-                for metric in chunk:
+                # @modified 20261018 - Horizon stage instrumentation
+                # Filter the chunk through the skip list before appending so
+                # that the skip_list stage is timed on its own
+                # for metric in chunk:
+                #
+                #     # Check if we should skip it
+                #     if self.in_skip_list(metric[0]):
+                #         continue
+                skip_start = time()
+                chunk_length = len(chunk)
+                in_skip_list = self.in_skip_list
+                chunk = [metric for metric in chunk if not in_skip_list(metric[0])]
+                # @modified 20261018 - Ingest normalisation
+                # append_start = time()
+                # stage_stats.record('skip_list', append_start - skip_start, chunk_length)
+                normalise_start = time()
+                stage_stats.record('skip_list', normalise_start - skip_start, chunk_length)
 
-                    # Check if we should skip it
-                    if self.in_skip_list(metric[0]):
+                # @added 20261018 - Ingest normalisation
+                # Drop the datapoints outside the window, and the duplicates,
+                # and aggregate the resolution buckets before appending.  The
+                # window check was in the append loop.
+                chunk_length = len(chunk)
+                if replaying:
+                    # Spooled datapoints are older than MAX_RESOLUTION if the
+                    # replay is behind, they are kept if they are within the
+                    # FULL_DURATION
+                    oldest_timestamp = now - FULL_DURATION
+                else:
+                    oldest_timestamp = now - MAX_RESOLUTION
+                normalised = []
+                for metric in chunk:
+                    # Bad data coming in
+                    if metric[1][0] < oldest_timestamp:
                         continue
+                    if ingest_filter_active:
+                        # @modified 20261018 - Ingest normalisation
+                        # Spooled datapoints are appended as they are
+                        # datapoint = ingest_filter.filter(metric[0], metric[1], now)
+                        datapoint = ingest_filter.filter(metric[0], metric[1], now, replaying)
+                        if datapoint is None:
+                            continue
+                        if datapoint is not metric[1]:
+                            metric = (metric[0], datapoint)
+                    normalised.append(metric)
+                if ingest_filter_active:
+                    if now - last_sweep >= sweep_interval:
+                        normalised.extend(ingest_filter.sweep(now))
+                        last_sweep = now
+                    for counter, count in ingest_filter.pop_counts():
+                        stage_stats.increment('normalise.%s' % counter, count)
+                chunk = normalised
+                # @modified 20261018 - Cardinality guard
+                # append_start = time()
+                # stage_stats.record('normalise', append_start - normalise_start, chunk_length)
+                guard_start = time()
+                stage_stats.record('normalise', guard_start - normalise_start, chunk_length)
+
+                # @added 20261018 - Cardinality guard
+                # Drop the datapoints of the new metrics that are over the
+                # budget of their prefix.  If Redis cannot be checked the
+                # datapoints are accepted.
+                if cardinality_guard and chunk:
+                    chunk_length = len(chunk)
+                    try:
+                        rejected = cardinality_guard.check([metric[0] for metric in chunk], now)
+                    except Exception as e:
+                        logger.error('%s :: cardinality guard check failed, accepting the chunk: %s' % (
+                            skyline_app, str(e)))
+                        rejected = None
+                    if rejected:
+                        chunk = [metric for metric in chunk if metric[0] not in rejected]
+                        stage_stats.increment('cardinality_guard.rejected_metrics', len(rejected))
+                        stage_stats.increment('cardinality_guard.rejected_datapoints', chunk_length - len(chunk))
+                    append_start = time()
+                    stage_stats.record('cardinality_guard', append_start - guard_start, chunk_length)
+                else:
+                    append_start = time()
+
+                for metric in chunk:
 
                     # Bad data coming in
-                    if metric[1][0] < now - MAX_RESOLUTION:
+                    # @modified 20261018 - Horizon disk spool
+                    # Spooled datapoints are older than MAX_RESOLUTION if the
+                    # replay is behind, they are kept if they are within the
+                    # FULL_DURATION
+                    # if metric[1][0] < now - MAX_RESOLUTION:
+                    #     continue
+                    # @modified 20261018 - Ingest normalisation
+                    # The window is checked in the normalise stage
+                    # if replaying:
+                    #     if metric[1][0] < now - FULL_DURATION:
+                    #         continue
+                    # elif metric[1][0] < now - MAX_RESOLUTION:
+                    #     continue
+
+                    # @added 20261018 - Binary timeseries codec
+                    # Skip a datapoint that cannot be encoded rather than
+                    # the rest of the chunk
+                    try:
+                        datapoint = encode_datapoint(metric[1])
+                    except Exception:
                         continue
 
                     # Append to messagepack main namespace
                     key = ''.join((FULL_NAMESPACE, metric[0]))
-                    pipe.append(key, packb(metric[1]))
-                    pipe.sadd(full_uniques, key)
+                    # @modified 20261018 - Binary timeseries codec
+                    # pipe.append(key, packb(metric[1]))
+                    pipe.append(key, datapoint)
+                    # @modified 20261018 - Horizon worker pipeline batching
+                    # The unique_metrics sets are added to once per flush
+                    # pipe.sadd(full_uniques, key)
+                    pipe_full_keys.add(key)
+                    pipe_appends.append((key, datapoint, metric[1][0], metric))
+                    # @added 20261018 - Incremental Roomba
+                    if ROOMBA_INCREMENTAL:
+                        if metric[1][0] < pipe_head_timestamps.get(key, metric[1][0] + 1):
+                            pipe_head_timestamps[key] = metric[1][0]
+
+                    # @modified 20261018 - Mini namespace rollups
+                    # The datapoint, the mean of a closed rollup bucket or
+                    # nothing is appended to the mini key
+                    # if not self.skip_mini:
+                    #     # Append to mini namespace
+                    #     mini_key = ''.join((MINI_NAMESPACE, metric[0]))
+                    #     pipe.append(mini_key, packb(metric[1]))
+                    #     pipe.sadd(mini_uniques, mini_key)
+                    if mini_namespace:
+                        mini_datapoint = mini_namespace.datapoint(metric[0], metric[1], now)
+                        if mini_datapoint is not None:
+                            mini_key = ''.join((MINI_NAMESPACE, metric[0]))
+                            if mini_datapoint is not metric[1]:
+                                datapoint = encode_datapoint(mini_datapoint)
+                            pipe.append(mini_key, datapoint)
+                            pipe_mini_keys.add(mini_key)
+                            pipe_appends.append((mini_key, datapoint, mini_datapoint[0], None))
+                            if ROOMBA_INCREMENTAL:
+                                if mini_datapoint[0] < pipe_head_timestamps.get(mini_key, mini_datapoint[0] + 1):
+                                    pipe_head_timestamps[mini_key] = mini_datapoint[0]
 
-                    if not self.skip_mini:
-                        # Append to mini namespace
-                        mini_key = ''.join((MINI_NAMESPACE, metric[0]))
-                        pipe.append(mini_key, packb(metric[1]))
-                        pipe.sadd(mini_uniques, mini_key)
+                    # @modified 20261018 - Horizon worker pipeline batching
+                    # pipe.execute()
+                    if not pipe_datapoints:
+                        pipe_started = time()
+                    pipe_datapoints += 1
 
-                    pipe.execute()
+                stage_stats.record('append', time() - append_start, len(chunk))
 
             except Empty:
-                logger.info('%s :: worker queue is empty and timed out' % skyline_app)
+                # @modified 20261018 - Horizon worker pipeline batching
+                # Only report an empty queue if there is nothing to flush
+                if not pipe_datapoints:
+                    logger.info('%s :: worker queue is empty and timed out' % skyline_app)
             except WatchError:
                 logger.error('%s :: WatchError - %s' % (skyline_app, str(key)))
             except NotImplementedError:
@@ -227,10 +825,134 @@ class Worker(Process):
             except Exception as e:
                 logger.error('%s :: error: %s' % (skyline_app, str(e)))
 
+            # @added 20261018 - Mini namespace rollups
+            # Append the means of the rollup buckets of the metrics that have
+            # stopped sending, even if the queue is empty
+            if mini_namespace and time() - last_mini_sweep >= MINI_ROLLUP_RESOLUTION:
+                last_mini_sweep = time()
+                try:
+                    for metric_name, mini_datapoint in mini_namespace.sweep(int(last_mini_sweep)):
+                        mini_key = ''.join((MINI_NAMESPACE, metric_name))
+                        # @modified 20261018 - Horizon worker pipeline batching
+                        # pipe.append(mini_key, encode_datapoint(mini_datapoint))
+                        datapoint = encode_datapoint(mini_datapoint)
+                        pipe.append(mini_key, datapoint)
+                        pipe_mini_keys.add(mini_key)
+                        pipe_appends.append((mini_key, datapoint, mini_datapoint[0], None))
+                        if ROOMBA_INCREMENTAL:
+                            if mini_datapoint[0] < pipe_head_timestamps.get(mini_key, mini_datapoint[0] + 1):
+                                pipe_head_timestamps[mini_key] = mini_datapoint[0]
+                        if not pipe_datapoints:
+                            pipe_started = time()
+                        pipe_datapoints += 1
+                except Exception as e:
+                    logger.error('%s :: error appending the swept mini rollups: %s' % (skyline_app, str(e)))
+
+            # @added 20261018 - Horizon worker pipeline batching
+            # Flush the pipeline if it has reached the size or latency bound
+            if pipe_datapoints:
+                flush_pipe = False
+                if pipe_datapoints >= WORKER_PIPELINE_MAX_DATAPOINTS:
+                    flush_pipe = True
+                elif (time() - pipe_started) >= WORKER_PIPELINE_MAX_LATENCY:
+                    flush_pipe = True
+                if flush_pipe:
+                    flush_start = time()
+                    # @added 20261018 - Horizon worker pipeline batching
+                    # The shards that failed, None if the whole flush failed
+                    flush_failed = False
+                    flush_failed_shards = None
+                    try:
+                        if pipe_full_keys:
+                            pipe.sadd(full_uniques, *pipe_full_keys)
+                        if pipe_mini_keys:
+                            pipe.sadd(mini_uniques, *pipe_mini_keys)
+                        # @added 20261018 - Incremental Roomba
+                        # Only add keys that are not in the head_timestamps,
+                        # Roomba updates the head timestamp when it trims
+                        # @modified 20261018 - Redis shards
+                        # The sorted sets are added to on the shards of the
+                        # keys with zadd_nx
+                        if pipe_head_timestamps:
+                            full_heads = []
+                            mini_heads = []
+                            for head_key, head_timestamp in pipe_head_timestamps.items():
+                                if head_key in pipe_full_keys:
+                                    # full_heads.extend([head_timestamp, head_key])
+                                    full_heads.append((head_timestamp, head_key))
+                                else:
+                                    # mini_heads.extend([head_timestamp, head_key])
+                                    mini_heads.append((head_timestamp, head_key))
+                            if full_heads:
+                                # pipe.execute_command('ZADD', full_head_timestamps, 'NX', *full_heads)
+                                pipe.zadd_nx(full_head_timestamps, full_heads)
+                            if mini_heads:
+                                # pipe.execute_command('ZADD', mini_head_timestamps, 'NX', *mini_heads)
+                                pipe.zadd_nx(mini_head_timestamps, mini_heads)
+                        pipe.execute()
+                    except WatchError:
+                        logger.error('%s :: WatchError - flushing pipeline of %s datapoints' % (
+                            skyline_app, str(pipe_datapoints)))
+                        flush_failed = True
+                    except Exception as e:
+                        logger.error('%s :: error flushing pipeline of %s datapoints: %s' % (
+                            skyline_app, str(pipe_datapoints), str(e)))
+                        flush_failed = True
+                        # @added 20261018 - Horizon worker pipeline batching
+                        # Only the appends to the shards that failed are
+                        # retried
+                        if isinstance(e, ShardedPipelineError):
+                            flush_failed_shards = e.failed_shards
+                    flush_latency = time() - flush_start
+                    # @added 20261018 - Horizon stage instrumentation
+                    stage_stats.record('redis_flush', flush_latency, pipe_datapoints)
+                    if WORKER_DEBUG:
+                        logger.info('%s :: flushed %s datapoints to Redis in %.6f seconds' % (
+                            skyline_app, str(pipe_datapoints), flush_latency))
+                    # Only the canary reports the flush metrics
+                    if self.canary:
+                        flush_sizes.append(pipe_datapoints)
+                        flush_latencies.append(flush_latency)
+                    # @modified 20261018 - Horizon worker pipeline batching
+                    # The appends of a failed flush are retried once with the
+                    # next flush
+                    # pipe_datapoints = 0
+                    # pipe_started = None
+                    # pipe_full_keys = set()
+                    # pipe_mini_keys = set()
+                    # pipe_head_timestamps = {}
+                    if flush_failed:
+                        pipe.reset()
+                        pipe_appends, pipe_datapoints, pipe_full_keys, pipe_mini_keys, pipe_head_timestamps = self.retry_appends(
+                            pipe, pipe_appends, pipe_retries, flush_failed_shards)
+                        pipe_retries = len(pipe_appends)
+                        if pipe_appends:
+                            pipe_started = time()
+                        else:
+                            pipe_started = None
+                    else:
+                        pipe_datapoints = 0
+                        pipe_started = None
+                        pipe_full_keys = set()
+                        pipe_mini_keys = set()
+                        pipe_head_timestamps = {}
+                        pipe_appends = []
+                        pipe_retries = 0
+
+            # @added 20261018 - Horizon stage instrumentation
+            stage_stats.send_if_due()
+
             # Log progress
             if self.canary:
-                logger.info('%s :: queue size at %d' % (skyline_app, self.q.qsize()))
-                queue_sizes.append(self.q.qsize())
+                # @modified 20261018 - SO_REUSEPORT sharded listeners
+                # logger.info('%s :: queue size at %d' % (skyline_app, self.q.qsize()))
+                # queue_sizes.append(self.q.qsize())
+                try:
+                    queue_size = sum(canary_queue.qsize() for canary_queue in self.canary_queues)
+                except NotImplementedError:
+                    queue_size = 0
+                logger.info('%s :: queue size at %d' % (skyline_app, queue_size))
+                queue_sizes.append(queue_size)
                 # Only send average queue mertics to graphite once per 10 seconds
                 now = time()
                 last_sent_graphite = now - last_send_to_graphite
@@ -249,6 +971,81 @@ class Worker(Process):
                     send_metric_name = '%s.queue_size' % skyline_app_graphite_namespace
                     send_graphite_metric(skyline_app, send_metric_name, average_queue_size)
 
+                    # @added 20261018 - Horizon worker pipeline batching
+                    # Report the average pipeline flush size and latency
+                    if flush_sizes:
+                        average_flush_size = sum(flush_sizes) / len(flush_sizes)
+                        average_flush_latency = sum(flush_latencies) / len(flush_latencies)
+                    else:
+                        average_flush_size = 0
+                        average_flush_latency = 0
+                    logger.info('%s :: pipeline flushes for the last 10 seconds - %s' % (skyline_app, str(len(flush_sizes))))
+                    logger.info('%s :: average pipeline flush size for the last 10 seconds - %s' % (skyline_app, str(average_flush_size)))
+                    logger.info('%s :: average pipeline flush latency for the last 10 seconds - %.6f' % (skyline_app, average_flush_latency))
+                    send_metric_name = '%s.pipeline_flush_size' % skyline_app_graphite_namespace
+                    send_graphite_metric(skyline_app, send_metric_name, average_flush_size)
+                    send_metric_name = '%s.pipeline_flush_latency' % skyline_app_graphite_namespace
+                    send_graphite_metric(skyline_app, send_metric_name, '%.6f' % average_flush_latency)
+
+                    # @added 20261018 - Shared memory ring buffer transport
+                    # Report the ring buffer usage, high water mark and drops
+                    # since the last report
+                    ring_buffers = [
+                        canary_queue for canary_queue in self.canary_queues
+                        if hasattr(canary_queue, 'stats')]
+                    if ring_buffers:
+                        used_bytes = 0
+                        high_water_mark = 0
+                        dropped_datapoints = 0
+                        for ring_buffer in ring_buffers:
+                            ring_buffer_stats = ring_buffer.stats()
+                            used_bytes += ring_buffer_stats['used_bytes']
+                            high_water_mark += ring_buffer_stats['high_water_mark']
+                            dropped_datapoints += ring_buffer_stats['dropped_datapoints']
+                        logger.info('%s :: ring buffer bytes used - %s, high water mark for the last 10 seconds - %s' % (
+                            skyline_app, str(used_bytes), str(high_water_mark)))
+                        logger.info('%s :: ring buffer datapoints dropped for the last 10 seconds - %s' % (
+                            skyline_app, str(dropped_datapoints)))
+                        send_metric_name = '%s.ring_buffer_used_bytes' % skyline_app_graphite_namespace
+                        send_graphite_metric(skyline_app, send_metric_name, used_bytes)
+                        send_metric_name = '%s.ring_buffer_high_water_mark' % skyline_app_graphite_namespace
+                        send_graphite_metric(skyline_app, send_metric_name, high_water_mark)
+                        send_metric_name = '%s.ring_buffer_dropped_datapoints' % skyline_app_graphite_namespace
+                        send_graphite_metric(skyline_app, send_metric_name, dropped_datapoints)
+
+                    # @added 20261018 - Horizon disk spool
+                    # Report the spool depth and how far behind the replay is,
+                    # the age of the oldest spooled segment
+                    if self.spool:
+                        spool = spool_stats(HORIZON_SPOOL_DIR)
+                        logger.info('%s :: spool segments - %s, bytes - %s, replay lag - %s seconds' % (
+                            skyline_app, str(spool['segments']), str(spool['bytes']),
+                            str(spool['replay_lag'])))
+                        send_metric_name = '%s.spool_segments' % skyline_app_graphite_namespace
+                        send_graphite_metric(skyline_app, send_metric_name, spool['segments'])
+                        send_metric_name = '%s.spool_bytes' % skyline_app_graphite_namespace
+                        send_graphite_metric(skyline_app, send_metric_name, spool['bytes'])
+                        send_metric_name = '%s.spool_replay_lag' % skyline_app_graphite_namespace
+                        send_graphite_metric(skyline_app, send_metric_name, spool['replay_lag'])
+
+                    # @added 20261018 - Cardinality guard
+                    # Report the number of distinct new metrics refused in the
+                    # current window for each prefix, for all the workers
+                    if cardinality_guard:
+                        try:
+                            rejected_cardinality = cardinality_guard.rejected_cardinality(time())
+                        except Exception as e:
+                            logger.error('%s :: failed to get the rejected cardinality: %s' % (skyline_app, str(e)))
+                            rejected_cardinality = {}
+                        for prefix, rejected_metrics in sorted(rejected_cardinality.items()):
+                            logger.info('%s :: cardinality guard refused %s new metrics for %s in the window' % (
+                                skyline_app, str(rejected_metrics), prefix))
+                            send_metric_name = '%s.cardinality_guard.%s.rejected_metrics' % (
+                                skyline_app_graphite_namespace, prefix)
+                            send_graphite_metric(skyline_app, send_metric_name, rejected_metrics)
+
                     # reset queue_sizes and last_sent_graphite
                     queue_sizes = []
+                    flush_sizes = []
+                    flush_latencies = []
                     last_send_to_graphite = time()
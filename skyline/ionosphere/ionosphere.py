@@ -50,6 +50,8 @@ from skyline_functions import (
     fail_check, mysql_select, write_data_to_file, send_graphite_metric, mkdir_p,
     # @added 20170825 - Task #2132: Optimise Ionosphere DB usage
     get_memcache_metric_object)
+# @added 20261018 - Redis shards
+from redis_shards import get_redis_shards
 
 # @added 20161221 - calculate features for every anomaly, instead of making the
 # user do it in the frontend or calling the webapp constantly in a cron like
@@ -2896,7 +2898,10 @@ class Ionosphere(Thread):
             # Timed this takes 0.013319 seconds on 689 unique_metrics
             unique_metrics = []
             try:
-                unique_metrics = list(self.redis_conn.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                # @modified 20261018 - Redis shards
+                # The unique_metrics set is read from all the shards
+                # unique_metrics = list(self.redis_conn.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                unique_metrics = list(get_redis_shards().smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
             except:
                 logger.error(traceback.format_exc())
                 logger.error('error :: could not get the unique_metrics list from Redis')
@@ -1,6 +1,7 @@
 import logging
 from redis import StrictRedis
-from msgpack import Unpacker
+# @modified 20261018 - Binary timeseries codec
+# from msgpack import Unpacker
 import traceback
 from math import ceil
 from luminol.anomaly_detector import AnomalyDetector
@@ -14,6 +15,10 @@ from ast import literal_eval
 import settings
 from skyline_functions import (mysql_select, is_derivative_metric,
                                nonNegativeDerivative)
+# @added 20261018 - Binary timeseries codec
+from timeseries_codec import decode_timeseries
+# @added 20261018 - Redis shards
+from redis_shards import get_redis_shards
 
 # Database configuration
 config = {'user': settings.PANORAMA_DBUSER,
@@ -104,7 +109,9 @@ def get_anomalous_ts(base_name, anomaly_timestamp):
     anomalous_metric = '%s%s' % (settings.FULL_NAMESPACE, base_name)
     unique_metrics = []
     try:
-        unique_metrics = list(redis_conn.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+        # @modified 20261018 - Redis shards
+        # unique_metrics = list(redis_conn.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+        unique_metrics = list(get_redis_shards().smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
     except:
         logger.error(traceback.format_exc())
         logger.error('error :: get_assigned_metrics :: no unique_metrics')
@@ -130,7 +137,9 @@ def get_anomalous_ts(base_name, anomaly_timestamp):
     # @modified 20180419 -
     raw_assigned = []
     try:
-        raw_assigned = redis_conn.mget(assigned_metrics)
+        # @modified 20261018 - Redis shards
+        # raw_assigned = redis_conn.mget(assigned_metrics)
+        raw_assigned = get_redis_shards().mget(assigned_metrics)
     except:
         raw_assigned = []
     if raw_assigned == [None]:
@@ -168,9 +177,11 @@ def get_anomalous_ts(base_name, anomaly_timestamp):
     for i, metric_name in enumerate(assigned_metrics):
         try:
             raw_series = raw_assigned[i]
-            unpacker = Unpacker(use_list=False)
-            unpacker.feed(raw_series)
-            timeseries = list(unpacker)
+            # @modified 20261018 - Binary timeseries codec
+            # unpacker = Unpacker(use_list=False)
+            # unpacker.feed(raw_series)
+            # timeseries = list(unpacker)
+            timeseries = decode_timeseries(raw_series)
         except:
             timeseries = []
 
@@ -218,7 +229,9 @@ def get_anoms(anomalous_ts):
 
 def get_assigned_metrics(i):
     try:
-        unique_metrics = list(redis_conn.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+        # @modified 20261018 - Redis shards
+        # unique_metrics = list(redis_conn.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+        unique_metrics = list(get_redis_shards().smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
     except:
         logger.error(traceback.format_exc())
         logger.error('error :: get_assigned_metrics :: no unique_metrics')
@@ -369,9 +382,11 @@ def get_correlations(
             continue
         try:
             raw_series = raw_assigned[i]
-            unpacker = Unpacker(use_list=False)
-            unpacker.feed(raw_series)
-            timeseries = list(unpacker)
+            # @modified 20261018 - Binary timeseries codec
+            # unpacker = Unpacker(use_list=False)
+            # unpacker.feed(raw_series)
+            # timeseries = list(unpacker)
+            timeseries = decode_timeseries(raw_series)
         except:
             timeseries = []
         if not timeseries:
@@ -562,7 +577,9 @@ def process_correlations(i, anomaly_id):
         runtime = 0
         return (base_name, anomaly_timestamp, anomalies, correlated_metrics, correlations, sorted_correlations, metrics_checked_for_correlation, runtime)
     assigned_metrics = get_assigned_metrics(i)
-    raw_assigned = redis_conn.mget(assigned_metrics)
+    # @modified 20261018 - Redis shards
+    # raw_assigned = redis_conn.mget(assigned_metrics)
+    raw_assigned = get_redis_shards().mget(assigned_metrics)
     # @added 20180720 - Feature #2464: luminosity_remote_data
     remote_assigned = []
     if settings.REMOTE_SKYLINE_INSTANCES:
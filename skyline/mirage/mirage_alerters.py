@@ -13,7 +13,8 @@ from requests.utils import quote
 # Added for graphs showing Redis data
 import traceback
 import redis
-from msgpack import Unpacker
+# @modified 20261018 - Binary timeseries codec
+# from msgpack import Unpacker
 import datetime as dt
 # @added 20180809 - Bug #2498: Incorrect scale in some graphs
 from time import time
@@ -58,6 +59,10 @@ if True:
         write_data_to_file, mkdir_p,
         # @added 20170603 - Feature #2034: analyse_derivatives
         nonNegativeDerivative, in_list)
+    # @added 20261018 - Binary timeseries codec
+    from timeseries_codec import decode_timeseries
+    # @added 20261018 - Redis shards
+    from redis_shards import get_redis_shards
 
 skyline_app = 'mirage'
 skyline_app_logger = '%sLog' % skyline_app
@@ -336,7 +341,9 @@ def alert_smtp(alert, metric, second_order_resolution_seconds, context):
         # Create graph from Redis data
         redis_metric_key = '%s%s' % (settings.FULL_NAMESPACE, metric[1])
         try:
-            raw_series = REDIS_ALERTER_CONN.get(redis_metric_key)
+            # @modified 20261018 - Redis shards
+            # raw_series = REDIS_ALERTER_CONN.get(redis_metric_key)
+            raw_series = get_redis_shards().get(redis_metric_key)
             if settings.ENABLE_DEBUG or LOCAL_DEBUG:
                 logger.info('debug :: alert_smtp - raw_series: %s' % 'OK')
         except:
@@ -344,16 +351,21 @@ def alert_smtp(alert, metric, second_order_resolution_seconds, context):
                 logger.info('debug :: alert_smtp - raw_series: %s' % 'FAIL')
 
         try:
-            unpacker = Unpacker(use_list=True)
-            unpacker.feed(raw_series)
-            timeseries_x = [float(item[0]) for item in unpacker]
-            unpacker = Unpacker(use_list=True)
-            unpacker.feed(raw_series)
-            timeseries_y = [item[1] for item in unpacker]
-
-            unpacker = Unpacker(use_list=False)
-            unpacker.feed(raw_series)
-            timeseries = list(unpacker)
+            # @modified 20261018 - Binary timeseries codec
+            # Decode the timeseries once with decode_timeseries
+            # unpacker = Unpacker(use_list=True)
+            # unpacker.feed(raw_series)
+            # timeseries_x = [float(item[0]) for item in unpacker]
+            # unpacker = Unpacker(use_list=True)
+            # unpacker.feed(raw_series)
+            # timeseries_y = [item[1] for item in unpacker]
+            #
+            # unpacker = Unpacker(use_list=False)
+            # unpacker.feed(raw_series)
+            # timeseries = list(unpacker)
+            timeseries = decode_timeseries(raw_series)
+            timeseries_x = [float(item[0]) for item in timeseries]
+            timeseries_y = [item[1] for item in timeseries]
         except:
             logger.error('error :: alert_smtp - unpack timeseries failed')
             timeseries = None
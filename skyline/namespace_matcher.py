@@ -0,0 +1,194 @@
+"""
+namespace_matcher
+
+Precompiled matching of metric names against lists such as SKIP_LIST,
+DO_NOT_SKIP_LIST and NON_DERIVATIVE_MONOTONIC_METRICS.
+
+An item in a list matches a metric name if the item is a substring of the
+metric name, or if all the dotted namespace elements of the item are elements
+of the metric namespace.  These are the same semantics as the original
+Horizon worker in_skip_list and skyline_functions.in_list loops, however rather
+than iterating every item for every metric, the list is compiled once into an
+Aho-Corasick automaton for the substring matches and an element index for the
+dotted namespace element matches.  Decisions are cached per metric name as a
+metric's decision never changes for a given list.
+"""
+
+# The maximum number of metric names to cache decisions for, when the cache
+# is full it is cleared.
+DEFAULT_CACHE_SIZE = 100000
+
+
+class NamespaceMatcher(object):
+    """
+    Match metric names against a list of items, optionally excluding the
+    metric names that match an exclude list, e.g. SKIP_LIST and
+    DO_NOT_SKIP_LIST.
+    """
+
+    def __init__(self, match_list, exclude_list=None, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        :param match_list: the list of strings to match
+        :param exclude_list: the list of strings which override a match
+        :param cache_size: the maximum number of decisions to cache
+        :type match_list: list
+        :type exclude_list: list
+        :type cache_size: int
+        """
+        self.match_list = _CompiledList(match_list)
+        if exclude_list:
+            self.exclude_list = _CompiledList(exclude_list)
+        else:
+            self.exclude_list = None
+        self.cache_size = int(cache_size)
+        self.cache = {}
+
+    def match(self, metric_name):
+        """
+        Determine if the metric name matches the match list and does not match
+        the exclude list.
+
+        :param metric_name: the metric name
+        :type metric_name: str
+        :return: ``True`` or ``False``
+        :rtype: boolean
+        """
+        try:
+            return self.cache[metric_name]
+        except KeyError:
+            pass
+
+        matched = self.match_list.match(metric_name)
+        if matched and self.exclude_list:
+            if self.exclude_list.match(metric_name):
+                matched = False
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[metric_name] = matched
+        return matched
+
+
+class _CompiledList(object):
+    """
+    A list of strings compiled into an Aho-Corasick automaton for substring
+    matches and an index of dotted namespace elements.
+    """
+
+    def __init__(self, items):
+        self.always_match = False
+        # Aho-Corasick automaton state tables
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [False]
+        # Element index, element: [rule ids] and the number of elements that
+        # each rule requires
+        self.element_index = {}
+        self.rule_sizes = []
+
+        for item in items:
+            if item == '':
+                # An empty string is in every metric name
+                self.always_match = True
+                continue
+            self._add_substring(item)
+            self._add_elements(item)
+        self._build_failure_links()
+
+    def _add_substring(self, item):
+        state = 0
+        for char in item:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(False)
+                self.goto[state][char] = next_state
+            state = next_state
+        self.output[state] = True
+
+    def _add_elements(self, item):
+        elements = item.split('.')
+        unique_elements = set(elements)
+        # The original comparison is between the number of unique elements
+        # matched and the number of elements in the item, so an item with
+        # duplicate elements can never be matched on its elements.
+        if len(unique_elements) != len(elements):
+            return
+        rule_id = len(self.rule_sizes)
+        self.rule_sizes.append(len(unique_elements))
+        for element in unique_elements:
+            self.element_index.setdefault(element, []).append(rule_id)
+
+    def _build_failure_links(self):
+        queue = []
+        for state in self.goto[0].values():
+            self.fail[state] = 0
+            queue.append(state)
+        position = 0
+        while position < len(queue):
+            state = queue[position]
+            position += 1
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state and char not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(char, 0)
+                if self.output[self.fail[next_state]]:
+                    self.output[next_state] = True
+
+    def substring_match(self, metric_name):
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        state = 0
+        for char in metric_name:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                return True
+        return False
+
+    def elements_match(self, metric_name):
+        element_index = self.element_index
+        rule_sizes = self.rule_sizes
+        matched_counts = {}
+        for element in set(metric_name.split('.')):
+            for rule_id in element_index.get(element, ()):
+                count = matched_counts.get(rule_id, 0) + 1
+                if count == rule_sizes[rule_id]:
+                    return True
+                matched_counts[rule_id] = count
+        return False
+
+    def match(self, metric_name):
+        if self.always_match:
+            return True
+        if self.substring_match(metric_name):
+            return True
+        return self.elements_match(metric_name)
+
+
+_list_matchers = {}
+
+
+def get_namespace_matcher(check_list, exclude_list=None):
+    """
+    Return the process wide :class:`NamespaceMatcher` for the lists, creating
+    and caching it if it does not exist.
+
+    :param check_list: the list of strings to match
+    :param exclude_list: the list of strings which override a match
+    :type check_list: list
+    :type exclude_list: list
+    :return: NamespaceMatcher
+    """
+    matcher_key = (tuple(check_list), tuple(exclude_list or ()))
+    matcher = _list_matchers.get(matcher_key)
+    if matcher is None:
+        matcher = NamespaceMatcher(check_list, exclude_list)
+        _list_matchers[matcher_key] = matcher
+    return matcher
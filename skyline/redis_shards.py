@@ -0,0 +1,344 @@
+"""
+redis_shards
+
+Route the metric keys across one or more Redis instances.
+
+If REDIS_SHARDS is set to a list of Redis unix socket paths the
+FULL_NAMESPACE and MINI_NAMESPACE metric keys, and the members of the
+namespace ``unique_metrics`` and ``head_timestamps`` sets, are sharded across
+them.  A metric is assigned to a shard by consistent hashing of the metric
+name, without the namespace, so the full and mini keys of a metric are on the
+same shard and adding a shard only moves about 1 / n of the metrics.  Each
+shard has its own namespace sets of the metrics it holds and the apps read the
+union of them.  All the other Skyline keys stay in the REDIS_SOCKET_PATH
+Redis, which can also be one of the shards.
+
+If REDIS_SHARDS is not set there is one shard, the REDIS_SOCKET_PATH Redis,
+and everything behaves as it does without sharding.
+
+The apps use :func:`get_redis_shards` rather than a StrictRedis connection for
+the metric keys:
+
+- ``redis_shards.mget(keys)`` - get the keys from their shards, in parallel
+- ``redis_shards.smembers(set_name)`` - the union of a set on all the shards
+- ``redis_shards.connection(key)`` - the connection of the shard of a key
+- ``redis_shards.pipeline()`` - a :class:`ShardedPipeline`
+- ``redis_shards.ping()`` - the shards that do not respond
+"""
+
+from bisect import bisect
+from hashlib import md5
+import sys
+from threading import Thread
+
+from redis import StrictRedis
+from redis.exceptions import RedisError
+
+import settings
+
+try:
+    REDIS_SHARDS = list(settings.REDIS_SHARDS)
+except:
+    REDIS_SHARDS = []
+
+python_version = int(sys.version_info[0])
+
+# The number of points of each shard on the hash ring
+RING_POINTS_PER_SHARD = 160
+
+
+def _hash(value):
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return int(md5(value).hexdigest()[:8], 16)
+
+
+def _redis_connection(socket_path):
+    if settings.REDIS_PASSWORD:
+        return StrictRedis(password=settings.REDIS_PASSWORD, unix_socket_path=socket_path)
+    return StrictRedis(unix_socket_path=socket_path)
+
+
+def metric_base_name(key):
+    """
+    The metric name of a key without the FULL_NAMESPACE or MINI_NAMESPACE.
+    """
+    if key.startswith(settings.FULL_NAMESPACE):
+        return key[len(settings.FULL_NAMESPACE):]
+    if settings.MINI_NAMESPACE and key.startswith(settings.MINI_NAMESPACE):
+        return key[len(settings.MINI_NAMESPACE):]
+    return key
+
+
+class RedisShards(object):
+    """
+    The shard map of the metric keys.
+    """
+
+    def __init__(self, socket_paths=None):
+        """
+        :param socket_paths: the Redis unix socket paths of the shards,
+            defaults to REDIS_SHARDS or, if that is not set, REDIS_SOCKET_PATH
+        :type socket_paths: list
+        """
+        self.socket_paths = list(socket_paths or REDIS_SHARDS or [settings.REDIS_SOCKET_PATH])
+        self.connections = [_redis_connection(socket_path) for socket_path in self.socket_paths]
+        self.count = len(self.connections)
+        # The hash ring, each shard is at RING_POINTS_PER_SHARD points hashed
+        # from its socket path, so the order of REDIS_SHARDS does not matter
+        ring = []
+        for shard, socket_path in enumerate(self.socket_paths):
+            for point in range(RING_POINTS_PER_SHARD):
+                ring.append((_hash('%s-%d' % (socket_path, point)), shard))
+        ring.sort()
+        self.ring_hashes = [ring_hash for ring_hash, shard in ring]
+        self.ring_shards = [shard for ring_hash, shard in ring]
+
+    def shard(self, key):
+        """
+        The index of the shard of a metric key or metric name.
+
+        :param key: the metric key, with or without the namespace
+        :type key: str
+        :return: the shard index
+        :rtype: int
+        """
+        if self.count == 1:
+            return 0
+        if python_version == 3 and isinstance(key, bytes):
+            key = key.decode('utf-8')
+        index = bisect(self.ring_hashes, _hash(metric_base_name(key)))
+        if index == len(self.ring_hashes):
+            index = 0
+        return self.ring_shards[index]
+
+    def connection(self, key):
+        """
+        The Redis connection of the shard of a metric key.
+        """
+        return self.connections[self.shard(key)]
+
+    def group_by_shard(self, keys):
+        """
+        Group metric keys by shard.
+
+        :param keys: the metric keys
+        :type keys: list
+        :return: a list of the ``(position, key)`` tuples of each shard
+        :rtype: list
+        """
+        shards = [[] for connection in self.connections]
+        for position, key in enumerate(keys):
+            shards[self.shard(key)].append((position, key))
+        return shards
+
+    def sort_by_shard(self, keys):
+        """
+        The keys ordered by shard, so that a contiguous slice of them, like
+        the metrics assigned to an Analyzer process, is fetched from as few
+        shards as possible.
+        """
+        if self.count == 1:
+            return list(keys)
+        return [key for shard_keys in self.group_by_shard(keys) for position, key in shard_keys]
+
+    def _run_on_shards(self, function, shards):
+        # Run function(shard) for each of the shards, in a thread per shard
+        # if there is more than one
+        if len(shards) == 1:
+            return {shards[0]: function(shards[0])}
+        results = {}
+        errors = []
+
+        def run(shard):
+            try:
+                results[shard] = function(shard)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=run, args=(shard,)) for shard in shards]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    def mget(self, keys):
+        """
+        Get metric keys from their shards, in parallel.
+
+        :param keys: the metric keys
+        :type keys: list
+        :return: the values, in the order of the keys
+        :rtype: list
+        """
+        if self.count == 1:
+            return self.connections[0].mget(keys)
+        keys = list(keys)
+        grouped = self.group_by_shard(keys)
+        shards = [shard for shard, shard_keys in enumerate(grouped) if shard_keys]
+        if not shards:
+            return []
+        results = self._run_on_shards(
+            lambda shard: self.connections[shard].mget([key for position, key in grouped[shard]]),
+            shards)
+        values = [None] * len(keys)
+        for shard in shards:
+            for (position, key), value in zip(grouped[shard], results[shard]):
+                values[position] = value
+        return values
+
+    def get(self, key):
+        """
+        Get a metric key from its shard.
+        """
+        return self.connection(key).get(key)
+
+    def smembers(self, set_name):
+        """
+        The union of a namespace set, e.g. ``metrics.unique_metrics``, on all
+        the shards.
+        """
+        if self.count == 1:
+            return self.connections[0].smembers(set_name)
+        results = self._run_on_shards(
+            lambda shard: self.connections[shard].smembers(set_name),
+            list(range(self.count)))
+        members = set()
+        for shard_members in results.values():
+            members.update(shard_members)
+        return members
+
+    def pipeline(self, transaction=True):
+        """
+        A pipeline that routes the metric key commands to their shards.
+        """
+        return ShardedPipeline(self, transaction)
+
+    def reconnect(self):
+        """
+        Make new connections to all the shards.
+        """
+        self.connections = [_redis_connection(socket_path) for socket_path in self.socket_paths]
+
+    def ping(self):
+        """
+        The shards that do not respond to a PING.
+
+        :return: the list of the shard indexes
+        :rtype: list
+        """
+        failed_shards = []
+        for shard, connection in enumerate(self.connections):
+            try:
+                connection.ping()
+            except Exception:
+                failed_shards.append(shard)
+        return failed_shards
+
+
+class ShardedPipelineError(RedisError):
+    """
+    Raised by :meth:`ShardedPipeline.execute` when the pipelines of one or
+    more shards failed, once the pipelines of all the shards have been
+    executed.  The exception of each shard that failed is in ``errors``.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(ShardedPipelineError, self).__init__(
+            'the pipelines of %s shards failed - %s' % (
+                str(len(errors)),
+                ', '.join('%s: %s' % (str(shard), str(error)) for shard, error in sorted(errors.items()))))
+
+    @property
+    def failed_shards(self):
+        return sorted(self.errors)
+
+
+class ShardedPipeline(object):
+    """
+    A Redis pipeline per shard, for the commands that the Horizon workers
+    send for the metric keys.
+    """
+
+    def __init__(self, redis_shards, transaction=True):
+        self.redis_shards = redis_shards
+        self.pipes = [connection.pipeline(transaction) for connection in redis_shards.connections]
+        self.shard = redis_shards.shard
+
+    def append(self, key, value):
+        self.pipes[self.shard(key)].append(key, value)
+
+    def sadd(self, set_name, *keys):
+        """
+        Add metric keys to a namespace set on their shards.
+        """
+        if len(self.pipes) == 1:
+            self.pipes[0].sadd(set_name, *keys)
+            return
+        for shard, shard_keys in enumerate(self.redis_shards.group_by_shard(keys)):
+            if shard_keys:
+                self.pipes[shard].sadd(set_name, *[key for position, key in shard_keys])
+
+    def zadd_nx(self, set_name, timestamps):
+        """
+        Add the ``(timestamp, key)`` of metric keys to a namespace sorted set
+        on their shards, only if they are not already in it, which requires
+        Redis >= 3.0.2.
+        """
+        grouped = [[] for pipe in self.pipes]
+        for timestamp, key in timestamps:
+            grouped[self.shard(key)].extend([timestamp, key])
+        for shard, arguments in enumerate(grouped):
+            if arguments:
+                self.pipes[shard].execute_command('ZADD', set_name, 'NX', *arguments)
+
+    def execute(self):
+        """
+        Execute the pipelines of all the shards.  The pipeline of a shard that
+        fails is reset, so its commands are discarded rather than being sent
+        with the next execute, and the pipelines of the other shards are still
+        executed.
+
+        :return: the results of the commands of all the shards
+        :rtype: list
+        :raises ShardedPipelineError: if the pipelines of any shards failed
+        """
+        results = []
+        errors = {}
+        for shard, pipe in enumerate(self.pipes):
+            try:
+                results.extend(pipe.execute())
+            except Exception as e:
+                # redis-py does not reset a pipeline on every error
+                pipe.reset()
+                errors[shard] = e
+        if errors:
+            raise ShardedPipelineError(errors)
+        return results
+
+    def reset(self):
+        """
+        Discard the commands of the pipelines of all the shards.
+        """
+        for pipe in self.pipes:
+            pipe.reset()
+
+
+_redis_shards = None
+
+
+def get_redis_shards():
+    """
+    The RedisShards of the REDIS_SHARDS, created once per process.
+
+    :return: the shard map
+    :rtype: RedisShards
+    """
+    global _redis_shards
+    if _redis_shards is None:
+        _redis_shards = RedisShards()
+    return _redis_shards
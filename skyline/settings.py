@@ -17,6 +17,20 @@ REDIS_SOCKET_PATH = '/tmp/redis.sock'
 :vartype REDIS_SOCKET_PATH: str
 """
 
+# @added 20261018 - Redis shards
+REDIS_SHARDS = []
+"""
+:var REDIS_SHARDS: A list of the Redis unix socket paths to shard the metric
+    keys across, e.g. ['/tmp/redis.sock', '/tmp/redis-1.sock'].  The
+    FULL_NAMESPACE and MINI_NAMESPACE keys of a metric are assigned to a shard
+    by consistent hashing of the metric name, so adding a shard only moves
+    about 1 / n of the metrics.  All the other Skyline keys stay in the
+    REDIS_SOCKET_PATH Redis, which can also be one of the shards.  If empty
+    the metric keys are in the REDIS_SOCKET_PATH Redis.  Roomba runs
+    ROOMBA_PROCESSES vacuum processes for each shard.
+:vartype REDIS_SHARDS: list
+"""
+
 #REDIS_PASSWORD = 'DO.PLEASE.set.A.VERY.VERY.LONG.REDIS.password-time(now-1+before_you_forget)'
 REDIS_PASSWORD = None
 """
@@ -86,6 +100,31 @@ MINI_NAMESPACE = 'mini.'
 :vartype MINI_NAMESPACE: str
 """
 
+TIMESERIES_CODEC = 'msgpack'
+"""
+:var TIMESERIES_CODEC: The format that Horizon stores the datapoints of the
+    metrics in Redis in, either ``msgpack``, ``binary`` or ``gorilla``.
+:vartype TIMESERIES_CODEC: str
+
+- ``msgpack`` - each datapoint is a msgpack ``[timestamp, value]`` array.
+- ``binary`` - each datapoint is a fixed width 18 byte record of the
+  timestamp and value as little-endian float64s, after a 2 byte msgpack
+  extension header.  This is about 20% larger than msgpack but the apps
+  decode a metric into a numpy array with no copy, many times faster than
+  unpacking msgpack.
+- ``gorilla`` - Horizon appends binary records, which Roomba seals into
+  compressed blocks of delta of delta timestamps and XOR'd values when it
+  trims the FULL_NAMESPACE keys.  Regular 60 second data takes about 3 to 8
+  bytes a datapoint rather than 15 with msgpack and decodes several times
+  faster than msgpack.  The MINI_NAMESPACE keys are stored as ``binary``.
+
+All the apps read all the formats, including metric keys with both, so this can
+be changed on a running Skyline.  The Roomba vacuum rewrites the keys in the
+new format as it trims them.  ROOMBA_LUA_TRIM is only used with ``msgpack``, and
+if this is changed back to ``msgpack`` ROOMBA_LUA_TRIM should be disabled
+until a full vacuum has run.
+"""
+
 FULL_DURATION = 86400
 """
 :var FULL_DURATION: This is the rolling duration that will be stored in Redis.
@@ -104,6 +143,34 @@ MINI_DURATION = 3600
 :vartype MINI_DURATION: str
 """
 
+MINI_NAMESPACE_MODE = 'append'
+"""
+:var MINI_NAMESPACE_MODE: How the Horizon workers maintain the mini namespace,
+    if OCULUS_HOST is set, either ``append``, ``rollup`` or ``view``.
+:vartype MINI_NAMESPACE_MODE: str
+
+- ``append`` - every datapoint is appended to the mini key as well as the
+  full key, which doubles the Redis writes.
+- ``rollup`` - only the mean of the datapoints of each MINI_ROLLUP_RESOLUTION
+  bucket is appended to the mini key, with the timestamp of the start of the
+  bucket, when a datapoint in a later bucket arrives, or two resolutions
+  after the bucket opened if the metric stops sending.  Each worker keeps the
+  buckets of the metrics it sees, so use HORIZON_SHARDED_WORKERS for the mean
+  to be of all the datapoints of a bucket.
+- ``view`` - nothing is written to the mini keys, the mini timeseries is the
+  last MINI_DURATION seconds of the full key, see
+  skyline_functions.get_mini_timeseries, which is the only supported way to
+  read the mini timeseries.  Only use this if nothing reads the mini keys
+  from Redis directly.
+"""
+
+MINI_ROLLUP_RESOLUTION = 300
+"""
+:var MINI_ROLLUP_RESOLUTION: The resolution in seconds of the mini keys if the
+    MINI_NAMESPACE_MODE is ``rollup``.
+:vartype MINI_ROLLUP_RESOLUTION: int
+"""
+
 GRAPHITE_HOST = 'YOUR_GRAPHITE_HOST.example.com'
 """
 :var GRAPHITE_HOST: If you have a Graphite host set up, set this metric to get
@@ -399,6 +466,62 @@ CONSENSUS = 6
 :vartype CONSENSUS: int
 """
 
+ANALYZER_VECTORISED_ALGORITHMS = True
+"""
+:var ANALYZER_VECTORISED_ALGORITHMS: If ``True`` the timeseries is converted to
+    numpy arrays once and the ALGORITHMS are run on its shared statistics by
+    the analyzer algorithm_engine, rather than each algorithm converting the
+    timeseries to a pandas.Series and calculating the statistics itself.  The
+    results are the same.  Any algorithm that is not in the algorithm_engine
+    is run from algorithms.py.
+:vartype ANALYZER_VECTORISED_ALGORITHMS: boolean
+"""
+
+ANALYZER_BATCH_ALGORITHMS = True
+"""
+:var ANALYZER_BATCH_ALGORITHMS: If ``True`` each Analyzer process decodes its
+    assigned metrics in blocks of ANALYZER_BATCH_SIZE and evaluates the
+    algorithm_engine BATCH_ALGORITHMS for the timeseries of the same length in
+    each block as 2-D numpy arrays, before the metrics are analysed one by one.
+    The results are the same.
+:vartype ANALYZER_BATCH_ALGORITHMS: boolean
+"""
+
+ANALYZER_BATCH_SIZE = 1000
+"""
+:var ANALYZER_BATCH_SIZE: The number of metrics in each ANALYZER_BATCH_ALGORITHMS
+    block.  The decoded timeseries of a block are held in memory until the
+    metrics are analysed.
+:vartype ANALYZER_BATCH_SIZE: int
+"""
+
+ANALYZER_INCREMENTAL_STATE = False
+"""
+:var ANALYZER_INCREMENTAL_STATE: If ``True`` the exponentially weighted moving
+    average state of the stddev_from_moving_average algorithm of each metric is
+    kept in the Redis analyzer.incremental_state.<metric_name> keys between
+    runs, as blocks of datapoints, and each run only folds in the new
+    datapoints and drops the expired blocks rather than calculating the ewm of
+    the whole timeseries.  The ewm mean and std are the same as pandas to
+    within floating point rounding, so a result can differ when the last value
+    is within rounding of 3 stddevs of the ewm mean.  Requires
+    ANALYZER_VECTORISED_ALGORITHMS.
+:vartype ANALYZER_INCREMENTAL_STATE: boolean
+"""
+
+ANALYZER_SKIP_UNCHANGED_METRICS = True
+"""
+:var ANALYZER_SKIP_UNCHANGED_METRICS: If ``True`` Analyzer keeps the verdict of
+    each metric, with the last datapoint and the length of its timeseries, in
+    the Redis analyzer.verdict.<base_name> key for STALE_PERIOD seconds.  A
+    metric that has no new datapoints since the last run, e.g. a metric that is
+    sent every 5 minutes, reuses the verdict after the stale, too short and
+    boring checks, rather than running the algorithms again.  The
+    first_hour_average of a reused verdict is the one from the last run.  Not
+    used with ENABLE_SECOND_ORDER.
+:vartype ANALYZER_SKIP_UNCHANGED_METRICS: boolean
+"""
+
 RUN_OPTIMIZED_WORKFLOW = True
 """
 :var RUN_OPTIMIZED_WORKFLOW: This sets Analyzer to run in an optimized manner.
@@ -687,12 +810,118 @@ PICKLE_PORT = 2024
 :vartype PICKLE_PORT: str
 """
 
+PICKLE_MAX_CONNECTIONS = 64
+"""
+:var PICKLE_MAX_CONNECTIONS: The maximum number of concurrent connections the
+    Horizon pickle listener will serve, e.g. from multiple carbon-relays.
+:vartype PICKLE_MAX_CONNECTIONS: int
+
+Each connection has its own framing buffer, so a slow relay only delays its
+own data and does not stall ingestion from the other relays.
+"""
+
 UDP_PORT = 2025
 """
 :var UDP_PORT: This is the port that listens for Messagepack-encoded UDP packets.
 :vartype UDP_PORT: str
 """
 
+UDP_RECEIVE_BUFFER_SIZE = 8388608
+"""
+:var UDP_RECEIVE_BUFFER_SIZE: The size in bytes of the UDP listener socket
+    receive buffer (SO_RCVBUF).
+:vartype UDP_RECEIVE_BUFFER_SIZE: int
+
+A large receive buffer allows bursts of datagrams to be queued in the kernel
+while the listener drains the socket.  Note that the kernel limits this to
+``net.core.rmem_max``, so that may need to be increased as well.
+"""
+
+LINE_PORT = 2023
+"""
+:var LINE_PORT: This is the port that listens for Graphite plaintext protocol
+    lines, ``<metric> <value> <timestamp>``, over TCP.  Set to ``0`` to not
+    start the plaintext line listener.
+:vartype LINE_PORT: int
+
+This allows senders that only speak the carbon plaintext protocol to send
+directly to Horizon, without going through a carbon-relay.  The line listener
+serves up to ``PICKLE_MAX_CONNECTIONS`` concurrent connections.
+"""
+
+HORIZON_SHARDED_WORKERS = False
+"""
+:var HORIZON_SHARDED_WORKERS: Whether each Horizon worker owns a shard of the
+    metrics.
+:vartype HORIZON_SHARDED_WORKERS: boolean
+
+By default all the WORKER_PROCESSES take chunks from the same queue, so the
+datapoints of a metric can be appended to Redis by different workers and out
+of order, which is why Roomba sorts every timeseries.  If set to ``True`` each
+worker has its own queue and the listeners route each metric to the worker
+chosen by a stable hash (crc32) of the metric name.  Each metric is then only
+appended to by one worker, in the order the datapoints were received, and
+Roomba only sorts a timeseries if it is found to be out of order.  With
+sharded workers HORIZON_LISTEN_SHARED_QUEUE is not used and, if
+HORIZON_TRANSPORT is ``ring_buffer``, each worker has a ring buffer of
+HORIZON_RING_BUFFER_SIZE.  As each chunk is split between the workers, the
+CHUNK_SIZE may need to be increased.
+"""
+
+HORIZON_TRANSPORT = 'queue'
+"""
+:var HORIZON_TRANSPORT: How the Horizon listeners pass metrics to the
+    workers, either ``queue`` or ``ring_buffer``.
+:vartype HORIZON_TRANSPORT: str
+
+- ``queue`` - a multiprocessing Queue of MAX_QUEUE_SIZE chunks.  Each chunk is
+  pickled, copied through a pipe and unpickled by the worker.
+- ``ring_buffer`` - a shared memory ring buffer of HORIZON_RING_BUFFER_SIZE
+  bytes.  Each chunk is encoded with marshal and written directly into shared
+  memory, which avoids the pickle and pipe round trip.  The canary worker
+  reports the ``ring_buffer_used_bytes``, ``ring_buffer_high_water_mark`` and
+  ``ring_buffer_dropped_datapoints`` metrics.
+"""
+
+HORIZON_RING_BUFFER_SIZE = 67108864
+"""
+:var HORIZON_RING_BUFFER_SIZE: The size in bytes of each Horizon ring buffer,
+    only used if HORIZON_TRANSPORT is ``ring_buffer``.
+:vartype HORIZON_RING_BUFFER_SIZE: int
+
+Each datapoint takes roughly 30 bytes plus the length of the metric name.
+When the ring buffer is full the listeners drop chunks, the same as when the
+queue is full.
+"""
+
+HORIZON_LISTEN_PROCESSES = 1
+"""
+:var HORIZON_LISTEN_PROCESSES: The number of Horizon listener processes to
+    start for each of the PICKLE_PORT, UDP_PORT and LINE_PORT.
+:vartype HORIZON_LISTEN_PROCESSES: int
+
+Unpickling and unpacking is CPU bound and a single listener process can only
+use one core.  If this is greater than 1 the listener processes all bind the
+port with ``SO_REUSEPORT`` and the kernel distributes connections and
+datagrams between them.  This requires Linux 3.9 or later.  Note that the
+kernel assigns each TCP connection to one listener, so there should be at
+least as many carbon-relay connections as listener processes for the load to
+be spread.
+"""
+
+HORIZON_LISTEN_SHARED_QUEUE = True
+"""
+:var HORIZON_LISTEN_SHARED_QUEUE: Whether all the listener processes put
+    metrics on one queue shared by all the workers.
+:vartype HORIZON_LISTEN_SHARED_QUEUE: boolean
+
+If set to ``False`` and HORIZON_LISTEN_PROCESSES is greater than 1, each
+listener process has its own queue and the WORKER_PROCESSES are assigned to
+the queues in turn, so there is less contention on each queue.
+WORKER_PROCESSES must be greater than or equal to HORIZON_LISTEN_PROCESSES,
+otherwise a shared queue is used.  MAX_QUEUE_SIZE applies to each queue.
+"""
+
 CHUNK_SIZE = 10
 """
 :var CHUNK_SIZE: This is how big a 'chunk' of metrics will be before they are
@@ -716,6 +945,153 @@ Try increasing :mod:`settings.CHUNK_SIZE` and decreasing
 :mod:`settings.ANALYZER_PROCESSES` or decreasing :mod:`settings.ROOMBA_PROCESSES`
 """
 
+HORIZON_SPOOL_DIR = None
+"""
+:var HORIZON_SPOOL_DIR: The directory for the Horizon disk spool, e.g.
+    ``'/opt/skyline/horizon/spool'``, the directory must exist.
+:vartype HORIZON_SPOOL_DIR: str
+
+If this is set, when the queue is full the Horizon listeners append the chunks
+to segment files in this directory rather than dropping them and the workers
+replay the spooled chunks once the queue has drained.  The canary worker
+reports the ``spool_segments``, ``spool_bytes`` and ``spool_replay_lag``
+metrics, the replay lag being the age in seconds of the oldest spooled
+segment.  If this is ``None`` chunks are dropped when the queue is full.
+"""
+
+HORIZON_SPOOL_MAX_BYTES = 1073741824
+"""
+:var HORIZON_SPOOL_MAX_BYTES: The maximum size in bytes of the Horizon disk
+    spool, only used if HORIZON_SPOOL_DIR is set.
+:vartype HORIZON_SPOOL_MAX_BYTES: int
+
+When the spool reaches this size the listeners drop chunks, the same as when
+there is no spool.
+"""
+
+HORIZON_SPOOL_REPLAY_RATE = 10000
+"""
+:var HORIZON_SPOOL_REPLAY_RATE: The maximum number of spooled datapoints per
+    second that each Horizon worker replays, only used if HORIZON_SPOOL_DIR is
+    set.
+:vartype HORIZON_SPOOL_REPLAY_RATE: int
+
+The workers only replay spooled chunks while the queue is drained, this bounds
+the replay further so that it does not fill the queue again.  Spooled
+datapoints that are older than the FULL_DURATION are discarded.
+"""
+
+WORKER_PIPELINE_MAX_DATAPOINTS = 1000
+"""
+:var WORKER_PIPELINE_MAX_DATAPOINTS: The maximum number of datapoints that a
+    Horizon worker will add to its Redis pipeline before it is flushed.
+:vartype WORKER_PIPELINE_MAX_DATAPOINTS: int
+
+The Horizon workers collect the datapoints from one or more chunks into a single
+Redis pipeline, rather than making a round trip to Redis for every datapoint.
+The pipeline is flushed when it contains WORKER_PIPELINE_MAX_DATAPOINTS or when
+the oldest datapoint in it has been waiting for
+:mod:`settings.WORKER_PIPELINE_MAX_LATENCY` seconds, whichever is first.
+Setting this to 1 results in the pipeline being flushed for every datapoint.
+"""
+
+WORKER_PIPELINE_MAX_LATENCY = 1.0
+"""
+:var WORKER_PIPELINE_MAX_LATENCY: The maximum number of seconds a datapoint can
+    wait in a Horizon worker Redis pipeline before the pipeline is flushed.
+:vartype WORKER_PIPELINE_MAX_LATENCY: float
+"""
+
+HORIZON_STAGE_METRICS_INTERVAL = 60
+"""
+:var HORIZON_STAGE_METRICS_INTERVAL: The interval in seconds at which each
+    Horizon listener and worker process sends its per stage ingest metrics to
+    Graphite, in one batch.  Set to 0 to not send them.
+:vartype HORIZON_STAGE_METRICS_INTERVAL: int
+
+The listeners report the ``socket_read``, ``deserialise`` and ``queue_put``
+stages under ``skyline.horizon.listen.<type>.<process_number>`` and the
+workers report the ``queue_wait``, ``skip_list``, ``normalise``,
+``cardinality_guard``, ``append`` and ``redis_flush`` stages under ``skyline.horizon.worker.<process_number>``.
+For each stage the calls, items handled, items per second, average, max and
+p50/p95/p99 latency and a latency histogram are sent.  The workers also send
+the number of datapoints the normalise stage dropped as ``normalise.duplicate``,
+``normalise.future`` and ``normalise.late`` and aggregated as
+``normalise.aggregated``, and the number of metrics and datapoints the
+cardinality guard refused as ``cardinality_guard.rejected_metrics`` and
+``cardinality_guard.rejected_datapoints``.
+"""
+
+HORIZON_DROP_DUPLICATE_DATAPOINTS = True
+"""
+:var HORIZON_DROP_DUPLICATE_DATAPOINTS: If ``True`` each Horizon worker drops a
+    datapoint with the same timestamp as the last datapoint it appended for the
+    metric, rather than appending it for Roomba to remove.  Each worker only
+    knows the metrics it handles, so all the duplicates are only dropped with
+    HORIZON_SHARDED_WORKERS.
+:vartype HORIZON_DROP_DUPLICATE_DATAPOINTS: boolean
+"""
+
+HORIZON_RESOLUTION = 0
+"""
+:var HORIZON_RESOLUTION: If set, the Horizon workers aggregate the datapoints of
+    each metric into one datapoint per HORIZON_RESOLUTION seconds, at the start
+    of the bucket, with HORIZON_RESOLUTION_AGGREGATION.  A bucket is appended
+    when a datapoint for a later bucket arrives, or when it is two resolutions
+    old, and datapoints for a bucket that has been appended are dropped.  Set
+    to 0 to append every datapoint.
+:vartype HORIZON_RESOLUTION: int
+"""
+
+HORIZON_RESOLUTION_AGGREGATION = 'last'
+"""
+:var HORIZON_RESOLUTION_AGGREGATION: How the datapoints in a HORIZON_RESOLUTION
+    bucket are aggregated, ``last``, ``sum`` or ``mean``.
+:vartype HORIZON_RESOLUTION_AGGREGATION: str
+"""
+
+HORIZON_MAX_FUTURE_SECONDS = 0
+"""
+:var HORIZON_MAX_FUTURE_SECONDS: If set, the Horizon workers drop datapoints with
+    a timestamp more than HORIZON_MAX_FUTURE_SECONDS ahead of the time on the
+    Skyline server.  Set to 0 to accept them.
+:vartype HORIZON_MAX_FUTURE_SECONDS: int
+"""
+
+HORIZON_CARDINALITY_GUARD = False
+"""
+:var HORIZON_CARDINALITY_GUARD: If ``True`` the Horizon workers create no more than
+    HORIZON_NEW_METRICS_BUDGET new metrics per namespace prefix per
+    HORIZON_CARDINALITY_WINDOW.  Datapoints for the new metrics over the budget
+    are dropped, datapoints for metrics that exist are always accepted.  The
+    new metrics are counted in Redis HyperLogLogs shared by all the workers and
+    the number of distinct metrics refused per prefix is sent to Graphite as
+    ``skyline.horizon.worker.cardinality_guard.<prefix>.rejected_metrics``.
+:vartype HORIZON_CARDINALITY_GUARD: boolean
+"""
+
+HORIZON_NEW_METRICS_BUDGET = 1000
+"""
+:var HORIZON_NEW_METRICS_BUDGET: The number of new metrics that can be created per
+    namespace prefix per HORIZON_CARDINALITY_WINDOW.
+:vartype HORIZON_NEW_METRICS_BUDGET: int
+"""
+
+HORIZON_CARDINALITY_WINDOW = 3600
+"""
+:var HORIZON_CARDINALITY_WINDOW: The window in seconds that the
+    HORIZON_NEW_METRICS_BUDGET is for.
+:vartype HORIZON_CARDINALITY_WINDOW: int
+"""
+
+HORIZON_CARDINALITY_PREFIX_DEPTH = 2
+"""
+:var HORIZON_CARDINALITY_PREFIX_DEPTH: The number of dotted elements of the metric
+    name that make the namespace prefix the budget is for, e.g. with 2 the
+    prefix of ``stats.web-01.requests.abc123`` is ``stats.web-01``.
+:vartype HORIZON_CARDINALITY_PREFIX_DEPTH: int
+"""
+
 ROOMBA_PROCESSES = 1
 """
 :var ROOMBA_PROCESSES: This is the number of Roomba processes that will be
@@ -750,6 +1126,59 @@ stall, I/O wait being one such edge case.  Although 99.999% of the time Roomba
 is fine, this ensures that no Roombas hang around longer than expected.
 """
 
+ROOMBA_LUA_TRIM = False
+"""
+:var ROOMBA_LUA_TRIM: Whether Roomba trims the metric keys in Redis with a Lua
+    script.
+:vartype ROOMBA_LUA_TRIM: boolean
+
+By default each Roomba vacuum process gets all the unique_metrics with
+SMEMBERS and then for each key WATCHes, GETs, unpacks, sorts, trims and SETs
+the key, which is many round trips per key and retries keys that are written
+to during the process.  If set to ``True`` the unique_metrics set is walked
+with SSCAN and the keys are trimmed in Redis by a Lua script in batches of
+ROOMBA_LUA_BATCH_SIZE keys, only the counts are returned to Roomba.  The
+trimming is the same, however keys with strictly increasing timestamps, which
+is the norm, are trimmed without decoding each datapoint and keys that do not
+need trimming are not rewritten.  Requires Redis >= 3.2.
+"""
+
+ROOMBA_LUA_BATCH_SIZE = 20
+"""
+:var ROOMBA_LUA_BATCH_SIZE: The number of keys that the Roomba Lua script
+    trims per call.
+:vartype ROOMBA_LUA_BATCH_SIZE: int
+
+Redis does not serve other clients while a script runs, so this should be kept
+small enough that a batch runs in a few milliseconds.  Keys with a
+FULL_DURATION of datapoints at a 60 second resolution take around 1ms each.
+"""
+
+ROOMBA_INCREMENTAL = False
+"""
+:var ROOMBA_INCREMENTAL: Whether Roomba only vacuums the keys that have
+    datapoints older than the FULL_DURATION + ROOMBA_GRACE_TIME.
+:vartype ROOMBA_INCREMENTAL: boolean
+
+By default every Roomba run unpacks and trims every key.  If set to ``True``
+the Horizon workers and Roomba maintain a ``<namespace>head_timestamps``
+sorted set of the timestamp of the oldest datapoint in each key and each
+Roomba run only vacuums the keys with a head timestamp older than the cutoff,
+so the cost of Roomba depends on the number of keys with expired data rather
+than the total number of keys.  The datapoints to remove from a key with
+strictly increasing timestamps are found with a binary search.  A full vacuum
+is run every ROOMBA_INCREMENTAL_FULL_INTERVAL seconds to add any keys that are
+not in the sorted set and to sort any keys that have datapoints out of order,
+so this works best with HORIZON_SHARDED_WORKERS.  Requires Redis >= 3.0.2.
+"""
+
+ROOMBA_INCREMENTAL_FULL_INTERVAL = 3600
+"""
+:var ROOMBA_INCREMENTAL_FULL_INTERVAL: The number of seconds between full
+    Roomba vacuums when ROOMBA_INCREMENTAL is ``True``.
+:vartype ROOMBA_INCREMENTAL_FULL_INTERVAL: int
+"""
+
 MAX_RESOLUTION = 1000
 """
 :var MAX_RESOLUTION: The Horizon agent will ignore incoming datapoints if their
@@ -25,6 +25,8 @@ except ImportError:
     import urllib.error
 
 import settings
+# @added 20261018 - Compiled SKIP_LIST matcher
+from namespace_matcher import get_namespace_matcher
 
 try:
     from settings import GRAPHITE_HOST
@@ -98,6 +100,49 @@ def send_graphite_metric(current_skyline_app, metric, value):
     return False
 
 
+def send_graphite_metrics(current_skyline_app, metrics):
+    """
+    Sends a batch of skyline_app metrics to the `GRAPHITE_HOST` if a graphite
+    host is defined, in one connection and one plaintext payload.
+
+    # @added 20261018 - Horizon stage instrumentation
+
+    :param current_skyline_app: the skyline app using this function
+    :param metrics: a list of ``(metric, value)`` tuples
+    :type current_skyline_app: str
+    :type metrics: list
+    :return: ``True`` or ``False``
+    :rtype: boolean
+
+    """
+    if GRAPHITE_HOST == '' or not metrics:
+        return False
+
+    timestamp = int(time())
+    payload = ''.join(
+        '%s %s %i\n' % (metric, value, timestamp) for metric, value in metrics)
+
+    sock = socket.socket()
+    sock.settimeout(10)
+    try:
+        sock.connect((GRAPHITE_HOST, CARBON_PORT))
+        sock.sendall(payload.encode('utf-8'))
+        sock.close()
+        return True
+    except socket.error:
+        endpoint = '%s:%d' % (GRAPHITE_HOST, CARBON_PORT)
+        current_skyline_app_logger = str(current_skyline_app) + 'Log'
+        current_logger = logging.getLogger(current_skyline_app_logger)
+        current_logger.error(
+            'error :: could not send %s metrics to Graphite at %s' % (
+                str(len(metrics)), endpoint))
+        try:
+            sock.close()
+        except:
+            pass
+        return False
+
+
 def mkdir_p(path):
     """
     Create nested directories.
@@ -1045,21 +1090,29 @@ def in_list(metric_name, check_list):
     This is a part copy of the SKIP_LIST allows for a string match or a match on
     dotted elements within the metric namespace used in Horizon/worker
 
+    # @modified 20261018 - Compiled SKIP_LIST matcher
+    The check_list is compiled once per process into a
+    :class:`namespace_matcher.NamespaceMatcher`, the same engine the Horizon
+    worker uses for the SKIP_LIST, and the result is cached per metric name.
+
     """
 
-    metric_namespace_elements = metric_name.split('.')
-    metric_in_list = False
-    for in_list in check_list:
-        if in_list in metric_name:
-            metric_in_list = True
-            break
-        in_list_namespace_elements = in_list.split('.')
-        elements_matched = set(metric_namespace_elements) & set(in_list_namespace_elements)
-        if len(elements_matched) == len(in_list_namespace_elements):
-            metric_in_list = True
-            break
-
-    if metric_in_list:
+    # @modified 20261018 - Compiled SKIP_LIST matcher
+    # metric_namespace_elements = metric_name.split('.')
+    # metric_in_list = False
+    # for in_list in check_list:
+    #     if in_list in metric_name:
+    #         metric_in_list = True
+    #         break
+    #     in_list_namespace_elements = in_list.split('.')
+    #     elements_matched = set(metric_namespace_elements) & set(in_list_namespace_elements)
+    #     if len(elements_matched) == len(in_list_namespace_elements):
+    #         metric_in_list = True
+    #         break
+    if not check_list:
+        return False
+    matcher = get_namespace_matcher(check_list)
+    if matcher.match(metric_name):
         return True
 
     return False
@@ -1404,3 +1457,47 @@ def set_metric_as_derivative(current_skyline_app, base_name):
         return_boolean = False
 
     return return_boolean
+
+
+# @added 20261018 - Mini namespace rollups
+def get_mini_timeseries(redis_conn, base_name):
+    """
+    Get the mini timeseries of a metric, the MINI_NAMESPACE key or, if the
+    MINI_NAMESPACE_MODE is ``view``, the last MINI_DURATION seconds of the
+    FULL_NAMESPACE key.
+
+    :param redis_conn: the Redis connection
+    :param base_name: the metric name without a namespace
+    :type redis_conn: object
+    :type base_name: str
+    :return: the list of ``(timestamp, value)`` datapoints, empty if the
+        metric does not exist
+    :rtype: list
+
+    """
+    from timeseries_codec import decode_timeseries
+
+    try:
+        mini_namespace_mode = settings.MINI_NAMESPACE_MODE
+    except:
+        mini_namespace_mode = 'append'
+
+    if mini_namespace_mode != 'view':
+        raw_series = redis_conn.get('%s%s' % (settings.MINI_NAMESPACE, str(base_name)))
+        if raw_series is None:
+            return []
+        return decode_timeseries(raw_series)
+
+    raw_series = redis_conn.get('%s%s' % (settings.FULL_NAMESPACE, str(base_name)))
+    if raw_series is None:
+        return []
+    timeseries = decode_timeseries(raw_series)
+    if not timeseries:
+        return []
+    from_timestamp = timeseries[-1][0] - settings.MINI_DURATION
+    # The full key is in timestamp order apart from the datapoints appended
+    # since it was last trimmed, so scan back from the end
+    index = len(timeseries)
+    while index > 0 and timeseries[index - 1][0] > from_timestamp:
+        index -= 1
+    return timeseries[index:]
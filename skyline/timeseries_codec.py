@@ -0,0 +1,381 @@
+"""
+timeseries_codec
+
+Encode and decode the timeseries that Horizon stores in the Redis metric keys.
+
+Horizon appends each datapoint to the metric key and every app that reads a
+metric key decodes it through :func:`decode_timeseries`, or
+:func:`decode_timeseries_array` for a numpy array, rather than with its own
+msgpack Unpacker loop.  The format Horizon writes is set by TIMESERIES_CODEC:
+
+- ``msgpack`` - each datapoint is ``packb((timestamp, value))``, the original
+  format.
+- ``binary`` - each datapoint is a fixed width 18 byte record, the 2 byte
+  RECORD_HEADER followed by the timestamp and value as little-endian float64.
+  A key of binary records is decoded into an ``(n, 2)`` float64 numpy array
+  with no copy, by viewing the key data with an 18 byte row stride.
+
+The RECORD_HEADER is the msgpack header of a 16 byte extension type, fixext 16
+of type RECORD_EXT_TYPE, so a binary record is also a valid msgpack object.
+Any key, including a key with msgpack datapoints followed by binary records,
+which is what a key holds for a while after TIMESERIES_CODEC is changed, is
+therefore a valid msgpack stream and is decoded with the msgpack Unpacker,
+with an ext_hook that unpacks each binary record into a datapoint.  This is
+the dual read path during a migration.  Roomba writes the keys it trims back in the TIMESERIES_CODEC
+format, so the keys are migrated by the Roomba vacuums.
+
+- ``gorilla`` - the FULL_NAMESPACE keys are stored as sealed blocks of
+  compressed datapoints followed by an uncompressed tail of binary records,
+  which Horizon appends to.  Roomba seals the tail into blocks when it trims
+  a key.  The MINI_NAMESPACE keys are stored as binary records.
+
+A block is a Gorilla style encoding of up to GORILLA_BLOCK_POINTS datapoints,
+the delta of the deltas of the timestamps and the XOR of each value with the
+previous value.  Rather than the variable bit widths of Gorilla each block uses
+one byte aligned width for all its timestamps and one for all its values, the
+least significant and most significant bytes that are zero in all the XORs of
+the block being dropped, so that a block is decoded with numpy cumsum and
+bitwise_xor.accumulate rather than a bit by bit loop.  A block is the data of
+a msgpack ext 16 of type BLOCK_EXT_TYPE, so gorilla keys are valid msgpack
+streams too.  The layout of the block data is:
+
+- the BLOCK_HEADER, the count of datapoints, the first timestamp, the byte
+  width of the timestamp delta of deltas, the first value and the number of
+  dropped least significant bytes and the byte width of the value XORs
+- the count - 1 timestamp delta of deltas as little-endian signed ints
+- the count - 1 value XORs as little-endian unsigned ints
+"""
+
+from itertools import chain
+from struct import Struct
+import sys
+
+import numpy as np
+from msgpack import packb, Unpacker
+
+import settings
+
+try:
+    TIMESERIES_CODEC = settings.TIMESERIES_CODEC
+except:
+    TIMESERIES_CODEC = 'msgpack'
+
+python_version = int(sys.version_info[0])
+
+# msgpack fixext 16 and the extension type, S for Skyline
+RECORD_EXT_TYPE = 0x53
+RECORD_HEADER = b'\xd8\x53'
+RECORD_SIZE = 18
+record_struct = Struct('<2sdd')
+datapoint_struct = Struct('<dd')
+# The little-endian uint16 value of the RECORD_HEADER
+RECORD_HEADER_VALUE = 0x53d8
+
+# msgpack ext 16, the big-endian uint16 length of the data and the extension
+# type, G for Gorilla
+BLOCK_EXT_TYPE = 0x47
+block_ext_struct = Struct('>BHB')
+BLOCK_EXT_HEADER_SIZE = 4
+# count, first timestamp, timestamp width, first value, value shift and width
+block_header_struct = Struct('<HqBdBB')
+# 12 hours of 60 second data per block, larger blocks compress about as well
+# and there are fewer numpy calls per key to decode
+GORILLA_BLOCK_POINTS = 720
+TIMESTAMP_WIDTHS = (
+    (0, 0, None), (1, 127, '<i1'), (2, 32767, '<i2'),
+    (4, 2147483647, '<i4'), (8, None, '<i8'))
+
+
+def encode_binary_datapoint(datapoint):
+    """
+    Encode a datapoint as a binary record.
+
+    :param datapoint: the ``(timestamp, value)`` datapoint
+    :type datapoint: tuple
+    :return: the record
+    :rtype: bytes
+    """
+    return record_struct.pack(RECORD_HEADER, datapoint[0], datapoint[1])
+
+
+def get_datapoint_encoder(codec=None):
+    """
+    The function to encode a ``(timestamp, value)`` datapoint for appending to
+    a metric key in a codec.
+
+    :param codec: the codec, defaults to TIMESERIES_CODEC
+    :type codec: str
+    :return: the encoder function
+    :rtype: function
+    """
+    # Horizon appends binary records to the tail of gorilla keys
+    if (codec or TIMESERIES_CODEC) in ('binary', 'gorilla'):
+        return encode_binary_datapoint
+    return packb
+
+
+def get_namespace_codec(namespace, codec=None):
+    """
+    The codec to write the keys of a namespace in, gorilla blocks are only
+    used for the FULL_NAMESPACE keys.
+
+    :param namespace: the namespace, e.g. settings.FULL_NAMESPACE
+    :param codec: the codec, defaults to TIMESERIES_CODEC
+    :type namespace: str
+    :type codec: str
+    :return: the codec
+    :rtype: str
+    """
+    codec = codec or TIMESERIES_CODEC
+    if codec == 'gorilla' and namespace != settings.FULL_NAMESPACE:
+        return 'binary'
+    return codec
+
+
+def encode_block(timeseries):
+    """
+    Encode a timeseries as a block, returns ``None`` if the timestamps are not
+    all integral.
+
+    :param timeseries: the list of ``(timestamp, value)`` datapoints, no more
+        than 4094 datapoints
+    :type timeseries: list
+    :return: the block, including the msgpack ext 16 header
+    :rtype: bytes
+    """
+    array = np.array(timeseries, dtype=np.float64).reshape((len(timeseries), 2))
+    timestamps = array[:, 0].astype(np.int64)
+    if not (timestamps == array[:, 0]).all():
+        return None
+    delta_of_deltas = np.diff(timestamps, n=1)
+    delta_of_deltas[1:] = np.diff(delta_of_deltas)
+    if len(delta_of_deltas):
+        largest = int(np.abs(delta_of_deltas).max())
+    else:
+        largest = 0
+    for timestamp_width, maximum, dtype in TIMESTAMP_WIDTHS:
+        if maximum is None or largest <= maximum:
+            break
+    value_bits = array[:, 1].view('<u8')
+    xor_bytes = np.bitwise_xor(value_bits[1:], value_bits[:-1]).view(np.uint8).reshape((-1, 8))
+    nonzero_bytes = np.nonzero(xor_bytes.any(axis=0))[0]
+    if len(nonzero_bytes):
+        value_shift = int(nonzero_bytes[0])
+        value_width = int(nonzero_bytes[-1]) - value_shift + 1
+    else:
+        value_shift = 0
+        value_width = 0
+    parts = [block_header_struct.pack(
+        len(timeseries), int(timestamps[0]), timestamp_width,
+        float(array[0, 1]), value_shift, value_width)]
+    if timestamp_width:
+        parts.append(delta_of_deltas.astype(dtype).tobytes())
+    if value_width:
+        parts.append(xor_bytes[:, value_shift:value_shift + value_width].tobytes())
+    data = b''.join(parts)
+    return block_ext_struct.pack(0xc8, len(data), BLOCK_EXT_TYPE) + data
+
+
+def decode_block(data):
+    """
+    Decode the data of a block into an ``(n, 2)`` float64 numpy array of
+    timestamps and values.
+
+    :param data: the block data, without the msgpack ext 16 header
+    :type data: bytes
+    :return: the array
+    :rtype: numpy.ndarray
+    """
+    count, first_timestamp, timestamp_width, first_value, value_shift, value_width = \
+        block_header_struct.unpack_from(data)
+    offset = block_header_struct.size
+    array = np.empty((count, 2), dtype=np.float64)
+    deltas = np.zeros(count, dtype=np.int64)
+    if timestamp_width:
+        deltas[1:] = np.frombuffer(
+            data, dtype='<i%d' % timestamp_width, count=count - 1, offset=offset)
+        offset += timestamp_width * (count - 1)
+        np.cumsum(deltas, out=deltas)
+    timestamps = np.cumsum(deltas)
+    timestamps += first_timestamp
+    array[:, 0] = timestamps
+    xor_bytes = np.zeros((count, 8), dtype=np.uint8)
+    if value_width:
+        xor_bytes[1:, value_shift:value_shift + value_width] = np.frombuffer(
+            data, dtype=np.uint8, count=value_width * (count - 1),
+            offset=offset).reshape((count - 1, value_width))
+    value_bits = xor_bytes.view('<u8').reshape(count)
+    # The bits of the first value, at offset 11 of the block header
+    value_bits[:1] = np.frombuffer(data, dtype='<u8', count=1, offset=11)
+    array[:, 1] = np.bitwise_xor.accumulate(value_bits).view('<f8')
+    return array
+
+
+def _split_blocks(raw_series):
+    # The (start, length) of the data of the blocks at the start of a key and
+    # the offset of the tail
+    blocks = []
+    offset = 0
+    length = len(raw_series)
+    while length - offset > BLOCK_EXT_HEADER_SIZE and raw_series[offset:offset + 1] == b'\xc8':
+        marker, data_length, ext_type = block_ext_struct.unpack_from(raw_series, offset)
+        if ext_type != BLOCK_EXT_TYPE:
+            break
+        blocks.append((offset + BLOCK_EXT_HEADER_SIZE, data_length))
+        offset += BLOCK_EXT_HEADER_SIZE + data_length
+    return blocks, offset
+
+
+def encode_timeseries(timeseries, codec=None):
+    """
+    Encode a timeseries as the data of a metric key, as if each datapoint had
+    been appended.
+
+    :param timeseries: the list of ``(timestamp, value)`` datapoints
+    :param codec: the codec, defaults to TIMESERIES_CODEC
+    :type timeseries: list
+    :type codec: str
+    :return: the key data
+    :rtype: bytes
+    """
+    codec = codec or TIMESERIES_CODEC
+    if codec == 'gorilla':
+        # Seal all the datapoints, the last block may be partial
+        parts = []
+        for start in range(0, len(timeseries), GORILLA_BLOCK_POINTS):
+            block_timeseries = timeseries[start:start + GORILLA_BLOCK_POINTS]
+            block = encode_block(block_timeseries)
+            if block is None:
+                # Only integral timestamps can be sealed
+                block = b''.join(map(encode_binary_datapoint, block_timeseries))
+            parts.append(block)
+        return b''.join(parts)
+    if codec == 'binary':
+        return b''.join(map(encode_binary_datapoint, timeseries))
+    if not timeseries:
+        return b''
+    # Pack the whole list in C and strip the array header, which is what
+    # packing and appending each datapoint produces
+    packed = packb(timeseries)
+    if len(timeseries) <= 15:
+        return packed[1:]
+    if len(timeseries) <= 65535:
+        return packed[3:]
+    return packed[5:]
+
+
+def binary_records(raw_series):
+    """
+    The number of records if the key data is all binary records, otherwise
+    ``None``.
+    """
+    length = len(raw_series)
+    if not length or length % RECORD_SIZE or raw_series[:2] != RECORD_HEADER:
+        return None
+    records = length // RECORD_SIZE
+    headers = np.ndarray(
+        shape=(records,), dtype='<u2', buffer=raw_series, offset=0,
+        strides=(RECORD_SIZE,))
+    if records > 1 and not (headers == RECORD_HEADER_VALUE).all():
+        return None
+    return records
+
+
+class _Block(list):
+    # The datapoints of a block found by the Unpacker
+    pass
+
+
+def _datapoints(array):
+    # The list of (timestamp, value) tuples of an array, with int timestamps
+    # if they are all integral
+    timestamps = array[:, 0]
+    int_timestamps = timestamps.astype(np.int64)
+    if (int_timestamps == timestamps).all():
+        timestamps = int_timestamps.tolist()
+    else:
+        timestamps = timestamps.tolist()
+    return list(zip(timestamps, array[:, 1].tolist()))
+
+
+def _unpack_record(code, data):
+    # The Unpacker ext_hook for binary records and blocks
+    if code == BLOCK_EXT_TYPE:
+        return _Block(_datapoints(decode_block(data)))
+    if code != RECORD_EXT_TYPE:
+        raise ValueError('unknown msgpack extension type %s' % str(code))
+    timestamp, value = datapoint_struct.unpack(data)
+    if timestamp.is_integer():
+        timestamp = int(timestamp)
+    return (timestamp, value)
+
+
+def _unpack_timeseries(raw_series):
+    # The generic path for msgpack and mixed keys
+    unpacker = Unpacker(use_list=False, ext_hook=_unpack_record)
+    unpacker.feed(raw_series)
+    timeseries = list(unpacker)
+    # A block that is not at the start of the key is only possible if the
+    # key has the ext 16 marker byte somewhere
+    if b'\xc8' in raw_series and any(isinstance(datapoint, _Block) for datapoint in timeseries):
+        flattened = []
+        for datapoint in timeseries:
+            if isinstance(datapoint, _Block):
+                flattened.extend(datapoint)
+            else:
+                flattened.append(datapoint)
+        timeseries = flattened
+    return timeseries
+
+
+def decode_timeseries_array(raw_series):
+    """
+    Decode the data of a metric key into an ``(n, 2)`` float64 numpy array of
+    timestamps and values.  A key of binary records is decoded without a
+    copy, into a read only view of the key data.
+
+    :param raw_series: the key data
+    :type raw_series: bytes
+    :return: the array
+    :rtype: numpy.ndarray
+    """
+    records = binary_records(raw_series)
+    if records is not None:
+        return np.ndarray(
+            shape=(records, 2), dtype='<f8', buffer=raw_series, offset=2,
+            strides=(RECORD_SIZE, 8))
+    blocks, offset = _split_blocks(raw_series)
+    if blocks:
+        arrays = [decode_block(raw_series[start:start + length]) for start, length in blocks]
+        if offset < len(raw_series):
+            arrays.append(decode_timeseries_array(raw_series[offset:]))
+        return np.concatenate(arrays)
+    timeseries = [
+        datapoint for datapoint in _unpack_timeseries(raw_series)
+        if isinstance(datapoint, tuple)]
+    return np.fromiter(
+        chain.from_iterable(timeseries), dtype=np.float64,
+        count=len(timeseries) * 2).reshape((len(timeseries), 2))
+
+
+def decode_timeseries(raw_series):
+    """
+    Decode the data of a metric key into a list of ``(timestamp, value)``
+    tuples, the same as ``list(Unpacker(use_list=False))`` of a msgpack key.
+    Integral timestamps of binary records are returned as ints.  As with the
+    Unpacker, a TypeError is raised if the key did not exist.
+
+    :param raw_series: the key data
+    :type raw_series: bytes
+    :return: the timeseries
+    :rtype: list
+    """
+    records = binary_records(raw_series)
+    if records is None:
+        blocks, offset = _split_blocks(raw_series)
+        if not blocks:
+            return _unpack_timeseries(raw_series)
+        if offset < len(raw_series) and binary_records(raw_series[offset:]) is None:
+            # Blocks followed by msgpack datapoints
+            return _unpack_timeseries(raw_series)
+    return _datapoints(decode_timeseries_array(raw_series))
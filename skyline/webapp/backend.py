@@ -13,13 +13,18 @@ from flask import request
 # @added 20180720 - Feature #2464: luminosity_remote_data
 # Added redis and msgpack
 from redis import StrictRedis
-from msgpack import Unpacker
+# @modified 20261018 - Binary timeseries codec
+# from msgpack import Unpacker
 
 import settings
 from skyline_functions import (
     mysql_select,
     # @added 20180720 - Feature #2464: luminosity_remote_data
     nonNegativeDerivative, in_list, is_derivative_metric)
+# @added 20261018 - Binary timeseries codec
+from timeseries_codec import decode_timeseries
+# @added 20261018 - Redis shards
+from redis_shards import get_redis_shards
 
 import skyline_version
 skyline_version = skyline_version.__absolute_version__
@@ -479,7 +484,9 @@ def luminosity_remote_data(anomaly_timestamp):
     until_timestamp = int(anomaly_timestamp) + 61
 
     try:
-        unique_metrics = list(REDIS_CONN.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+        # @modified 20261018 - Redis shards
+        # unique_metrics = list(REDIS_CONN.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+        unique_metrics = list(get_redis_shards().smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
     except Exception as e:
         logger.error('error :: %s' % str(e))
         logger.error('error :: luminosity_remote_data :: could not determine unique_metrics from Redis set')
@@ -504,7 +511,9 @@ def luminosity_remote_data(anomaly_timestamp):
     # Multi get series
     raw_assigned_failed = True
     try:
-        raw_assigned = REDIS_CONN.mget(assigned_metrics)
+        # @modified 20261018 - Redis shards
+        # raw_assigned = REDIS_CONN.mget(assigned_metrics)
+        raw_assigned = get_redis_shards().mget(assigned_metrics)
         raw_assigned_failed = False
     except:
         logger.info(traceback.format_exc())
@@ -521,9 +530,11 @@ def luminosity_remote_data(anomaly_timestamp):
         timeseries = []
         try:
             raw_series = raw_assigned[i]
-            unpacker = Unpacker(use_list=False)
-            unpacker.feed(raw_series)
-            timeseries = list(unpacker)
+            # @modified 20261018 - Binary timeseries codec
+            # unpacker = Unpacker(use_list=False)
+            # unpacker.feed(raw_series)
+            # timeseries = list(unpacker)
+            timeseries = decode_timeseries(raw_series)
         except:
             timeseries = []
 
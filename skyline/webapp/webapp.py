@@ -6,7 +6,8 @@ import sys
 import re
 import csv
 import traceback
-from msgpack import Unpacker
+# @modified 20261018 - Binary timeseries codec
+# from msgpack import Unpacker
 from functools import wraps
 from flask import (
     Flask, request, render_template, redirect, Response, abort, flash,
@@ -75,6 +76,10 @@ from skyline_functions import (
     # @added 20180804 - Feature #2488: Allow user to specifically set metric as a derivative metric in training_data
     set_metric_as_derivative,
 )
+# @added 20261018 - Binary timeseries codec
+from timeseries_codec import decode_timeseries
+# @added 20261018 - Redis shards
+from redis_shards import get_redis_shards
 
 from backend import (
     panorama_request, get_list,
@@ -518,15 +523,19 @@ def api():
     if 'metric' in request.args:
         metric = request.args.get(str('metric'), None)
         try:
-            raw_series = REDIS_CONN.get(metric)
+            # @modified 20261018 - Redis shards
+            # raw_series = REDIS_CONN.get(metric)
+            raw_series = get_redis_shards().get(metric)
             if not raw_series:
                 resp = json.dumps(
                     {'results': 'Error: No metric by that name - try /api?metric=' + settings.FULL_NAMESPACE + 'metric_namespace'})
                 return resp, 404
             else:
-                unpacker = Unpacker(use_list=False)
-                unpacker.feed(raw_series)
-                timeseries = [item[:2] for item in unpacker]
+                # @modified 20261018 - Binary timeseries codec
+                # unpacker = Unpacker(use_list=False)
+                # unpacker.feed(raw_series)
+                # timeseries = [item[:2] for item in unpacker]
+                timeseries = [item[:2] for item in decode_timeseries(raw_series)]
                 resp = json.dumps({'results': timeseries})
                 return resp, 200
         except Exception as e:
@@ -726,7 +735,9 @@ def panorama():
             if key == 'metric' and value != 'all':
                 if value != '':
                     try:
-                        unique_metrics = list(REDIS_CONN.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                        # @modified 20261018 - Redis shards
+                        # unique_metrics = list(REDIS_CONN.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                        unique_metrics = list(get_redis_shards().smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
                     except:
                         logger.error('error :: Webapp could not get the unique_metrics list from Redis')
                         logger.info(traceback.format_exc())
@@ -781,7 +792,9 @@ def panorama():
                 metric_namespace_pattern = value.replace('%', '')
                 if metric_namespace_pattern != '' and value != 'all':
                     try:
-                        unique_metrics = list(REDIS_CONN.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                        # @modified 20261018 - Redis shards
+                        # unique_metrics = list(REDIS_CONN.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                        unique_metrics = list(get_redis_shards().smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
                     except:
                         logger.error('error :: Webapp could not get the unique_metrics list from Redis')
                         logger.info(traceback.format_exc())
@@ -1049,7 +1062,9 @@ def ionosphere():
                 if not metric_found:
                     metric_name = settings.FULL_NAMESPACE + base_name
                     try:
-                        unique_metrics = list(REDIS_CONN.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                        # @modified 20261018 - Redis shards
+                        # unique_metrics = list(REDIS_CONN.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                        unique_metrics = list(get_redis_shards().smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
                     except:
                         logger.error('error :: Webapp could not get the unique_metrics list from Redis')
                         logger.info(traceback.format_exc())
@@ -1237,7 +1252,9 @@ def ionosphere():
 
             if key == 'metric' and not_metric_wildcard:
                 try:
-                    unique_metrics = list(REDIS_CONN.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                    # @modified 20261018 - Redis shards
+                    # unique_metrics = list(REDIS_CONN.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                    unique_metrics = list(get_redis_shards().smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
                 except:
                     logger.error('error :: Webapp could not get the unique_metrics list from Redis')
                     logger.info(traceback.format_exc())
@@ -1286,7 +1303,9 @@ def ionosphere():
                 metric_namespace_pattern = value.replace('%', '')
                 if metric_namespace_pattern != '' and value != 'all':
                     try:
-                        unique_metrics = list(REDIS_CONN.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                        # @modified 20261018 - Redis shards
+                        # unique_metrics = list(REDIS_CONN.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                        unique_metrics = list(get_redis_shards().smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
                     except:
                         trace = traceback.format_exc()
                         fail_msg = 'error :: Webapp could not get the unique_metrics list from Redis'
@@ -1834,7 +1853,9 @@ def ionosphere():
 
                 if key == 'metric' or key == 'metric_td':
                     try:
-                        unique_metrics = list(REDIS_CONN.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                        # @modified 20261018 - Redis shards
+                        # unique_metrics = list(REDIS_CONN.smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
+                        unique_metrics = list(get_redis_shards().smembers(settings.FULL_NAMESPACE + 'unique_metrics'))
                     except:
                         logger.error('error :: Webapp could not get the unique_metrics list from Redis')
                         logger.info(traceback.format_exc())
@@ -3313,9 +3334,13 @@ def rebrow_key(host, port, db, key):
             test_string = False
         if not test_string:
             raw_result = r.get(key)
-            unpacker = Unpacker(use_list=False)
-            unpacker.feed(raw_result)
-            val = list(unpacker)
+            # @modified 20261018 - Binary timeseries codec
+            # Metric keys may hold binary records, decode_timeseries decodes
+            # any msgpack key the same as the Unpacker
+            # unpacker = Unpacker(use_list=False)
+            # unpacker.feed(raw_result)
+            # val = list(unpacker)
+            val = decode_timeseries(raw_result)
             msg_pack_key = True
     elif t == 'list':
         val = r.lrange(key, 0, -1)
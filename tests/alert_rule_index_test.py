@@ -0,0 +1,54 @@
+import unittest2 as unittest
+import os.path
+import sys
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.join(os.path.dirname(os.path.realpath(current_dir)))
+skyline_dir = parent_dir + '/skyline'
+sys.path.append(skyline_dir)
+
+from alert_rule_index import AlertRuleIndex
+
+
+class TestAlertRuleIndex(unittest.TestCase):
+    """
+    Test that the alert_rule_index matches the metrics as the Analyzer ALERTS
+    loops did
+    """
+
+    alerts = (
+        ('skyline', 'smtp', 1800),
+        ('stats.web.*.requests', 'smtp', 3600, 168),
+        ('carbon', 'slack', 600),
+        ('stats.db01.load', 'hipchat', 600),
+        ('[invalid', 'smtp', 600),
+    )
+
+    def test_match_rules(self):
+        index = AlertRuleIndex(self.alerts)
+        self.assertEqual(index.match_rules('skyline.analyzer.run_time'), ((0, 'regex'),))
+        self.assertEqual(index.match_rules('stats.web.01.requests'), ((1, 'regex'),))
+        self.assertEqual(index.match_rules('stats.carbon.updates'), ((2, 'substring'),))
+        self.assertEqual(index.match_rules('stats.db01.load'), ((3, 'absolute'),))
+        self.assertEqual(index.match_rules('app.[invalid'), ((4, 'substring'),))
+        self.assertEqual(index.match_rules('app.requests'), ())
+
+    def test_update_matches_only_added_metrics(self):
+        index = AlertRuleIndex(self.alerts)
+        self.assertEqual(index.update(['skyline.horizon.queue', 'app.requests']), (2, 0))
+        index.index['app.requests'] = ((2, 'substring'),)
+        self.assertEqual(index.update(['app.requests', 'stats.web.01.requests']), (1, 1))
+        self.assertNotIn('skyline.horizon.queue', index.index)
+        # Not matched again
+        self.assertEqual(index.matches('app.requests'), ((2, 'substring'),))
+
+    def test_smtp_alerter_and_mirage_metric(self):
+        index = AlertRuleIndex(self.alerts)
+        self.assertTrue(index.smtp_alerter('skyline.analyzer.run_time'))
+        self.assertFalse(index.smtp_alerter('stats.carbon.updates'))
+        self.assertTrue(index.mirage_metric('stats.web.01.requests'))
+        self.assertFalse(index.mirage_metric('skyline.analyzer.run_time'))
+
+
+if __name__ == '__main__':
+    unittest.main()
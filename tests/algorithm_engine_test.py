@@ -0,0 +1,77 @@
+import unittest2 as unittest
+from time import time
+import os.path
+import random
+import sys
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.join(os.path.dirname(os.path.realpath(current_dir)))
+skyline_dir = parent_dir + '/skyline'
+sys.path.append(skyline_dir)
+
+from analyzer import algorithms
+from analyzer import algorithm_engine
+import settings
+
+
+class TestAlgorithmEngine(unittest.TestCase):
+    """
+    Test that the algorithm_engine returns the same results as the
+    algorithms.py functions
+    """
+
+    def series(self):
+        now = int(time())
+        random.seed(1)
+        anomalous = [1.0] * 1439 + [1000.0]
+        noisy = [random.gauss(100, 10) for i in range(1440)]
+        spike = noisy[:-3] + [300.0, 310.0, 320.0]
+        steps = [float(random.randint(0, 3)) for i in range(500)]
+        trend = [float(i) * 0.1 + random.random() for i in range(1440)]
+        return [
+            [(now - ((len(values) - 1 - i) * 60), value) for i, value in enumerate(values)]
+            for values in (anomalous, noisy, spike, steps, trend)]
+
+    def test_same_results_as_algorithms(self):
+        for timeseries in self.series():
+            statistics = algorithm_engine.get_series_statistics(timeseries)
+            for algorithm in settings.ALGORITHMS:
+                self.assertEqual(
+                    bool(algorithm_engine.ALGORITHMS[algorithm](statistics)),
+                    bool(getattr(algorithms, algorithm)(timeseries)),
+                    '%s differs' % algorithm)
+
+    def test_same_ensemble(self):
+        for timeseries in self.series():
+            results = []
+            for vectorised in (False, True):
+                algorithms.ANALYZER_VECTORISED_ALGORITHMS = vectorised
+                results.append(algorithms.run_selected_algorithm(timeseries, 'test.metric'))
+            self.assertEqual(results[0], results[1])
+
+    def test_batch_algorithms(self):
+        timeseries_list = self.series()
+        batch = algorithm_engine.batch_algorithms(timeseries_list)
+        for timeseries, series_statistics in zip(timeseries_list, batch):
+            if len(timeseries) != 1440:
+                # The one timeseries of its length is not batched
+                self.assertIsNone(series_statistics)
+                continue
+            self.assertEqual(
+                sorted(series_statistics.results), sorted(algorithm_engine.BATCH_ALGORITHMS))
+            for algorithm, result in series_statistics.results.items():
+                self.assertEqual(
+                    result, bool(getattr(algorithms, algorithm)(timeseries)),
+                    '%s differs' % algorithm)
+            self.assertEqual(
+                algorithms.run_selected_algorithm(timeseries, 'test.metric', series_statistics),
+                algorithms.run_selected_algorithm(timeseries, 'test.metric'))
+
+    def test_values_that_are_not_finite_are_not_handled(self):
+        now = int(time())
+        self.assertIsNone(algorithm_engine.get_series_statistics([(now, 1.0), (now + 60, float('nan'))]))
+        self.assertIsNone(algorithm_engine.get_series_statistics([(now, 1.0), (now + 60, None)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
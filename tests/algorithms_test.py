@@ -76,6 +76,18 @@ class TestAlgorithms(unittest.TestCase):
         self.assertTrue(len(filter(None, ensemble)) >= settings.CONSENSUS)
         self.assertEqual(datapoint, 1000)
 
+    @patch.object(algorithms, 'time')
+    def test_run_selected_algorithm_reuses_last_verdict(self, timeMock):
+        timeMock.return_value, timeseries = self.data(time())
+        last_verdict = (False, [False] * len(settings.ALGORITHMS), 1000)
+        self.assertEqual(
+            algorithms.run_selected_algorithm(timeseries, "test.metric", None, last_verdict),
+            last_verdict)
+        # The stale check is still made
+        timeMock.return_value += settings.STALE_PERIOD + 1
+        with self.assertRaises(algorithms.Stale):
+            algorithms.run_selected_algorithm(timeseries, "test.metric", None, last_verdict)
+
     @unittest.skip('Fails inexplicable in certain environments.')
     @patch.object(algorithms, 'CONSENSUS')
     @patch.object(algorithms, 'ALGORITHMS')
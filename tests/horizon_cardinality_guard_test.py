@@ -0,0 +1,148 @@
+import os.path
+import sys
+
+import unittest2 as unittest
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.join(os.path.dirname(os.path.realpath(current_dir)))
+skyline_dir = parent_dir + '/skyline'
+sys.path.append(skyline_dir)
+sys.path.append(skyline_dir + '/horizon')
+
+from redis_shards import RedisShards
+from cardinality_guard import CardinalityGuard
+
+FULL_NAMESPACE = 'metrics.'
+
+
+class FakeRedis(object):
+    """
+    The set and HyperLogLog commands of a StrictRedis, with exact counts, and
+    a pipeline that runs them when it is executed
+    """
+
+    def __init__(self):
+        self.sets = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def sismember(self, name, value):
+        return value in self.sets.get(name, set())
+
+    def sadd(self, name, *values):
+        self.sets.setdefault(name, set()).update(values)
+
+    def smembers(self, name):
+        return set(
+            value if isinstance(value, bytes) else value.encode('utf-8')
+            for value in self.sets.get(name, set()))
+
+    def pfadd(self, name, *values):
+        self.sadd(name, *values)
+
+    def pfcount(self, name):
+        return len(self.sets.get(name, set()))
+
+    def expire(self, name, time):
+        pass
+
+
+class FakePipeline(object):
+
+    def __init__(self, redis_conn):
+        self.redis_conn = redis_conn
+        self.commands = []
+
+    def __getattr__(self, command):
+        def queue(*args):
+            self.commands.append((command, args))
+        return queue
+
+    def execute(self):
+        results = [getattr(self.redis_conn, command)(*args) for command, args in self.commands]
+        self.commands = []
+        return results
+
+
+class TestCardinalityGuard(unittest.TestCase):
+    """
+    Test the new metric budget per namespace prefix of the Horizon workers
+    """
+
+    now = 1500000000
+
+    def guard(self, budget=3, shards=1):
+        redis_shards = RedisShards(['/tmp/shard-%s.sock' % str(shard) for shard in range(shards)])
+        redis_shards.connections = [FakeRedis() for shard in range(shards)]
+        guard = CardinalityGuard(
+            FakeRedis(), redis_shards, FULL_NAMESPACE, budget, 600, 2)
+        return guard
+
+    def add_existing(self, guard, metric_name):
+        key = FULL_NAMESPACE + metric_name
+        guard.redis_shards.connection(key).sadd(guard.full_uniques, key)
+
+    def test_known_metrics_are_always_accepted(self):
+        guard = self.guard(budget=0)
+        self.add_existing(guard, 'stats.web.requests')
+        self.assertEqual(guard.check(['stats.web.requests'], self.now), set())
+        self.assertEqual(guard.check(['stats.web.errors'], self.now), set(['stats.web.errors']))
+        # The prefix is exhausted but the existing metric is still accepted
+        self.assertEqual(guard.check(['stats.web.requests', 'stats.web.latency'], self.now), set(['stats.web.latency']))
+
+    def test_budget_boundary(self):
+        guard = self.guard(budget=3)
+        self.assertEqual(guard.check(['stats.web.a', 'stats.web.b'], self.now), set())
+        self.assertNotIn('stats.web', guard.exhausted)
+        # The last of the budget is used, so the prefix is exhausted without
+        # a rejection
+        self.assertEqual(guard.check(['stats.web.c'], self.now), set())
+        self.assertIn('stats.web', guard.exhausted)
+        self.assertEqual(guard.check(['stats.web.d'], self.now), set(['stats.web.d']))
+        # Accepted metrics are known in the window
+        self.assertEqual(guard.check(['stats.web.a', 'stats.web.c'], self.now), set())
+        # Other prefixes have their own budget
+        self.assertEqual(guard.check(['stats.db.a'], self.now), set())
+
+    def test_rejections_are_counted(self):
+        guard = self.guard(budget=1)
+        rejected = guard.check(['stats.web.a', 'stats.web.b', 'stats.web.c', 'stats.db.a'], self.now)
+        self.assertEqual(len(rejected), 2)
+        self.assertEqual(guard.check(['stats.web.d', 'stats.web.d'], self.now), set(['stats.web.d']))
+        self.assertEqual(guard.check(['stats.web.b'], self.now), set(['stats.web.b']))
+        self.assertEqual(guard.rejected_cardinality(self.now), {'stats.web': 3})
+        self.assertEqual(guard.rejected_cardinality(self.now + 600), {})
+
+    def test_window_rollover(self):
+        guard = self.guard(budget=2)
+        self.assertEqual(guard.check(['stats.web.a', 'stats.web.b', 'stats.web.c'], self.now), set(['stats.web.c']))
+        self.assertEqual(guard.exhausted, set(['stats.web']))
+        self.assertEqual(guard.known, set(['stats.web.a', 'stats.web.b']))
+        next_window = guard.window_start + 600
+        self.assertEqual(guard.check(['stats.web.c'], next_window), set())
+        self.assertEqual(guard.window_start, next_window)
+        self.assertEqual(guard.known, set(['stats.web.c']))
+        self.assertEqual(guard.exhausted, set())
+        # A metric accepted in the last window that was not created is new
+        # again and uses the budget of the window
+        self.assertEqual(guard.check(['stats.web.a'], next_window), set())
+        self.assertEqual(guard.exhausted, set(['stats.web']))
+
+    def test_existing_is_looked_up_on_the_shard_of_each_metric(self):
+        guard = self.guard(shards=3)
+        metric_names = ['stats.host-%s.cpu' % str(i) for i in range(30)]
+        for metric_name in metric_names[:20]:
+            self.add_existing(guard, metric_name)
+        shards = set(guard.redis_shards.shard(FULL_NAMESPACE + metric_name) for metric_name in metric_names[:20])
+        self.assertTrue(len(shards) > 1)
+        self.assertEqual(guard.existing(metric_names), set(metric_names[:20]))
+        # A metric in the unique_metrics set of another shard is not found
+        key = FULL_NAMESPACE + metric_names[20]
+        other_shard = (guard.redis_shards.shard(key) + 1) % 3
+        guard.redis_shards.connections[other_shard].sadd(guard.full_uniques, key)
+        self.assertEqual(guard.existing(metric_names[20:]), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
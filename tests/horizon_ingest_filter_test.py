@@ -0,0 +1,68 @@
+import os.path
+import sys
+
+import unittest2 as unittest
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.join(os.path.dirname(os.path.realpath(current_dir)))
+skyline_dir = parent_dir + '/skyline'
+sys.path.append(skyline_dir)
+sys.path.append(skyline_dir + '/horizon')
+
+from ingest_filter import IngestFilter
+
+
+class TestIngestFilter(unittest.TestCase):
+    """
+    Test the Horizon worker duplicate, resolution and window filter
+    """
+
+    now = 1500000000
+
+    def test_duplicates_and_future_datapoints_are_dropped(self):
+        ingest_filter = IngestFilter(max_future=60)
+        self.assertEqual(ingest_filter.filter('a', (self.now, 1.0), self.now), (self.now, 1.0))
+        self.assertIsNone(ingest_filter.filter('a', (self.now, 2.0), self.now))
+        # Out of order datapoints are left for Roomba to sort
+        self.assertEqual(ingest_filter.filter('a', (self.now - 10, 3.0), self.now), (self.now - 10, 3.0))
+        self.assertEqual(ingest_filter.filter('b', (self.now, 1.0), self.now), (self.now, 1.0))
+        self.assertIsNone(ingest_filter.filter('b', (self.now + 61, 1.0), self.now))
+        self.assertEqual(dict(ingest_filter.pop_counts()), {'duplicate': 1, 'future': 1})
+        self.assertEqual(ingest_filter.pop_counts(), [])
+
+    def test_resolution_buckets(self):
+        for aggregation, expected in (('last', 3.0), ('sum', 6.0), ('mean', 2.0)):
+            ingest_filter = IngestFilter(resolution=60, aggregation=aggregation)
+            start = self.now - (self.now % 60)
+            for offset, value in ((10, 1.0), (40, 3.0), (20, 2.0), (40, 5.0)):
+                self.assertIsNone(ingest_filter.filter('a', (start + offset, value), self.now))
+            self.assertEqual(ingest_filter.filter('a', (start + 60, 1.0), self.now), (start, expected))
+            # A datapoint for a bucket that has been appended is late
+            self.assertIsNone(ingest_filter.filter('a', (start + 50, 1.0), self.now))
+            counts = dict(ingest_filter.pop_counts())
+            self.assertEqual(counts['duplicate'], 1)
+            self.assertEqual(counts['late'], 1)
+            # The open bucket is appended when it is two resolutions old
+            self.assertEqual(ingest_filter.sweep(start + 120), [])
+            self.assertEqual(ingest_filter.sweep(start + 180), [('a', (start + 60, 1.0))])
+            self.assertIsNone(ingest_filter.filter('a', (start + 70, 1.0), start + 180))
+
+
+    def test_replayed_datapoints_are_not_late(self):
+        ingest_filter = IngestFilter(resolution=60, aggregation='mean', max_future=60)
+        start = self.now - (self.now % 60)
+        # The live datapoints that arrived after the queue drained
+        self.assertIsNone(ingest_filter.filter('a', (start, 1.0), self.now))
+        self.assertEqual(ingest_filter.filter('a', (start + 60, 1.0), self.now), (start, 1.0))
+        # The spooled datapoints from before them are appended as they are
+        for offset in range(5):
+            datapoint = (start - 600 + (offset * 10), float(offset))
+            self.assertEqual(ingest_filter.filter('a', datapoint, self.now, replayed=True), datapoint)
+        self.assertIsNone(ingest_filter.filter('a', (self.now + 61, 1.0), self.now, replayed=True))
+        self.assertEqual(dict(ingest_filter.pop_counts()), {'future': 1})
+        # The open bucket is not changed
+        self.assertEqual(ingest_filter.buckets['a'], [start + 60, start + 60, 1.0, 1.0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import os.path
+import sys
+
+import unittest2 as unittest
+from msgpack import packb, unpackb
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.join(os.path.dirname(os.path.realpath(current_dir)))
+skyline_dir = parent_dir + '/skyline'
+sys.path.append(skyline_dir)
+sys.path.append(skyline_dir + '/horizon')
+
+from listen import valid_datapoint
+
+
+class TestValidDatapoint(unittest.TestCase):
+    """
+    Test that only datapoints with the [<metric>, [<timestamp>, <value>]]
+    shape are accepted from UDP datagrams
+    """
+
+    def test_valid_datapoints(self):
+        datapoints = unpackb(packb([['test.metric', [1500000000, 1.0]], ('test.metric', (1500000060, 2))]))
+        for datapoint in datapoints:
+            self.assertTrue(valid_datapoint(datapoint))
+
+    def test_invalid_datapoints(self):
+        for datapoint in (
+                unpackb(b'\x80'), None, 1, 'test.metric', [], ['test.metric'],
+                ['test.metric', 1.0], ['test.metric', [1500000000]], [1, [1500000000, 1.0]],
+                ['test.metric', [1500000000, 1.0], 'extra']):
+            self.assertFalse(valid_datapoint(datapoint), str(datapoint))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os.path
+import sys
+
+import unittest2 as unittest
+from mock import patch
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.join(os.path.dirname(os.path.realpath(current_dir)))
+skyline_dir = parent_dir + '/skyline'
+sys.path.append(skyline_dir)
+sys.path.append(skyline_dir + '/horizon')
+
+import settings
+import skyline_functions
+from mini_namespace import MiniNamespace
+from timeseries_codec import encode_timeseries
+
+
+class DictRedis(object):
+    """
+    The get of a StrictRedis, in a dict
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    def get(self, key):
+        return self.keys.get(key)
+
+
+class TestMiniNamespace(unittest.TestCase):
+    """
+    Test the datapoints appended to the mini keys in each MINI_NAMESPACE_MODE
+    and the mini timeseries that are read
+    """
+
+    now = 1500000000
+
+    def test_append(self):
+        mini_namespace = MiniNamespace('append')
+        datapoint = (self.now, 1.0)
+        self.assertIs(mini_namespace.datapoint('a', datapoint, self.now), datapoint)
+        self.assertEqual(mini_namespace.sweep(self.now), [])
+
+    def test_rollup(self):
+        mini_namespace = MiniNamespace('rollup', resolution=300, window=86400)
+        start = self.now - (self.now % 300)
+        for offset, value in ((0, 1.0), (60, 2.0), (120, 6.0)):
+            self.assertIsNone(mini_namespace.datapoint('a', (start + offset, value), start + offset))
+        self.assertIsNone(mini_namespace.datapoint('b', (start, 4.0), start))
+        # The mean of the bucket is appended when a later bucket starts
+        self.assertEqual(mini_namespace.datapoint('a', (start + 300, 5.0), start + 300), (start, 3.0))
+        # A late datapoint for the closed bucket is not
+        self.assertIsNone(mini_namespace.datapoint('a', (start + 240, 5.0), start + 300))
+        # The bucket of a metric that stopped sending is swept once it is two
+        # resolutions old
+        self.assertEqual(mini_namespace.sweep(start + 599), [])
+        self.assertEqual(mini_namespace.sweep(start + 600), [('b', (start, 4.0))])
+        self.assertEqual(mini_namespace.sweep(start + 900), [('a', (start + 300, 5.0))])
+        self.assertEqual(mini_namespace.rollups.buckets, {})
+        # The metrics that have not sent for longer than the window are pruned
+        mini_namespace.sweep(start + 300 + 86400 + 301)
+        self.assertEqual(mini_namespace.rollups.last_timestamps, {})
+
+    def test_view(self):
+        mini_namespace = MiniNamespace('view')
+        self.assertIsNone(mini_namespace.datapoint('a', (self.now, 1.0), self.now))
+        self.assertEqual(mini_namespace.sweep(self.now), [])
+        with self.assertRaises(ValueError):
+            MiniNamespace('none')
+
+    def test_get_mini_timeseries(self):
+        full_timeseries = [(self.now - (i * 60), float(i)) for i in range(100, -1, -1)]
+        mini_timeseries = [(self.now - 300, 1.0), (self.now, 2.0)]
+        redis_conn = DictRedis({
+            '%stest.metric' % settings.FULL_NAMESPACE: encode_timeseries(full_timeseries, 'msgpack'),
+            '%stest.metric' % settings.MINI_NAMESPACE: encode_timeseries(mini_timeseries, 'msgpack')})
+        with patch.object(skyline_functions.settings, 'MINI_NAMESPACE_MODE', 'append', create=True):
+            self.assertEqual(skyline_functions.get_mini_timeseries(redis_conn, 'test.metric'), mini_timeseries)
+            self.assertEqual(skyline_functions.get_mini_timeseries(redis_conn, 'no.metric'), [])
+        with patch.object(skyline_functions.settings, 'MINI_DURATION', 600):
+            with patch.object(skyline_functions.settings, 'MINI_NAMESPACE_MODE', 'view', create=True):
+                self.assertEqual(
+                    skyline_functions.get_mini_timeseries(redis_conn, 'test.metric'),
+                    full_timeseries[-10:])
+                self.assertEqual(skyline_functions.get_mini_timeseries(redis_conn, 'no.metric'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os.path
+import sys
+from multiprocessing import Process
+
+import unittest2 as unittest
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.join(os.path.dirname(os.path.realpath(current_dir)))
+skyline_dir = parent_dir + '/skyline'
+sys.path.append(skyline_dir)
+sys.path.append(skyline_dir + '/horizon')
+
+from ring_buffer import RingBuffer, encode_datapoints, decode_datapoints, Empty, Full
+
+
+def produce(ring_buffer, name, count):
+    for i in range(count):
+        ring_buffer.put([('%s.%d' % (name, j), (1500000000 + i, float(j))) for j in range(10)])
+
+
+class TestRingBuffer(unittest.TestCase):
+    """
+    Test the Horizon shared memory ring buffer transport
+    """
+
+    chunk = [
+        ('stats.web01.requests', (1500000000, 1.5)),
+        ('stats.web01.errors', (1500000060.0, 3)),
+        ('carbon.agents.skyline-1.cpuUsage', (1500000120, -0.25))]
+
+    def test_encode_decode_preserves_types(self):
+        decoded = decode_datapoints(encode_datapoints(self.chunk))
+        self.assertEqual(decoded, self.chunk)
+        for original, metric in zip(self.chunk, decoded):
+            self.assertEqual(type(metric[1][0]), type(original[1][0]))
+            self.assertEqual(type(metric[1][1]), type(original[1][1]))
+
+    def test_wraps_around_and_raises_full_and_empty(self):
+        message_size = 4 + len(encode_datapoints(self.chunk))
+        ring_buffer = RingBuffer(message_size * 3 - 7)
+        for i in range(20):
+            ring_buffer.put(self.chunk)
+            ring_buffer.put(self.chunk)
+            with self.assertRaises(Full):
+                ring_buffer.put(self.chunk)
+            self.assertEqual(ring_buffer.qsize(), 2)
+            self.assertEqual(ring_buffer.get(True, 1), self.chunk)
+            self.assertEqual(ring_buffer.get(False), self.chunk)
+            with self.assertRaises(Empty):
+                ring_buffer.get(True, 0.01)
+        stats = ring_buffer.stats()
+        self.assertEqual(stats['dropped_chunks'], 20)
+        self.assertEqual(stats['dropped_datapoints'], 60)
+        self.assertEqual(stats['high_water_mark'], message_size * 2)
+
+    def test_multiple_producer_processes(self):
+        ring_buffer = RingBuffer(1024 * 1024)
+        producers = [Process(target=produce, args=(ring_buffer, name, 100)) for name in ('a', 'b', 'c')]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+        datapoints = []
+        while 1:
+            try:
+                datapoints.extend(ring_buffer.get(True, 0.1))
+            except Empty:
+                break
+        self.assertEqual(len(datapoints), 3000)
+        timestamps = [metric[1][0] for metric in datapoints if metric[0] == 'b.3']
+        self.assertEqual(timestamps, sorted(timestamps))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os.path
+import sys
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+import unittest2 as unittest
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.join(os.path.dirname(os.path.realpath(current_dir)))
+skyline_dir = parent_dir + '/skyline'
+sys.path.append(skyline_dir)
+sys.path.append(skyline_dir + '/horizon')
+
+from sharded_queue import ShardedQueue, ShardedQueueFull, metric_shard
+
+
+class TestShardedQueue(unittest.TestCase):
+    """
+    Test the Horizon sharded worker queue routing
+    """
+
+    chunk = [('stats.host%d.cpu' % (i % 40), (1500000000 + i, float(i))) for i in range(200)]
+
+    def test_routes_each_metric_to_one_shard_in_order(self):
+        queues = [Queue(), Queue(), Queue()]
+        sharded_queue = ShardedQueue(queues)
+        sharded_queue.put(self.chunk)
+        sharded_queue.put(self.chunk)
+        self.assertEqual(sharded_queue.qsize(), sum(queue.qsize() for queue in queues))
+        for shard, queue in enumerate(queues):
+            datapoints = []
+            while not queue.empty():
+                datapoints.extend(queue.get())
+            for metric in datapoints:
+                self.assertEqual(metric_shard(metric[0], 3), shard)
+            expected = [metric for metric in self.chunk if metric_shard(metric[0], 3) == shard]
+            self.assertEqual(datapoints, expected * 2)
+
+    def test_full_shard_only_drops_its_datapoints(self):
+        queues = [Queue(), Queue(maxsize=1)]
+        sharded_queue = ShardedQueue(queues)
+        sharded_queue.put(self.chunk)
+        with self.assertRaises(ShardedQueueFull) as context:
+            sharded_queue.put(self.chunk)
+        expected_dropped = [metric for metric in self.chunk if metric_shard(metric[0], 2) == 1]
+        self.assertEqual(context.exception.dropped, len(expected_dropped))
+        self.assertEqual(context.exception.dropped_chunk, expected_dropped)
+        self.assertEqual(queues[0].qsize(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+
+import unittest2 as unittest
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.join(os.path.dirname(os.path.realpath(current_dir)))
+skyline_dir = parent_dir + '/skyline'
+sys.path.append(skyline_dir)
+sys.path.append(skyline_dir + '/horizon')
+
+from spool import SpoolWriter, SpoolReader, spool_stats, segment_shard
+
+
+class TestSpool(unittest.TestCase):
+    """
+    Test the Horizon disk spool
+    """
+
+    chunk = [
+        ('stats.web01.requests', (1500000000, 1.5)),
+        ('stats.web01.errors', (1500000060, 3))]
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir)
+
+    def test_replays_rotated_segments_in_order(self):
+        writer = SpoolWriter(self.spool_dir, 1024 * 1024)
+        reader = SpoolReader(self.spool_dir)
+        self.assertTrue(writer.write(self.chunk))
+        # The open segment is not replayed
+        self.assertIsNone(reader.read_chunk())
+        writer.rotate()
+        writer.write(self.chunk[:1])
+        writer.rotate()
+        stats = spool_stats(self.spool_dir)
+        self.assertEqual(stats['segments'], 2)
+        reader.last_checked = 0
+        self.assertEqual(reader.read_chunk(), self.chunk)
+        self.assertEqual(reader.read_chunk(), self.chunk[:1])
+        self.assertIsNone(reader.read_chunk())
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_drops_when_full_and_claims_orphaned_segments(self):
+        writer = SpoolWriter(self.spool_dir, 1)
+        self.assertTrue(writer.write(self.chunk))
+        self.assertFalse(writer.write(self.chunk))
+        writer.segment.close()
+        # A segment left open by a listener that is no longer running
+        orphan = os.path.join(self.spool_dir, '1500000000000-999999-1.spool.writing')
+        os.rename(writer.segment_path, orphan)
+        reader = SpoolReader(self.spool_dir)
+        self.assertEqual(reader.read_chunk(), self.chunk)
+
+    def test_segments_for_a_shard_are_claimed_by_its_worker(self):
+        for shard in (None, 0, 1, 5):
+            writer = SpoolWriter(self.spool_dir, 1024 * 1024, shard)
+            writer.write([('shard.%s' % str(shard), (1500000000, 1.0))])
+            writer.rotate()
+        self.assertEqual(
+            sorted(segment_shard(segment) for segment in os.listdir(self.spool_dir)),
+            sorted([None, 0, 1, 5], key=lambda shard: -1 if shard is None else shard))
+        # Worker 1 of 2 claims the segments for any worker, for shard 1 and
+        # for shard 5, which no longer has a worker
+        reader = SpoolReader(self.spool_dir, 1, 2)
+        replayed = []
+        while True:
+            chunk = reader.read_chunk()
+            if chunk is None:
+                break
+            replayed.extend(metric[0] for metric in chunk)
+        self.assertEqual(sorted(replayed), ['shard.1', 'shard.5', 'shard.None'])
+        self.assertEqual([segment_shard(segment) for segment in os.listdir(self.spool_dir)], [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
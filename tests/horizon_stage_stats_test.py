@@ -0,0 +1,80 @@
+import os.path
+import sys
+from threading import Event
+from time import time
+
+import unittest2 as unittest
+from mock import patch
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.join(os.path.dirname(os.path.realpath(current_dir)))
+skyline_dir = parent_dir + '/skyline'
+sys.path.append(skyline_dir)
+sys.path.append(skyline_dir + '/horizon')
+
+import stage_stats as stage_stats_module
+from stage_stats import StageStats, bucket_label
+
+
+class TestStageStats(unittest.TestCase):
+    """
+    Test the Horizon stage latency and throughput aggregation
+    """
+
+    def test_histogram_and_percentiles(self):
+        stage_stats = StageStats('horizon', 'skyline.horizon.worker.0', ['redis_flush'], 60)
+        for i in range(98):
+            stage_stats.record('redis_flush', 0.0005, 10)
+        stage_stats.record('redis_flush', 0.05, 10)
+        stage_stats.record('redis_flush', 20.0, 10)
+        metrics = dict(stage_stats.graphite_metrics(10))
+        namespace = 'skyline.horizon.worker.0.redis_flush'
+        self.assertEqual(metrics['%s.calls' % namespace], 100)
+        self.assertEqual(metrics['%s.items' % namespace], 1000)
+        self.assertEqual(metrics['%s.items_per_second' % namespace], '100.00')
+        self.assertEqual(metrics['%s.latency_le_0_001' % namespace], 98)
+        self.assertEqual(metrics['%s.latency_le_0_1' % namespace], 1)
+        self.assertEqual(metrics['%s.latency_le_inf' % namespace], 1)
+        self.assertEqual(metrics['%s.latency_p50' % namespace], '0.001000')
+        self.assertEqual(metrics['%s.latency_p99' % namespace], '0.100000')
+        self.assertEqual(metrics['%s.latency_max' % namespace], '20.000000')
+        stage_stats.reset()
+        self.assertEqual(dict(stage_stats.graphite_metrics(10))['%s.calls' % namespace], 0)
+
+    def test_send_does_not_wait_for_graphite(self):
+        stage_stats = StageStats('horizon', 'skyline.horizon.listen.0', ['socket_read'], 60)
+        sending = Event()
+        sent = Event()
+        unreachable = Event()
+
+        def send_graphite_metrics(skyline_app, metrics):
+            sending.set()
+            unreachable.wait(10)
+            sent.set()
+            return False
+
+        with patch.object(stage_stats_module, 'send_graphite_metrics', send_graphite_metrics):
+            start = time()
+            for i in range(3):
+                stage_stats.last_sent -= 60
+                stage_stats.record('socket_read', 0.001, 1)
+                queued = stage_stats.send_if_due()
+                if i == 0:
+                    self.assertTrue(queued)
+                    self.assertTrue(sending.wait(5))
+            self.assertTrue(time() - start < 1)
+            # One batch is being sent and one is waiting, so the third is
+            # dropped and counted in the next batch
+            self.assertFalse(queued)
+            self.assertEqual(stage_stats.counters, {'dropped_metric_batches': 1})
+            unreachable.set()
+            self.assertTrue(sent.wait(5))
+
+    def test_bucket_label(self):
+        self.assertEqual(bucket_label(0.0001), '0_0001')
+        self.assertEqual(bucket_label(10), '10')
+        self.assertEqual(bucket_label(None), 'inf')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os.path
+import random
+import sys
+
+import numpy as np
+import pandas
+import unittest2 as unittest
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.join(os.path.dirname(os.path.realpath(current_dir)))
+skyline_dir = parent_dir + '/skyline'
+sys.path.append(skyline_dir)
+sys.path.append(skyline_dir + '/analyzer')
+
+from incremental_state import IncrementalState
+
+
+class DictRedis(object):
+    """
+    The get and setex of a StrictRedis, in a dict
+    """
+
+    def __init__(self):
+        self.keys = {}
+
+    def get(self, key):
+        return self.keys.get(key)
+
+    def setex(self, key, expire, value):
+        self.keys[key] = value
+
+
+class TestIncrementalState(unittest.TestCase):
+    """
+    Test that the ewm state kept between runs gives the pandas ewm mean and
+    std of the timeseries
+    """
+
+    def assert_pandas_ewm(self, incremental_state, timestamps, values):
+        mean, std = incremental_state.moving_average(timestamps, values)
+        moving = pandas.Series(values).ewm(ignore_na=False, min_periods=0, adjust=True, com=50)
+        self.assertAlmostEqual(mean, moving.mean().iat[-1], delta=abs(mean) * 1e-9)
+        self.assertAlmostEqual(std, moving.std(bias=False).iat[-1], delta=std * 1e-9)
+
+    def test_runs_fold_in_new_and_drop_expired_datapoints(self):
+        random.seed(1)
+        values = np.array([1000.0 + random.gauss(0, 10) for i in range(2000)])
+        timestamps = np.arange(2000, dtype=np.float64) * 60
+        redis_conn = DictRedis()
+        incremental_state = IncrementalState(redis_conn, 'test.metric')
+        for start, end in ((0, 1000), (1, 1001), (3, 1004), (70, 1080), (70, 1080), (200, 2000)):
+            self.assert_pandas_ewm(incremental_state, timestamps[start:end], values[start:end])
+        blocks = incremental_state.load()
+        self.assertEqual(blocks[:, 2].sum(), 1800)
+        # A datapoint removed from the middle of the timeseries does not match
+        # the blocks, which are made again
+        kept = np.ones(1800, dtype=bool)
+        kept[900] = False
+        self.assert_pandas_ewm(incremental_state, timestamps[200:][kept], values[200:][kept])
+        self.assertEqual(incremental_state.load()[:, 2].sum(), 1799)
+
+    def test_timestamps_that_are_not_in_order_are_not_handled(self):
+        incremental_state = IncrementalState(DictRedis(), 'test.metric')
+        timestamps = np.array([60.0, 0.0, 120.0])
+        self.assertIsNone(incremental_state.moving_average(timestamps, np.ones(3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os.path
+import sys
+
+import unittest2 as unittest
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.join(os.path.dirname(os.path.realpath(current_dir)))
+skyline_dir = parent_dir + '/skyline'
+sys.path.append(skyline_dir)
+
+from namespace_matcher import NamespaceMatcher
+
+
+def original_in_skip_list(metric_name, skip_list, do_not_skip_list):
+    """
+    The original Horizon worker in_skip_list loop
+    """
+    metric_namespace_elements = metric_name.split('.')
+    process_metric = True
+    for to_skip in skip_list:
+        if to_skip in metric_name:
+            process_metric = False
+            break
+        to_skip_namespace_elements = to_skip.split('.')
+        elements_matched = set(metric_namespace_elements) & set(to_skip_namespace_elements)
+        if len(elements_matched) == len(to_skip_namespace_elements):
+            process_metric = False
+            break
+    if not process_metric:
+        for do_not_skip in do_not_skip_list:
+            if do_not_skip in metric_name:
+                process_metric = True
+                break
+            do_not_skip_namespace_elements = do_not_skip.split('.')
+            elements_matched = set(metric_namespace_elements) & set(do_not_skip_namespace_elements)
+            if len(elements_matched) == len(do_not_skip_namespace_elements):
+                process_metric = True
+                break
+    return not process_metric
+
+
+class TestNamespaceMatcher(unittest.TestCase):
+    """
+    Test the NamespaceMatcher gives the same decisions as the original SKIP_LIST
+    and DO_NOT_SKIP_LIST loops
+    """
+
+    skip_list = [
+        'skyline.analyzer.', 'skyline.boundary.', '_90', '.lower',
+        'skyline.analyzer.algorithm_breakdown', 'a.a', 'stats.timers']
+    do_not_skip_list = ['skyline.analyzer.run_time', 'total_anomalies']
+    metrics = [
+        'skyline.analyzer.run_time', 'skyline.analyzer.skyline-1.run_time',
+        'skyline.analyzer.skyline-1.total_anomalies',
+        'skyline.analyzer.skyline-1.algorithm_breakdown.ks_test.timing.times_run',
+        'skyline.horizon.queue_size', 'stats.web.timers.response_90',
+        'stats.web.timers.response.lower', 'stats.timers.web.response',
+        'a.a', 'a.b.a', 'web.request.count', 'skyline.analyzer', '',
+        'analyzer.skyline.x.', 'algorithm_breakdown.skyline.analyzer.x']
+
+    def test_matches_original_skip_list_decisions(self):
+        matcher = NamespaceMatcher(self.skip_list, self.do_not_skip_list)
+        for metric in self.metrics:
+            self.assertEqual(
+                matcher.match(metric),
+                original_in_skip_list(metric, self.skip_list, self.do_not_skip_list),
+                msg=metric)
+
+    def test_cache_is_bounded(self):
+        matcher = NamespaceMatcher(self.skip_list, cache_size=5)
+        for metric in self.metrics:
+            matcher.match(metric)
+            self.assertTrue(len(matcher.cache) <= 5)
+
+    def test_empty_list_matches_nothing(self):
+        matcher = NamespaceMatcher([])
+        self.assertFalse(matcher.match('skyline.analyzer.run_time'))
+
+
+if __name__ == '__main__':
+    unittest.main()
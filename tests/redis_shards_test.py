@@ -0,0 +1,110 @@
+import os.path
+import sys
+
+import unittest2 as unittest
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.join(os.path.dirname(os.path.realpath(current_dir)))
+skyline_dir = parent_dir + '/skyline'
+sys.path.append(skyline_dir)
+
+import settings
+from redis_shards import RedisShards, ShardedPipelineError
+
+
+class FakePipeline(object):
+    """
+    A pipeline that queues the append commands and fails if its Redis is down
+    """
+
+    def __init__(self, redis_conn):
+        self.redis_conn = redis_conn
+        self.commands = []
+
+    def append(self, key, value):
+        self.commands.append((key, value))
+
+    def execute(self):
+        if self.redis_conn.down:
+            raise IOError('Redis is down')
+        self.redis_conn.written.extend(self.commands)
+        results = [True] * len(self.commands)
+        self.commands = []
+        return results
+
+    def reset(self):
+        self.commands = []
+
+
+class FakeRedis(object):
+
+    def __init__(self, down=False):
+        self.down = down
+        self.written = []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def ping(self):
+        if self.down:
+            raise IOError('Redis is down')
+        return True
+
+
+class TestRedisShards(unittest.TestCase):
+    """
+    Test the consistent hashing of the metric keys to the Redis shards, the
+    StrictRedis connections are lazy so no Redis is needed
+    """
+
+    metrics = ['stats.host-%d.cpu.%d' % (i, j) for i in range(50) for j in range(20)]
+
+    def test_full_and_mini_keys_are_on_the_same_shard(self):
+        redis_shards = RedisShards(['/tmp/shard-0.sock', '/tmp/shard-1.sock', '/tmp/shard-2.sock'])
+        for metric in self.metrics:
+            shard = redis_shards.shard(metric)
+            self.assertEqual(redis_shards.shard(settings.FULL_NAMESPACE + metric), shard)
+            self.assertEqual(redis_shards.shard(settings.MINI_NAMESPACE + metric), shard)
+        self.assertEqual(
+            set(redis_shards.shard(metric) for metric in self.metrics), set([0, 1, 2]))
+
+    def test_adding_a_shard_only_moves_its_share(self):
+        socket_paths = ['/tmp/shard-0.sock', '/tmp/shard-1.sock', '/tmp/shard-2.sock']
+        three = RedisShards(socket_paths)
+        four = RedisShards(socket_paths + ['/tmp/shard-3.sock'])
+        moved = 0
+        for metric in self.metrics:
+            if three.shard(metric) != four.shard(metric):
+                moved += 1
+                # Metrics only move to the new shard
+                self.assertEqual(four.shard(metric), 3)
+        self.assertTrue(0 < moved < len(self.metrics) / 2)
+
+    def test_order_of_the_shards_does_not_matter(self):
+        forward = RedisShards(['/tmp/shard-0.sock', '/tmp/shard-1.sock'])
+        backward = RedisShards(['/tmp/shard-1.sock', '/tmp/shard-0.sock'])
+        for metric in self.metrics:
+            self.assertEqual(
+                forward.socket_paths[forward.shard(metric)],
+                backward.socket_paths[backward.shard(metric)])
+
+    def test_a_shard_that_is_down_does_not_stop_the_other_shards(self):
+        redis_shards = RedisShards(['/tmp/shard-0.sock', '/tmp/shard-1.sock', '/tmp/shard-2.sock'])
+        redis_shards.connections = [FakeRedis(down=True), FakeRedis(), FakeRedis()]
+        self.assertEqual(redis_shards.ping(), [0])
+        pipe = redis_shards.pipeline()
+        for flush in range(3):
+            for metric in self.metrics:
+                pipe.append(settings.FULL_NAMESPACE + metric, b'datapoint')
+            with self.assertRaises(ShardedPipelineError) as context:
+                pipe.execute()
+            self.assertEqual(context.exception.failed_shards, [0])
+            # The commands of the shard that failed are not queued again
+            self.assertEqual([len(shard_pipe.commands) for shard_pipe in pipe.pipes], [0, 0, 0])
+        written = sum(len(redis_conn.written) for redis_conn in redis_shards.connections)
+        on_shard_0 = len([metric for metric in self.metrics if redis_shards.shard(metric) == 0])
+        self.assertEqual(written, 3 * (len(self.metrics) - on_shard_0))
+
+
+if __name__ == '__main__':
+    unittest.main()
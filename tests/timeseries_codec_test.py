@@ -0,0 +1,64 @@
+import os.path
+import sys
+
+import unittest2 as unittest
+from msgpack import packb
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.join(os.path.dirname(os.path.realpath(current_dir)))
+skyline_dir = parent_dir + '/skyline'
+sys.path.append(skyline_dir)
+
+from timeseries_codec import (
+    GORILLA_BLOCK_POINTS, decode_timeseries, decode_timeseries_array,
+    encode_timeseries, get_datapoint_encoder)
+
+
+class TestTimeseriesCodec(unittest.TestCase):
+    """
+    Test the Redis metric key timeseries codec
+    """
+
+    timeseries = [(1500000000 + (i * 60), float(i) * 1.5) for i in range(20)]
+
+    def test_msgpack_key_is_unchanged(self):
+        appended = b''.join(packb(datapoint) for datapoint in self.timeseries)
+        self.assertEqual(encode_timeseries(self.timeseries, 'msgpack'), appended)
+        self.assertEqual(decode_timeseries(appended), self.timeseries)
+        # The single value format
+        self.assertEqual(decode_timeseries(packb(1500000000)), [1500000000])
+
+    def test_binary_and_mixed_keys(self):
+        encode_datapoint = get_datapoint_encoder('binary')
+        binary = b''.join(encode_datapoint(datapoint) for datapoint in self.timeseries)
+        self.assertEqual(binary, encode_timeseries(self.timeseries, 'binary'))
+        self.assertEqual(decode_timeseries(binary), self.timeseries)
+        self.assertEqual(type(decode_timeseries(binary)[0][0]), int)
+        array = decode_timeseries_array(binary)
+        self.assertEqual(array.shape, (20, 2))
+        self.assertEqual(array[3].tolist(), [1500000180.0, 4.5])
+        # A key written with msgpack and then binary records
+        mixed = encode_timeseries(self.timeseries[:7], 'msgpack') + encode_timeseries(self.timeseries[7:], 'binary')
+        self.assertEqual(decode_timeseries(mixed), self.timeseries)
+        self.assertEqual(decode_timeseries_array(mixed).tolist(), array.tolist())
+
+    def test_gorilla_blocks_and_tail(self):
+        timeseries = [
+            (1500000000 + (i * 60) + (i % 3), float(i % 11))
+            for i in range(GORILLA_BLOCK_POINTS + 30)]
+        gorilla = encode_timeseries(timeseries, 'gorilla')
+        self.assertLess(len(gorilla), len(encode_timeseries(timeseries, 'msgpack')) // 2)
+        self.assertEqual(decode_timeseries(gorilla), timeseries)
+        # The binary tail appended by the workers
+        appended = gorilla + encode_timeseries(self.timeseries, 'binary')
+        self.assertEqual(decode_timeseries(appended), timeseries + self.timeseries)
+        self.assertEqual(
+            decode_timeseries_array(appended).tolist(),
+            [[float(timestamp), value] for timestamp, value in timeseries + self.timeseries])
+        # Timestamps that are not integral are not sealed
+        fractional = [(timestamp + 0.5, value) for timestamp, value in self.timeseries]
+        self.assertEqual(decode_timeseries(encode_timeseries(fractional, 'gorilla')), fractional)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 from __future__ import division
 import redis
-import msgpack
+# @modified 20261018 - Binary timeseries codec
+# import msgpack
 import sys
 import time
 from os.path import dirname, abspath
@@ -8,6 +9,9 @@ from os.path import dirname, abspath
 # add the shared settings file to namespace
 sys.path.insert(0, ''.join((dirname(dirname(abspath(__file__))), "")))
 from skyline import settings
+# @added 20261018 - Binary timeseries codec
+sys.path.insert(0, ''.join((dirname(dirname(abspath(__file__))), "/skyline")))
+from timeseries_codec import decode_timeseries
 
 metric = 'horizon.test.udp'
 
@@ -23,9 +27,11 @@ def check_continuity(metric, mini=False):
         print 'key not found at %s ' + metric
         return 0, 0, 0, 0, 0
 
-    unpacker = msgpack.Unpacker()
-    unpacker.feed(raw_series)
-    timeseries = list(unpacker)
+    # @modified 20261018 - Binary timeseries codec
+    # unpacker = msgpack.Unpacker()
+    # unpacker.feed(raw_series)
+    # timeseries = list(unpacker)
+    timeseries = decode_timeseries(raw_series)
     length = len(timeseries)
 
     start = time.ctime(int(timeseries[0][0]))
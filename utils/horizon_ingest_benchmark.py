@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+"""
+Benchmark the Horizon ingest end to end.
+
+Starts Horizon Listen and Worker processes, as the Horizon agent does, with
+the Redis settings of settings.py or --redis-socket, and load generator
+processes that send synthetic metrics to the listeners over pickle, UDP and
+the plaintext line protocol.  Each sender sends one datapoint for each of its
+metrics per round, the timestamps advancing by --resolution seconds a round.
+
+When the --duration has elapsed the senders are stopped and the workers are
+given until the queue has drained, up to --drain-timeout seconds, to finish.
+The datapoints stored in the ``<FULL_NAMESPACE>benchmark.*`` keys are then
+counted and the keys are removed, unless --keep is passed.
+
+The report is json, to stdout or --output, with:
+
+- ``sent``, ``stored``, ``dropped`` and ``drop_rate`` - the datapoints sent
+  per protocol and in total, stored in Redis and lost
+- ``datapoints_per_second`` - the sustained ingest rate, the datapoints
+  stored divided by the time from the start until the queue drained
+- ``queue_depth`` - the max and mean number of chunks on the queues
+- ``redis_commands_per_second`` - from the Redis total_commands_processed
+- ``cpu`` - the cpu seconds and percent of a core of each process, from
+  /proc on Linux
+- ``samples`` - the queue depth, Redis commands per second and datapoints
+  sent per second for each --interval
+
+If --min-datapoints-per-second or --max-drop-rate are passed and the run does
+not meet them the exit code is 1, so that ingest regressions can be caught
+before a deployment.  Use a dedicated local redis-server, the benchmark writes
+to and removes keys in the Redis of the settings.
+
+Usage:
+
+    python utils/horizon_ingest_benchmark.py --metrics 10000 --duration 30
+    python utils/horizon_ingest_benchmark.py -p pickle -p line --workers 4 \\
+        --metrics 100000 --rate 50000 --output report.json \\
+        --min-datapoints-per-second 40000 --max-drop-rate 0.001
+"""
+
+from __future__ import division, print_function
+import argparse
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+from os.path import dirname, join, realpath
+from multiprocessing import Process, Value
+from time import sleep, time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from msgpack import packb
+
+__location__ = realpath(join(os.getcwd(), dirname(__file__)))
+sys.path.insert(0, join(__location__, '..', 'skyline'))
+sys.path.insert(0, join(__location__, '..', 'skyline', 'horizon'))
+# ignoreErrorCodes E402
+import settings
+
+PROTOCOLS = ('pickle', 'udp', 'line')
+METRIC_PREFIX = 'benchmark'
+# The datapoints per pickle, datagram and line send
+PICKLE_BATCH_SIZE = 500
+UDP_BATCH_SIZE = 50
+LINE_BATCH_SIZE = 500
+# How long the Redis commands per second must stay below this, and the queue
+# empty, for the ingest to be considered drained
+DRAIN_IDLE_SAMPLES = 2
+DRAIN_IDLE_COMMANDS_PER_SECOND = 10
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def process_cpu_seconds(pid):
+    """
+    The user and system cpu seconds of a process from /proc, ``None`` if they
+    are not available.
+    """
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            # The fields after the process name, which can contain spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def metric_names(protocol, sender, metrics):
+    return ['%s.%s.%d.%d' % (METRIC_PREFIX, protocol, sender, n) for n in range(metrics)]
+
+
+def send_pickle(sock, datapoints):
+    payload = pickle.dumps(datapoints, protocol=2)
+    sock.sendall(struct.pack('!I', len(payload)) + payload)
+
+
+def send_udp(sock, datapoints):
+    for start in range(0, len(datapoints), UDP_BATCH_SIZE):
+        datagram = packb([[metric, list(datapoint)] for metric, datapoint in datapoints[start:start + UDP_BATCH_SIZE]])
+        try:
+            sock.send(datagram)
+        except socket.error:
+            # A full socket buffer, the datapoints are counted as dropped
+            pass
+
+
+def send_line(sock, datapoints):
+    sock.sendall(''.join(
+        '%s %s %d\n' % (metric, repr(datapoint[1]), datapoint[0])
+        for metric, datapoint in datapoints).encode('utf-8'))
+
+
+def sender(protocol, port, number, metrics, rate, resolution, sent, stop):
+    """
+    Send a datapoint for each of the metrics every round until stopped.
+
+    :param rate: the datapoints per second to send at, 0 for as fast as
+        possible
+    :param sent: the multiprocessing Value to count the datapoints sent in
+    :param stop: the multiprocessing Value that is set to stop sending
+    """
+    if protocol == 'udp':
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect(('127.0.0.1', port))
+        send = send_udp
+        batch_size = UDP_BATCH_SIZE * 10
+    else:
+        sock = socket.create_connection(('127.0.0.1', port))
+        if protocol == 'pickle':
+            send = send_pickle
+            batch_size = PICKLE_BATCH_SIZE
+        else:
+            send = send_line
+            batch_size = LINE_BATCH_SIZE
+    names = metric_names(protocol, number, metrics)
+    timestamp = int(time())
+    started = time()
+    count = 0
+    round_number = 0
+    while not stop.value:
+        for start in range(0, len(names), batch_size):
+            if stop.value:
+                break
+            datapoints = [
+                (metric, (timestamp, float((round_number + index) % 100)))
+                for index, metric in enumerate(names[start:start + batch_size])]
+            send(sock, datapoints)
+            count += len(datapoints)
+            with sent.get_lock():
+                sent.value += len(datapoints)
+            if rate:
+                ahead = (count / rate) - (time() - started)
+                if ahead > 0:
+                    sleep(ahead)
+        round_number += 1
+        timestamp += resolution
+    sock.close()
+
+
+def count_stored(redis_conn, decode_timeseries, delete):
+    """
+    The number of datapoints in the benchmark keys, removing the keys if
+    delete is True.
+    """
+    stored = 0
+    keys = 0
+    unique_metrics = '%sunique_metrics' % settings.FULL_NAMESPACE
+    batch = []
+    scan_keys = redis_conn.scan_iter(match='%s%s.*' % (settings.FULL_NAMESPACE, METRIC_PREFIX), count=1000)
+    while True:
+        key = next(scan_keys, None)
+        if key is not None:
+            batch.append(key)
+        if batch and (key is None or len(batch) == 1000):
+            for raw_series in redis_conn.mget(batch):
+                if raw_series is not None:
+                    stored += len(decode_timeseries(raw_series))
+            keys += len(batch)
+            if delete:
+                pipe = redis_conn.pipeline(transaction=False)
+                pipe.delete(*batch)
+                pipe.srem(unique_metrics, *batch)
+                pipe.execute()
+            batch = []
+        if key is None:
+            break
+    return stored, keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Horizon ingest benchmark.')
+    parser.add_argument(
+        '-p', '--protocol', action='append', choices=PROTOCOLS,
+        help='a protocol to send with, can be given more than once, defaults to all')
+    parser.add_argument('-m', '--metrics', type=int, default=10000, help='the number of metrics per protocol')
+    parser.add_argument('-d', '--duration', type=int, default=30, help='the seconds to send for')
+    parser.add_argument('-r', '--rate', type=int, default=0, help='the datapoints per second per protocol, 0 for as fast as possible')
+    parser.add_argument('--senders', type=int, default=1, help='the sender processes per protocol')
+    parser.add_argument('--resolution', type=int, default=60, help='the seconds between the datapoints of a metric')
+    parser.add_argument('--workers', type=int, default=settings.WORKER_PROCESSES, help='the Worker processes')
+    parser.add_argument('--listen-processes', type=int, default=1, help='the Listen processes per protocol')
+    parser.add_argument('--pickle-port', type=int, default=settings.PICKLE_PORT)
+    parser.add_argument('--udp-port', type=int, default=settings.UDP_PORT)
+    parser.add_argument('--line-port', type=int, default=getattr(settings, 'LINE_PORT', None) or 2023)
+    parser.add_argument('--redis-socket', default=settings.REDIS_SOCKET_PATH, help='the Redis unix socket')
+    parser.add_argument('--interval', type=float, default=1, help='the seconds between samples')
+    parser.add_argument('--drain-timeout', type=int, default=60, help='the seconds to wait for the queue to drain')
+    parser.add_argument('--log', default=os.devnull, help='the file to write the Horizon log to')
+    parser.add_argument('--keep', action='store_true', help='do not remove the benchmark keys')
+    parser.add_argument('--output', help='the file to write the json report to, defaults to stdout')
+    parser.add_argument('--min-datapoints-per-second', type=float, help='fail if the ingest rate is lower')
+    parser.add_argument('--max-drop-rate', type=float, help='fail if the drop rate is higher')
+    args = parser.parse_args()
+    protocols = args.protocol or list(PROTOCOLS)
+
+    # Settings for the benchmark, set before Horizon is imported as the
+    # modules read them on import
+    settings.REDIS_SOCKET_PATH = args.redis_socket
+    settings.GRAPHITE_HOST = ''
+    settings.HORIZON_IP = '127.0.0.1'
+    settings.HORIZON_SPOOL_DIR = None
+    settings.WORKER_PROCESSES = args.workers
+
+    # ignoreErrorCodes E402
+    from agent import Horizon
+    from listen import Listen
+    from worker import Worker
+    from redis import StrictRedis
+    from timeseries_codec import decode_timeseries
+
+    logger = logging.getLogger('horizonLog')
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.FileHandler(args.log))
+
+    if settings.REDIS_PASSWORD:
+        redis_conn = StrictRedis(password=settings.REDIS_PASSWORD, unix_socket_path=settings.REDIS_SOCKET_PATH)
+    else:
+        redis_conn = StrictRedis(unix_socket_path=settings.REDIS_SOCKET_PATH)
+    redis_conn.ping()
+    # Remove the keys of a previous run
+    count_stored(redis_conn, decode_timeseries, True)
+
+    pid = os.getpid()
+    queue = Horizon().new_listen_queue()
+    processes = {}
+    for i in range(args.workers):
+        worker = Worker(queue, pid, True, canary=(i == 0), process_number=i)
+        worker.start()
+        processes['worker.%d' % i] = worker
+    ports = {'pickle': args.pickle_port, 'udp': args.udp_port, 'line': args.line_port}
+    for protocol in protocols:
+        for i in range(args.listen_processes):
+            listener = Listen(
+                ports[protocol], queue, pid, type=protocol,
+                reuse_port=args.listen_processes > 1, process_number=i)
+            listener.start()
+            processes['listen.%s.%d' % (protocol, i)] = listener
+    # Give the listeners time to bind
+    sleep(1)
+
+    stop = Value('b', 0)
+    sent = dict((protocol, Value('L', 0)) for protocol in protocols)
+    metrics_per_sender = max(args.metrics // args.senders, 1)
+    rate_per_sender = args.rate / args.senders
+    for protocol in protocols:
+        for i in range(args.senders):
+            process = Process(
+                target=sender, args=(
+                    protocol, ports[protocol], i, metrics_per_sender,
+                    rate_per_sender, args.resolution, sent[protocol], stop))
+            process.daemon = True
+            process.start()
+            processes['sender.%s.%d' % (protocol, i)] = process
+
+    def queue_depth():
+        try:
+            return queue.qsize()
+        except NotImplementedError:
+            return None
+
+    def redis_commands():
+        return int(redis_conn.info('stats')['total_commands_processed'])
+
+    cpu_start = dict((name, process_cpu_seconds(process.pid)) for name, process in processes.items())
+    commands_start = redis_commands()
+    started = time()
+    samples = []
+    last_sample = started
+    last_commands = commands_start
+    last_sent = 0
+    idle_samples = 0
+    sending_finished = None
+    while True:
+        sleep(args.interval)
+        now = time()
+        commands = redis_commands()
+        total_sent = sum(value.value for value in sent.values())
+        depth = queue_depth()
+        commands_per_second = (commands - last_commands) / (now - last_sample)
+        samples.append({
+            'seconds': round(now - started, 3),
+            'queue_depth': depth,
+            'redis_commands_per_second': int(commands_per_second),
+            'sent_datapoints_per_second': int((total_sent - last_sent) / (now - last_sample)),
+        })
+        last_sample = now
+        last_commands = commands
+        last_sent = total_sent
+        if sending_finished is None:
+            if now - started >= args.duration:
+                stop.value = 1
+                sending_finished = now
+            continue
+        if not depth and commands_per_second < DRAIN_IDLE_COMMANDS_PER_SECOND:
+            idle_samples += 1
+        else:
+            idle_samples = 0
+        if idle_samples >= DRAIN_IDLE_SAMPLES or now - sending_finished >= args.drain_timeout:
+            break
+
+    # The ingest finished at the last sample with Redis commands
+    drained = started
+    for sample in samples:
+        if sample['redis_commands_per_second'] >= DRAIN_IDLE_COMMANDS_PER_SECOND:
+            drained = started + sample['seconds']
+    ingest_seconds = max(drained - started, args.interval)
+    cpu = {}
+    for name, process in processes.items():
+        cpu_end = process_cpu_seconds(process.pid)
+        if cpu_end is None or cpu_start[name] is None:
+            cpu[name] = None
+            continue
+        cpu[name] = {
+            'cpu_seconds': round(cpu_end - cpu_start[name], 3),
+            'cpu_percent': round(100 * (cpu_end - cpu_start[name]) / (time() - started), 1),
+        }
+    commands_total = redis_commands() - commands_start
+
+    for process in processes.values():
+        process.terminate()
+    stored, keys = count_stored(redis_conn, decode_timeseries, not args.keep)
+
+    sent_total = sum(value.value for value in sent.values())
+    depths = [sample['queue_depth'] for sample in samples if sample['queue_depth'] is not None]
+    report = {
+        'settings': {
+            'protocols': protocols,
+            'metrics': args.metrics,
+            'senders': args.senders,
+            'duration': args.duration,
+            'rate': args.rate,
+            'resolution': args.resolution,
+            'workers': args.workers,
+            'listen_processes': args.listen_processes,
+            'chunk_size': settings.CHUNK_SIZE,
+            'max_queue_size': settings.MAX_QUEUE_SIZE,
+            'transport': getattr(settings, 'HORIZON_TRANSPORT', 'queue'),
+            'timeseries_codec': getattr(settings, 'TIMESERIES_CODEC', 'msgpack'),
+            'python_version': sys.version.split()[0],
+        },
+        'sent': dict((protocol, value.value) for protocol, value in sent.items()),
+        'sent_total': sent_total,
+        'stored': stored,
+        'keys': keys,
+        'dropped': max(sent_total - stored, 0),
+        'drop_rate': round(max(sent_total - stored, 0) / sent_total, 6) if sent_total else 0,
+        'ingest_seconds': round(ingest_seconds, 3),
+        'datapoints_per_second': int(stored / ingest_seconds),
+        'queue_depth': {
+            'max': max(depths) if depths else None,
+            'mean': round(sum(depths) / len(depths), 1) if depths else None,
+        },
+        'redis_commands_per_second': int(commands_total / ingest_seconds),
+        'cpu': cpu,
+        'samples': samples,
+    }
+
+    failures = []
+    if args.min_datapoints_per_second is not None and report['datapoints_per_second'] < args.min_datapoints_per_second:
+        failures.append('datapoints_per_second %s is less than %s' % (
+            report['datapoints_per_second'], args.min_datapoints_per_second))
+    if args.max_drop_rate is not None and report['drop_rate'] > args.max_drop_rate:
+        failures.append('drop_rate %s is more than %s' % (report['drop_rate'], args.max_drop_rate))
+    report['failures'] = failures
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    for failure in failures:
+        print('error :: %s' % failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,6 +22,8 @@ __location__ = realpath(join(os.getcwd(), dirname(__file__)))
 sys.path.insert(0, join(__location__, '..', 'skyline'))
 # ignoreErrorCodes E402
 import settings
+# @added 20261018 - Binary timeseries codec
+from timeseries_codec import decode_timeseries
 
 
 class NoDataException(Exception):
@@ -177,9 +179,11 @@ def seed():
         # @added 20180823 - Bug #2552: seed_data.py testing with UDP does not work
         #                   seed_data.py testing with UDP does not work GH77
         else:
-            unpacker = msgpack.Unpacker(use_list=False)
-            unpacker.feed(x)
-            timeseries = list(unpacker)
+            # @modified 20261018 - Binary timeseries codec
+            # unpacker = msgpack.Unpacker(use_list=False)
+            # unpacker.feed(x)
+            # timeseries = list(unpacker)
+            timeseries = decode_timeseries(x)
             print 'info :: %s%s key exists and the time series has %s data points' % (
                 settings.FULL_NAMESPACE, metric, str(len(timeseries)))
 
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Benchmark the timeseries codecs on utils/data.json style series.
+
+For each codec this reports the bytes per datapoint of the metric key data and
+the decode throughput in datapoints per second, to a list of tuples with
+decode_timeseries and to a numpy array with decode_timeseries_array.  The
+series are the ``results`` of the json files, cut into FULL_DURATION long
+windows as they would be in the FULL_NAMESPACE keys.
+
+Usage:
+
+    python utils/timeseries_codec_benchmark.py
+    python utils/timeseries_codec_benchmark.py -f utils/data.json -n 200 --json
+"""
+
+from __future__ import division, print_function
+import argparse
+import json
+import os
+import sys
+from os.path import dirname, join, realpath
+import timeit
+
+__location__ = realpath(join(os.getcwd(), dirname(__file__)))
+sys.path.insert(0, join(__location__, '..', 'skyline'))
+# ignoreErrorCodes E402
+import settings
+from timeseries_codec import decode_timeseries, decode_timeseries_array, encode_timeseries
+
+CODECS = ('msgpack', 'binary', 'gorilla')
+
+
+def load_series(paths, duration):
+    """
+    The FULL_DURATION windows of the series in data.json style files.
+    """
+    windows = []
+    for path in paths:
+        with open(path) as f:
+            results = json.load(f)['results']
+        timeseries = []
+        for timestamp, value in results:
+            if float(timestamp).is_integer():
+                timestamp = int(timestamp)
+            timeseries.append((timestamp, float(value)))
+        start = 0
+        while start < len(timeseries):
+            first_timestamp = timeseries[start][0]
+            end = start
+            while end < len(timeseries) and timeseries[end][0] < first_timestamp + duration:
+                end += 1
+            windows.append(timeseries[start:end])
+            start = end
+    return windows
+
+
+def benchmark(windows, codec, number):
+    """
+    The bytes per datapoint and the decode throughput of a codec.
+    """
+    datapoints = sum(len(timeseries) for timeseries in windows)
+    keys = [encode_timeseries(timeseries, codec) for timeseries in windows]
+    for raw_series, timeseries in zip(keys, windows):
+        if decode_timeseries(raw_series) != timeseries:
+            raise ValueError('%s does not decode to the encoded timeseries' % codec)
+
+    def decode_list():
+        for raw_series in keys:
+            decode_timeseries(raw_series)
+
+    def decode_array():
+        for raw_series in keys:
+            decode_timeseries_array(raw_series)
+
+    list_seconds = min(timeit.repeat(decode_list, number=number, repeat=3))
+    array_seconds = min(timeit.repeat(decode_array, number=number, repeat=3))
+    return {
+        'codec': codec,
+        'keys': len(keys),
+        'datapoints': datapoints,
+        'bytes': sum(len(raw_series) for raw_series in keys),
+        'bytes_per_datapoint': round(sum(len(raw_series) for raw_series in keys) / datapoints, 3),
+        'decode_list_datapoints_per_second': int(datapoints * number / list_seconds),
+        'decode_array_datapoints_per_second': int(datapoints * number / array_seconds),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Timeseries codec benchmark.')
+    parser.add_argument(
+        '-f', '--file', action='append',
+        help='a data.json style file, can be given more than once, defaults to utils/data.json')
+    parser.add_argument(
+        '-d', '--duration', type=int, default=settings.FULL_DURATION,
+        help='the length of the series in seconds, defaults to FULL_DURATION')
+    parser.add_argument(
+        '-n', '--number', type=int, default=100,
+        help='the number of times to decode the series')
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    args = parser.parse_args()
+
+    windows = load_series(args.file or [join(__location__, 'data.json')], args.duration)
+    results = [benchmark(windows, codec, args.number) for codec in CODECS]
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        msgpack_result = results[0]
+        print('%-8s %12s %18s %18s' % ('codec', 'bytes/point', 'list points/s', 'array points/s'))
+        for result in results:
+            print('%-8s %12.2f %18d %18d   %.1fx smaller, %.1fx faster array decode than msgpack' % (
+                result['codec'], result['bytes_per_datapoint'],
+                result['decode_list_datapoints_per_second'],
+                result['decode_array_datapoints_per_second'],
+                msgpack_result['bytes'] / result['bytes'],
+                result['decode_array_datapoints_per_second'] / msgpack_result['decode_array_datapoints_per_second']))